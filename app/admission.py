@@ -0,0 +1,250 @@
+# app/admission.py
+"""
+Admission control перед вызовами OpenAI.
+
+Оценка стоимости запроса в токенах — estimate_cost: промпт + картинка
+(по размеру файла) + ожидаемый ответ по length.
+
+Два уровня:
+- ClientLimiter — token bucket на клиента (X-API-Key из списка
+  ADMISSION_API_KEYS, иначе IP):
+  ADMISSION_CLIENT_TPM токенов в минуту, проверяется на входе в ручку,
+  до обработки картинки;
+- GlobalBudget — общий бюджет токенов в минуту под лимиты OpenAI
+  (ADMISSION_GLOBAL_TPM), берётся прямо перед вызовом модели, поэтому
+  ответы из кэша его не тратят. Ожидающие стоят в очередях по приоритету
+  (interactive > batch > background); если прогнозное ожидание больше
+  допустимого для очереди — сразу отказ с Retry-After, а не таймаут
+  через минуту.
+
+Очередь запроса задаётся через contextvar current_lane в ручке; задачи,
+созданные из неё (asyncio.gather, стрим), наследуют значение.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+from fastapi import Request
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+ADMISSION_ENABLED = _env_bool("ADMISSION_ENABLED", "1")
+ADMISSION_CLIENT_TPM = int(os.getenv("ADMISSION_CLIENT_TPM", "200000"))
+ADMISSION_GLOBAL_TPM = int(os.getenv("ADMISSION_GLOBAL_TPM", "2000000"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "100000"))
+ADMISSION_TRUST_FORWARDED = _env_bool("ADMISSION_TRUST_FORWARDED", "0")
+# известные ключи через запятую; неизвестный X-API-Key лимитируется по IP
+ADMISSION_API_KEYS = frozenset(
+    key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()
+)
+
+# приоритет по порядку и сколько секунд запрос может ждать бюджет
+LANES = ("interactive", "batch", "background")
+LANE_MAX_WAIT = {
+    "interactive": float(os.getenv("ADMISSION_WAIT_INTERACTIVE", "2")),
+    "batch": float(os.getenv("ADMISSION_WAIT_BATCH", "15")),
+    "background": float(os.getenv("ADMISSION_WAIT_BACKGROUND", "120")),
+}
+
+# грубая оценка токенов: статичный промпт + суффикс, картинка, ответ
+PROMPT_TOKENS = 1200
+IMAGE_TOKENS_PER_TILE = 5700  # gpt-4o-mini, high detail, тайл 512x512
+IMAGE_TOKENS_BASE = 2800
+OUTPUT_TOKENS = {
+    "Short": 300,
+    "Medium": 450,
+    "Long": 800,
+    "VeryLong": 2500,
+}
+
+current_lane: ContextVar[str] = ContextVar("admission_lane", default="background")
+
+
+class Rejected(Exception):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def estimate_image_tokens(image_bytes: int | None) -> int:
+    """
+    Картинка всё равно ужимается до IMAGE_MAX_EDGE, так что по размеру
+    загрузки грубо угадываем число тайлов (1..4). None — размер
+    неизвестен, считаем по максимуму; 0 — вызов без картинки.
+    """
+    if image_bytes is None:
+        tiles = 4
+    elif image_bytes <= 0:
+        return 0
+    elif image_bytes < 100 * 1024:
+        tiles = 1
+    elif image_bytes < 500 * 1024:
+        tiles = 2
+    else:
+        tiles = 4
+    return IMAGE_TOKENS_BASE + IMAGE_TOKENS_PER_TILE * tiles
+
+
+def estimate_cost(lengths: list[str] | str, image_bytes: int | None = 0) -> int:
+    """lengths — один length или по одному на вариант (картинка одна на всех)."""
+    if isinstance(lengths, str):
+        lengths = [lengths]
+    output = sum(OUTPUT_TOKENS.get(length, OUTPUT_TOKENS["Medium"]) for length in lengths)
+    return PROMPT_TOKENS + estimate_image_tokens(image_bytes) + output
+
+
+def client_id(request: Request) -> str:
+    """
+    Ключ бакета. X-API-Key никто не проверяет, поэтому свой бакет получают
+    только ключи из ADMISSION_API_KEYS — иначе перебором случайных ключей
+    лимит обходится, а LRU вытесняет бакеты настоящих клиентов.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in ADMISSION_API_KEYS:
+        return f"key:{api_key}"
+    if ADMISSION_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    host = request.client.host if request.client else "unknown"
+    return f"ip:{host}"
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, cost: float) -> bool:
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def time_until(self, cost: float) -> float:
+        """Через сколько секунд в ведре наберётся cost токенов."""
+        self._refill()
+        missing = cost - self.tokens
+        return max(missing, 0.0) / self.rate if self.rate > 0 else float("inf")
+
+
+class ClientLimiter:
+    def __init__(self, per_minute: int = ADMISSION_CLIENT_TPM, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.per_minute = per_minute
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.rejected = 0
+
+    def check(self, client: str, cost: int) -> None:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.per_minute)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)  # самый давно не появлявшийся
+        else:
+            self._buckets.move_to_end(client)
+
+        cost = min(cost, bucket.capacity)
+        if not bucket.try_take(cost):
+            self.rejected += 1
+            raise Rejected("Слишком много запросов от клиента", bucket.time_until(cost))
+
+
+class GlobalBudget:
+    def __init__(self, per_minute: int = ADMISSION_GLOBAL_TPM, max_wait: dict | None = None):
+        self.bucket = TokenBucket(per_minute)
+        self.max_wait = max_wait or LANE_MAX_WAIT
+        self._lanes: dict[str, deque] = {lane: deque() for lane in LANES}
+        self._wake = asyncio.Event()
+        self._pump_task: asyncio.Task | None = None
+        self.admitted = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+
+    def queued(self, lane: str) -> int:
+        return len(self._lanes[lane])
+
+    def _ahead(self, lane: str) -> float:
+        """Стоимость ожидающих в очередях с приоритетом не ниже lane."""
+        total = 0.0
+        for name in LANES[: LANES.index(lane) + 1]:
+            total += sum(cost for cost, fut in self._lanes[name] if not fut.done())
+        return total
+
+    async def acquire(self, cost: int, lane: str) -> None:
+        lane = lane if lane in self._lanes else LANES[-1]
+        cost = min(cost, self.bucket.capacity)
+
+        ahead = self._ahead(lane)
+        if ahead == 0 and self.bucket.try_take(cost):
+            self.admitted[lane] += 1
+            return
+
+        wait = self.bucket.time_until(ahead + cost)
+        if wait > self.max_wait[lane]:
+            self.rejected[lane] += 1
+            raise Rejected("Превышен общий бюджет токенов OpenAI", wait)
+
+        fut = asyncio.get_running_loop().create_future()
+        waiter = (cost, fut)
+        self._lanes[lane].append(waiter)
+        self._wake.set()
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump(), name="admission-pump")
+
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.max_wait[lane])
+        except asyncio.TimeoutError:
+            # обогнали более приоритетные — отказываем
+            if not fut.done():
+                fut.cancel()
+                self.rejected[lane] += 1
+                raise Rejected("Превышен общий бюджет токенов OpenAI", self.bucket.time_until(cost))
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.bucket.tokens += cost  # бюджет уже выдан — возвращаем
+            fut.cancel()
+            raise
+        self.admitted[lane] += 1
+
+    async def _pump(self) -> None:
+        try:
+            while True:
+                head = None
+                for lane in LANES:
+                    queue = self._lanes[lane]
+                    while queue and queue[0][1].done():
+                        queue.popleft()  # отменённые по таймауту
+                    if queue:
+                        head = queue
+                        break
+                if head is None:
+                    return
+
+                cost, fut = head[0]
+                if self.bucket.try_take(cost):
+                    head.popleft()
+                    fut.set_result(None)
+                    continue
+
+                # ждём пополнения ведра или нового (возможно, более приоритетного) запроса
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.bucket.time_until(cost))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._pump_task = None
@@ -0,0 +1,252 @@
+# app/cache.py
+"""
+Кэш результатов /generate.
+
+Ключ — sha256 от байтов изображения (images.hash_upload) + нормализованные
+параметры (style, length, tags_count) + версия промпта. Значение — то, что вернула
+модель: {"description": str, "tags": list[str]}.
+
+Бэкенды:
+- memory — LRU в памяти процесса с TTL и лимитом по байтам;
+- db     — поиск готовой Generation по колонке cache_key;
+- none   — кэш выключен.
+
+Тот же memory-бэкенд — read-through кэш GET /photos/{id} и
+/generations/{id} (build_read_cache, READ_CACHE_*): готовое тело ответа +
+ETag/Last-Modified. Сбрасывается при изменении и удалении; кэш свой
+у каждого процесса, поэтому TTL короткий — изменения из других
+процессов видны не позже чем через READ_CACHE_TTL секунд.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from . import db, models
+
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ITEMS = int(os.getenv("RESULT_CACHE_MAX_ITEMS", "10000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+READ_CACHE_BACKEND = os.getenv("READ_CACHE_BACKEND", "memory")
+READ_CACHE_TTL = int(os.getenv("READ_CACHE_TTL", "10"))
+READ_CACHE_MAX_ITEMS = int(os.getenv("READ_CACHE_MAX_ITEMS", "10000"))
+READ_CACHE_MAX_BYTES = int(os.getenv("READ_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+def make_key(
+    image_digest: str,
+    style: str,
+    length: str,
+    tags_count: int,
+    prompt_version: str,
+) -> str:
+    """Ключ кэша: digest картинки + нормализованные параметры + версия промпта."""
+    params = json.dumps(
+        [prompt_version, style.strip(), length, max(tags_count, 0)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(f"{image_digest}|{params}".encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "sets": self.sets,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+# ---------- MEMORY ----------
+
+
+class MemoryCacheBackend:
+    """LRU в памяти процесса: TTL + лимит по количеству и по байтам."""
+
+    blocking = False
+
+    def __init__(
+        self,
+        max_items: int = RESULT_CACHE_MAX_ITEMS,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        ttl: int = RESULT_CACHE_TTL,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._data: "OrderedDict[str, tuple[float, int, dict]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, _, value = item
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict) -> None:
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_items or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._pop(oldest)
+                self.stats.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _pop(self, key: str) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+
+# ---------- DB ----------
+
+
+class DBCacheBackend:
+    """
+    Кэш поверх таблицы generations: ищем последнюю Generation с таким же
+    cache_key. Отдельно ничего не пишем — generate() сам сохраняет
+    Generation вместе с ключом.
+    """
+
+    blocking = True
+
+    def __init__(self, ttl: int = RESULT_CACHE_TTL):
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Optional[dict]:
+        with db.SessionLocal() as session:
+            gen = (
+                session.query(models.Generation)
+                .filter(models.Generation.cache_key == key)
+                .order_by(models.Generation.id.desc())
+                .first()
+            )
+            if gen is None:
+                return None
+
+            created_at = gen.created_at
+            if created_at.tzinfo is None:
+                # SQLite отдаёт naive datetime в UTC
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            if created_at < datetime.now(timezone.utc) - timedelta(seconds=self.ttl):
+                return None
+
+            return {"description": gen.description, "tags": list(gen.tags or [])}
+
+    def set(self, key: str, value: dict) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+# ---------- ФАСАД ----------
+
+
+class ResultCache:
+    """Обёртка над бэкендом: считает попадания/промахи."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @property
+    def blocking(self) -> bool:
+        return bool(self.backend is not None and self.backend.blocking)
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.backend.stats if self.backend is not None else CacheStats()
+
+    def get(self, key: str) -> Optional[dict]:
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.backend.stats.misses += 1
+        else:
+            self.backend.stats.hits += 1
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        if self.backend is None:
+            return
+        self.backend.set(key, value)
+        self.backend.stats.sets += 1
+
+    def delete(self, key: str) -> None:
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear()
+
+
+def build_result_cache(name: str = RESULT_CACHE_BACKEND) -> ResultCache:
+    if name == "memory":
+        return ResultCache(MemoryCacheBackend())
+    if name == "db":
+        return ResultCache(DBCacheBackend())
+    if name in ("none", "off", ""):
+        return ResultCache(None)
+    raise RuntimeError(f"Неизвестный RESULT_CACHE_BACKEND: {name!r}")
+
+
+def build_read_cache(name: str = READ_CACHE_BACKEND) -> ResultCache:
+    if name == "memory":
+        return ResultCache(
+            MemoryCacheBackend(
+                max_items=READ_CACHE_MAX_ITEMS,
+                max_bytes=READ_CACHE_MAX_BYTES,
+                ttl=READ_CACHE_TTL,
+            )
+        )
+    if name in ("none", "off", ""):
+        return ResultCache(None)
+    raise RuntimeError(f"Неизвестный READ_CACHE_BACKEND: {name!r}")
@@ -1,18 +1,139 @@
 # app/crud.py
-from typing import List, Optional
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 
-from sqlalchemy.orm import Session
+import orjson
+from sqlalchemy import Text, exists, func, insert, tuple_, type_coerce
+from sqlalchemy.orm import Query, Session
 
-from . import models, schemas
+from . import dedup, models, schemas
+
+
+def _save(db: Session, commit: bool) -> None:
+    """
+    commit=True — закрываем транзакцию; commit=False — только flush
+    (id и server_default приходят через RETURNING), commit делает вызывающий.
+    refresh не нужен: сессии создаются с expire_on_commit=False.
+    """
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+
+
+# ---------- KEYSET-ПАГИНАЦИЯ ----------
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """ValueError, если курсор битый."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Невалидный cursor: {e}")
+
+
+def _keyset_page(
+    query: Query,
+    model,
+    cursor: Optional[str],
+    limit: int,
+) -> Tuple[list, Optional[str]]:
+    """
+    Страница по (created_at, id) DESC: WHERE (created_at, id) < курсор.
+    Стоимость любой страницы одинаковая — это проход по индексу, без OFFSET.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < (created_at, row_id))
+
+    rows = (
+        query.order_by(model.created_at.desc(), model.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+# ---------- ЛЁГКОЕ ЧТЕНИЕ СПИСКОВ ----------
+#
+# Списки отдают не ORM-объекты, а строки из select по нужным колонкам:
+# без identity map, без StringArray (tags разбирает orjson) и без
+# from_attributes-валидации в pydantic. Порядок полей — как в PhotoOut /
+# GenerationOut, чтобы ответ без ?fields= не менялся.
+
+PHOTO_FIELDS = ("file_path", "id", "created_at")
+GENERATION_FIELDS = ("photo_id", "description", "tags", "style", "length", "tags_count", "id", "created_at")
+
+PREVIEW_SUFFIX = "…"
+
+
+def parse_fields(fields: Optional[str], allowed: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    ?fields=id,tags -> ("tags", "id"): порядок как в allowed, пустой fields — все поля.
+    ValueError на неизвестное поле.
+    """
+    if not fields:
+        return allowed
+    wanted = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = wanted - set(allowed)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}; доступны: {', '.join(allowed)}")
+    return tuple(name for name in allowed if name in wanted)
+
+
+def _project(
+    db: Session,
+    model,
+    columns: dict,
+    fields: Tuple[str, ...],
+    cursor: Optional[str],
+    limit: int,
+    filters=(),
+    convert: Optional[dict] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Keyset-страница из колонок columns[name] для name из fields.
+    id и created_at выбираются всегда — по ним строится next_cursor.
+    convert — {поле: функция} для пост-обработки значения.
+    """
+    names = list(fields) + [key for key in ("id", "created_at") if key not in fields]
+    query = db.query(*(columns[name].label(name) for name in names))
+    for condition in filters:
+        query = query.filter(condition)
+    rows, next_cursor = _keyset_page(query, model, cursor, limit)
+
+    convert = convert or {}
+    plan = [(i, name, convert.get(name)) for i, name in enumerate(names[: len(fields)])]
+    items = [
+        {name: fn(row[i]) if fn is not None else row[i] for i, name, fn in plan}
+        for row in rows
+    ]
+    return items, next_cursor
+
+
+def _decode_tags(raw: Optional[str]) -> Optional[list]:
+    return orjson.loads(raw) if raw is not None else None
 
 
 # ---------- PHOTO ----------
 
-def create_photo(db: Session, file_path: str) -> models.Photo:
+def create_photo(db: Session, file_path: str, commit: bool = True) -> models.Photo:
     db_photo = models.Photo(file_path=file_path)
     db.add(db_photo)
-    db.commit()
-    db.refresh(db_photo)
+    _save(db, commit)
     return db_photo
 
 
@@ -20,30 +141,76 @@ def get_photo(db: Session, photo_id: int) -> Optional[models.Photo]:
     return db.query(models.Photo).filter(models.Photo.id == photo_id).first()
 
 
-def get_photos(db: Session, skip: int = 0, limit: int = 100) -> List[models.Photo]:
-    return (
+def get_photos(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+) -> Tuple[List[models.Photo], Optional[str]]:
+    """Возвращает (страница, next_cursor); next_cursor=None — это последняя страница."""
+    return _keyset_page(db.query(models.Photo), models.Photo, cursor, limit)
+
+
+def get_photo_rows(
+    db: Session,
+    fields: Tuple[str, ...] = PHOTO_FIELDS,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+) -> Tuple[List[dict], Optional[str]]:
+    """get_photos для GET /photos: только колонки из fields, сразу словари."""
+    photo = models.Photo
+    columns = {"file_path": photo.file_path, "id": photo.id, "created_at": photo.created_at}
+    return _project(db, photo, columns, fields, cursor, limit)
+
+
+def delete_photo(db: Session, photo_id: int, commit: bool = True) -> bool:
+    """Один DELETE: generations (и их теги, логи) удаляет каскад в БД, без загрузки в сессию."""
+    deleted = (
         db.query(models.Photo)
-        .order_by(models.Photo.created_at.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+        .filter(models.Photo.id == photo_id)
+        .delete(synchronize_session=False)
     )
+    _save(db, commit)
+    return deleted == 1
 
 
-def delete_photo(db: Session, photo_id: int) -> bool:
-    photo = get_photo(db, photo_id)
-    if not photo:
-        return False
-    db.delete(photo)
-    db.commit()
-    return True
+def delete_photos_batch(
+    db: Session,
+    ids: Optional[List[int]] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    batch: int = 500,
+) -> Tuple[int, bool]:
+    """Одна пачка массового удаления photos, см. _delete_batch."""
+    return _delete_batch(db, models.Photo, _range_filters(models.Photo, ids, created_after, created_before), batch)
 
 
 # ---------- GENERATION ----------
 
+TAG_MAX_LENGTH = 100
+
+
+def normalize_tag(tag: str) -> str:
+    return tag.strip().lower()[:TAG_MAX_LENGTH]
+
+
+def sync_tags(gen: models.Generation) -> None:
+    """Приводит generation_tags в соответствие с gen.tags (без лишних DELETE/INSERT)."""
+    wanted = []
+    for tag in gen.tags or []:
+        if isinstance(tag, str):
+            tag = normalize_tag(tag)
+            if tag and tag not in wanted:
+                wanted.append(tag)
+
+    current = {row.tag: row for row in gen.tag_rows}
+    gen.tag_rows = [current.get(tag) or models.GenerationTag(tag=tag) for tag in wanted]
+
+
 def create_generation(
     db: Session,
     data: schemas.GenerationCreate,
+    cache_key: Optional[str] = None,
+    commit: bool = True,
 ) -> models.Generation:
     db_gen = models.Generation(
         photo_id=data.photo_id,
@@ -52,28 +219,206 @@ def create_generation(
         style=data.style,
         length=data.length,
         tags_count=data.tags_count,
+        cache_key=cache_key,
     )
+    sync_tags(db_gen)
     db.add(db_gen)
-    db.commit()
-    db.refresh(db_gen)
+    _save(db, commit)
     return db_gen
 
 
+def _photo_from_item(item: dict, file_path: str) -> models.Photo:
+    # file_path из item — ключ сохранённого оригинала (app/storage.py),
+    # phash — dHash загрузки (app/dedup.py), если они есть
+    return models.Photo(
+        file_path=item.get("file_path") or file_path,
+        **dedup.photo_columns(item.get("phash")),
+    )
+
+
+def _generation_from_item(item: dict, photo: models.Photo) -> models.Generation:
+    gen = models.Generation(
+        photo=photo,
+        description=item["description"],
+        tags=item["tags"],
+        style=item["style"],
+        length=item["length"],
+        tags_count=item["tags_count"],
+        cache_key=item.get("cache_key"),
+    )
+    sync_tags(gen)
+    return gen
+
+
+def create_photo_with_generation(
+    db: Session,
+    file_path: str,
+    item: dict,
+    commit: bool = True,
+) -> models.Generation:
+    """
+    Unit of work для /generate: Photo + Generation одним flush и одним
+    commit. Сиротских photos при падении между вставками не остаётся.
+    item — словарь с полями Generation (description, tags, style, ...).
+    """
+    db_gen = _generation_from_item(item, _photo_from_item(item, file_path))
+    db.add(db_gen)
+    _save(db, commit)
+    return db_gen
+
+
+def create_photo_with_generations(
+    db: Session,
+    file_path: str,
+    items: List[dict],
+    commit: bool = True,
+) -> List[models.Generation]:
+    """
+    Одно Photo и несколько Generation (варианты одной картинки) — одним
+    commit. Поля Photo (file_path, phash) берутся из первого элемента.
+    """
+    photo = _photo_from_item(items[0], file_path)
+    gens = [_generation_from_item(item, photo) for item in items]
+    db.add_all(gens)
+    _save(db, commit)
+    return gens
+
+
+def create_generation_for_photo(
+    db: Session,
+    photo_id: int,
+    item: dict,
+    commit: bool = True,
+) -> Optional[models.Generation]:
+    """Новая Generation для уже существующего Photo (перегенерация). None — нет фото."""
+    photo = get_photo(db, photo_id)
+    if photo is None:
+        return None
+    if photo.phash is None:
+        for key, value in dedup.photo_columns(item.get("phash")).items():
+            setattr(photo, key, value)
+    db_gen = _generation_from_item(item, photo)
+    db.add(db_gen)
+    _save(db, commit)
+    return db_gen
+
+
+def bulk_create_generations(
+    db: Session,
+    items: List[dict],
+    file_path: str,
+) -> List[int]:
+    """
+    Пакетная запись: на каждый элемент — Photo + Generation,
+    всё одной транзакцией (один commit на весь батч).
+    items — словари с полями Generation (description, tags, style, ...).
+    Возвращает id созданных Generation в том же порядке.
+    """
+    gens = [_generation_from_item(item, _photo_from_item(item, file_path)) for item in items]
+    db.add_all(gens)
+    db.commit()
+    return [gen.id for gen in gens]
+
+
 def get_generation(db: Session, gen_id: int) -> Optional[models.Generation]:
     return db.query(models.Generation).filter(models.Generation.id == gen_id).first()
 
 
 def get_generations(
     db: Session,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
-) -> List[models.Generation]:
-    return (
-        db.query(models.Generation)
-        .order_by(models.Generation.created_at.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+    tags: Optional[List[str]] = None,
+    match: str = "any",
+    tag_prefix: Optional[str] = None,
+) -> Tuple[List[models.Generation], Optional[str]]:
+    """
+    Возвращает (страница, next_cursor); next_cursor=None — это последняя страница.
+
+    Фильтры по тегам идут через индекс generation_tags:
+    - tags + match="any" — есть хотя бы один из тегов;
+    - tags + match="all" — есть все теги;
+    - tag_prefix         — есть тег, начинающийся с префикса.
+    """
+    query = db.query(models.Generation)
+    for condition in _tag_filters(tags, match, tag_prefix):
+        query = query.filter(condition)
+    return _keyset_page(query, models.Generation, cursor, limit)
+
+
+def _tag_filters(
+    tags: Optional[List[str]],
+    match: str,
+    tag_prefix: Optional[str],
+) -> list:
+    tag_row = models.GenerationTag
+    same_gen = tag_row.generation_id == models.Generation.id
+    filters = []
+
+    wanted = [t for t in (normalize_tag(t) for t in tags or []) if t]
+    if wanted and match == "all":
+        for tag in dict.fromkeys(wanted):
+            filters.append(exists().where(same_gen, tag_row.tag == tag))
+    elif wanted:
+        filters.append(exists().where(same_gen, tag_row.tag.in_(wanted)))
+
+    if tag_prefix and normalize_tag(tag_prefix):
+        prefix = normalize_tag(tag_prefix)
+        filters.append(exists().where(same_gen, tag_row.tag.startswith(prefix, autoescape=True)))
+    return filters
+
+
+def get_generation_rows(
+    db: Session,
+    fields: Tuple[str, ...] = GENERATION_FIELDS,
+    description: str = "full",
+    preview_chars: int = 200,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    tags: Optional[List[str]] = None,
+    match: str = "any",
+    tag_prefix: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    get_generations для GET /generations: только колонки из fields, сразу словари.
+
+    description:
+    - "full"    — как есть;
+    - "preview" — первые preview_chars символов (обрезает БД, лишнее не
+      передаётся), у обрезанных в конце PREVIEW_SUFFIX;
+    - "none"    — без description, как если бы его не было в fields.
+    """
+    gen = models.Generation
+    columns = {
+        "photo_id": gen.photo_id,
+        "description": gen.description,
+        # сырой JSON: разбирается в _decode_tags, а не в StringArray
+        "tags": type_coerce(gen.tags, Text),
+        "style": gen.style,
+        "length": gen.length,
+        "tags_count": gen.tags_count,
+        "id": gen.id,
+        "created_at": gen.created_at,
+    }
+    convert = {"tags": _decode_tags}
+    if description == "none":
+        fields = tuple(name for name in fields if name != "description")
+    elif description == "preview":
+        # на символ больше — так видно, что описание длиннее превью
+        columns["description"] = func.substr(gen.description, 1, preview_chars + 1)
+        convert["description"] = lambda value: (
+            value[:preview_chars] + PREVIEW_SUFFIX if len(value) > preview_chars else value
+        )
+
+    return _project(
+        db,
+        gen,
+        columns,
+        fields,
+        cursor,
+        limit,
+        filters=_tag_filters(tags, match, tag_prefix),
+        convert=convert,
     )
 
 
@@ -81,11 +426,17 @@ def update_generation(
     db: Session,
     gen: models.Generation,
     data: schemas.GenerationUpdate,
+    commit: bool = True,
 ) -> models.Generation:
+    """
+    version растёт на 1 (и updated_at обновляется), только если что-то
+    действительно поменялось: PUT с теми же значениями не сбрасывает ETag.
+    """
     if data.description is not None:
         gen.description = data.description
     if data.tags is not None:
         gen.tags = data.tags
+        sync_tags(gen)
     if data.style is not None:
         gen.style = data.style
     if data.length is not None:
@@ -93,35 +444,320 @@ def update_generation(
     if data.tags_count is not None:
         gen.tags_count = data.tags_count
 
+    if db.is_modified(gen, include_collections=False):
+        # выражением, а не gen.version + 1: параллельные PUT не дадут одну версию;
+        # новое значение (и updated_at) eager_defaults перечитывает сразу после flush
+        gen.version = models.Generation.version + 1
+
     db.add(gen)
-    db.commit()
-    db.refresh(gen)
+    _save(db, commit)
     return gen
 
 
-def delete_generation(db: Session, gen_id: int) -> bool:
-    gen = get_generation(db, gen_id)
-    if not gen:
-        return False
-    db.delete(gen)
+def get_generation_ids(db: Session, photo_id: int) -> List[int]:
+    """id Generation одного фото — по индексу photo_id."""
+    rows = db.query(models.Generation.id).filter(models.Generation.photo_id == photo_id)
+    return [row_id for (row_id,) in rows]
+
+
+def delete_generation(db: Session, gen_id: int, commit: bool = True) -> bool:
+    """Один DELETE: теги и логи удаляет каскад в БД, jobs.generation_id -> NULL."""
+    deleted = (
+        db.query(models.Generation)
+        .filter(models.Generation.id == gen_id)
+        .delete(synchronize_session=False)
+    )
+    _save(db, commit)
+    return deleted == 1
+
+
+def delete_generations_batch(
+    db: Session,
+    ids: Optional[List[int]] = None,
+    photo_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    batch: int = 500,
+) -> Tuple[int, bool]:
+    """Одна пачка массового удаления generations, см. _delete_batch."""
+    filters = _range_filters(models.Generation, ids, created_after, created_before)
+    if photo_id is not None:
+        filters.append(models.Generation.photo_id == photo_id)
+    return _delete_batch(db, models.Generation, filters, batch)
+
+
+# ---------- МАССОВОЕ УДАЛЕНИЕ ----------
+
+def _utc(value: datetime) -> datetime:
+    # created_at в SQLite хранится как UTC без зоны: aware-границы приводим к UTC
+    return value.astimezone(timezone.utc) if value.tzinfo is not None else value
+
+
+def _range_filters(
+    model,
+    ids: Optional[List[int]],
+    created_after: Optional[datetime],
+    created_before: Optional[datetime],
+) -> list:
+    """Фильтры объединяются через AND; created_after включительно, created_before — нет."""
+    filters = []
+    if ids is not None:
+        filters.append(model.id.in_(ids))
+    if created_after is not None:
+        filters.append(model.created_at >= _utc(created_after))
+    if created_before is not None:
+        filters.append(model.created_at < _utc(created_before))
+    return filters
+
+
+def _delete_batch(db: Session, model, filters: list, batch: int) -> Tuple[int, bool]:
+    """
+    Удаляет до batch строк model по filters и коммитит: (удалено, есть_ещё).
+
+    id пачки выбираются по индексу (created_at, id) — от старых к новым,
+    затем один DELETE ... WHERE id IN (...). Каскад на дочерние таблицы
+    делает БД. Транзакция и блокировки — только на одну пачку, в памяти —
+    только её id; вызывающий повторяет, пока есть_ещё.
+    """
+    ids = [
+        row_id
+        for (row_id,) in db.query(model.id)
+        .filter(*filters)
+        .order_by(model.created_at, model.id)
+        .limit(batch)
+    ]
+    if not ids:
+        return 0, False
+    deleted = db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return deleted, len(ids) == batch
+
+
+# ---------- JOB ----------
+
+def create_job(
+    db: Session,
+    params: dict,
+    image_data: Optional[bytes],
+    image_mime: Optional[str],
+    commit: bool = True,
+) -> models.Job:
+    job = models.Job(
+        id=uuid.uuid4().hex,
+        status="queued",
+        style=params["style"],
+        length=params["length"],
+        tags_count=params["tags_count"],
+        cache_key=params.get("cache_key"),
+        image_data=image_data,
+        image_mime=image_mime,
+        image_phash=dedup.to_signed(params["phash"]) if params.get("phash") is not None else None,
+        file_path=params.get("file_path"),
+        attempts=0,
+    )
+    db.add(job)
+    _save(db, commit)
+    return job
+
+
+def get_job(db: Session, job_id: str) -> Optional[models.Job]:
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def _claim(db: Session, job_id: str) -> bool:
+    """UPDATE queued -> running (attempts + 1, updated_at — начало аренды) без commit."""
+    claimed = (
+        db.query(models.Job)
+        .filter(models.Job.id == job_id, models.Job.status == "queued")
+        .update(
+            {
+                models.Job.status: "running",
+                models.Job.attempts: models.Job.attempts + 1,
+                models.Job.updated_at: func.now(),
+            },
+            synchronize_session=False,
+        )
+    )
+    return claimed == 1
+
+
+def claim_job(db: Session, job_id: str) -> bool:
+    """
+    Атомарно переводит задачу queued -> running.
+    True — задачу забрал этот воркер (безопасно между процессами).
+    """
+    claimed = _claim(db, job_id)
+    db.commit()
+    return claimed
+
+
+def claim_next_job(db: Session, batch: int = 10) -> Optional[str]:
+    """
+    Забирает самую старую задачу из очереди; None — очередь пуста.
+    SELECT ... FOR UPDATE SKIP LOCKED и UPDATE — в одной транзакции: строки,
+    которые держит другой воркер, пропускаются, а не ждут его commit.
+    """
+    candidates = (
+        db.query(models.Job.id)
+        .filter(models.Job.status == "queued")
+        .order_by(models.Job.created_at)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for (job_id,) in candidates:
+        # в SQLite FOR UPDATE нет — гонку решает условие status='queued' в UPDATE
+        if _claim(db, job_id):
+            db.commit()
+            return job_id
+    db.commit()
+    return None
+
+
+def touch_job(db: Session, job_id: str) -> None:
+    """Продлевает аренду running-задачи (updated_at = now)."""
+    db.query(models.Job).filter(models.Job.id == job_id, models.Job.status == "running").update(
+        {models.Job.updated_at: func.now()},
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def release_job(db: Session, job_id: str) -> bool:
+    """
+    running -> queued без учёта попытки: воркер останавливается, задача
+    не виновата. Уже завершённую задачу не трогает.
+    """
+    released = (
+        db.query(models.Job)
+        .filter(models.Job.id == job_id, models.Job.status == "running")
+        .update(
+            {
+                models.Job.status: "queued",
+                models.Job.attempts: models.Job.attempts - 1,
+                models.Job.updated_at: func.now(),
+            },
+            synchronize_session=False,
+        )
+    )
     db.commit()
-    return True
+    return released == 1
+
+
+def retry_job(db: Session, job_id: str, error: str) -> bool:
+    """
+    running -> queued после временной ошибки (429/503/таймаут): попытка
+    засчитана, в error — последняя ошибка. Уже завершённую задачу не трогает.
+    """
+    requeued = (
+        db.query(models.Job)
+        .filter(models.Job.id == job_id, models.Job.status == "running")
+        .update(
+            {
+                models.Job.status: "queued",
+                models.Job.error: error,
+                models.Job.updated_at: func.now(),
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return requeued == 1
+
+
+def reclaim_stale_jobs(db: Session, lease_seconds: float, max_attempts: int) -> Tuple[int, int]:
+    """
+    running-задачи, чья аренда (updated_at) истекла — воркер упал или
+    процесс убит: при attempts < max_attempts возвращаются в queued,
+    иначе переводятся в failed с очисткой image_data. Возвращает
+    (возвращено в очередь, провалено).
+    """
+    cutoff = _utc(datetime.now(timezone.utc) - timedelta(seconds=lease_seconds))
+    stale = db.query(models.Job).filter(
+        models.Job.status == "running",
+        models.Job.updated_at < cutoff,
+    )
+    failed = stale.filter(models.Job.attempts >= max_attempts).update(
+        {
+            models.Job.status: "failed",
+            models.Job.error: f"Задача не завершилась за {max_attempts} попыток",
+            models.Job.image_data: None,
+            models.Job.updated_at: func.now(),
+        },
+        synchronize_session=False,
+    )
+    requeued = stale.update(
+        {models.Job.status: "queued", models.Job.updated_at: func.now()},
+        synchronize_session=False,
+    )
+    db.commit()
+    return requeued, failed
+
+
+def finish_job(db: Session, job: models.Job, result: dict, file_path: str) -> models.Job:
+    """Photo + Generation + статус задачи — одной транзакцией."""
+    job.generation = create_photo_with_generation(db, file_path, result, commit=False)
+    job.status = "done"
+    job.error = None
+    job.image_data = None
+    db.add(job)
+    db.commit()
+    return job
+
+
+def fail_job(db: Session, job: models.Job, error: str) -> models.Job:
+    job.status = "failed"
+    job.error = error
+    job.image_data = None
+    db.add(job)
+    db.commit()
+    return job
 
 
 # ---------- LOG ----------
 
-def create_log(db: Session, data: schemas.LogCreate) -> models.Log:
+def create_log(db: Session, data: schemas.LogCreate, commit: bool = True) -> models.Log:
     db_log = models.Log(
         level=data.level,
         message=data.message,
         generation_id=data.generation_id,
     )
     db.add(db_log)
-    db.commit()
-    db.refresh(db_log)
+    _save(db, commit)
     return db_log
 
 
+def bulk_create_logs(db: Session, rows: List[dict]) -> None:
+    """Пачка логов одним INSERT (executemany) и одним commit, без загрузки объектов."""
+    if not rows:
+        return
+    db.execute(insert(models.Log), rows)
+    db.commit()
+
+
+def detach_missing_generations(db: Session, rows: List[dict]) -> List[dict]:
+    """
+    Копия rows, где generation_id удалённых Generation заменён на NULL
+    (иначе FK валит весь INSERT пачки); сам id остаётся в message.
+    """
+    wanted = {row["generation_id"] for row in rows if row.get("generation_id") is not None}
+    if not wanted:
+        return rows
+    existing = {
+        gen_id
+        for (gen_id,) in db.query(models.Generation.id).filter(models.Generation.id.in_(wanted))
+    }
+    fixed = []
+    for row in rows:
+        gen_id = row.get("generation_id")
+        if gen_id is not None and gen_id not in existing:
+            message = json.loads(row["message"])
+            message["generation_id"] = gen_id
+            row = {**row, "generation_id": None, "message": json.dumps(message, ensure_ascii=False)}
+        fixed.append(row)
+    return fixed
+
+
 def get_logs(db: Session, skip: int = 0, limit: int = 100) -> List[models.Log]:
     return (
         db.query(models.Log)
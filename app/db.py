@@ -1,9 +1,20 @@
 import os
+from typing import AsyncIterator, Callable, TypeVar, Union
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 from dotenv import load_dotenv
 
+T = TypeVar("T")
+
 # Загружаем .env локально (на Render его просто не будет — это не страшно)
 load_dotenv()
 
@@ -12,8 +23,6 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 
 # 2) Если переменная не задана (например, у тебя локально) — используем старый Postgres-конфиг
 if not DATABASE_URL:
-    from sqlalchemy.engine import URL
-
     # ⚠️ тут всё как у тебя было
     DB_USER = "postgres"
     DB_PASSWORD = "pg12345"
@@ -30,14 +39,90 @@ if not DATABASE_URL:
         database=DB_NAME,
     )
 
-# 3) Создаём engine по строке подключения (это может быть и postgres://, и sqlite:///)
-engine = create_engine(
-    DATABASE_URL,
-    echo=True,
-    future=True,
-)
+# Render и многие хостинги отдают postgres:// или postgresql:// без драйвера —
+# SQLAlchemy 2 первое не понимает, а для второго ищет psycopg2. Ставим pg8000.
+DATABASE_URL = make_url(DATABASE_URL)
+if DATABASE_URL.drivername in ("postgres", "postgresql"):
+    DATABASE_URL = DATABASE_URL.set(drivername="postgresql+pg8000")
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+# ---------- НАСТРОЙКИ ПУЛА ----------
+
+DB_ECHO = _env_bool("DB_ECHO", "0")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", "1")
+# 0 — без ограничения
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+# AsyncSession (asyncpg / aiosqlite) для ручек в app/main.py
+DB_ASYNC = _env_bool("DB_ASYNC", "0")
+
+
+def _engine_kwargs(url: URL) -> dict:
+    kwargs = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    if url.get_backend_name() != "sqlite":
+        kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return kwargs
+
+
+def _popcount_xor(a, b):
+    if a is None or b is None:
+        return None
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _sqlite_setup(dbapi_connection) -> None:
+    # SQLite по умолчанию не проверяет внешние ключи и не делает ON DELETE CASCADE
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+    # расстояние Хэмминга между BIGINT-хэшами, в Postgres — выражением (см. app/dedup.py)
+    dbapi_connection.create_function("phash_distance", 2, _popcount_xor, deterministic=True)
+
+
+# 3) engine по строке подключения (postgres или sqlite) — не при импорте,
+#    а в init_engines() из lifespan / воркера / команды миграций
+def _create_engine() -> Engine:
+    sync_engine = create_engine(DATABASE_URL, future=True, **_engine_kwargs(DATABASE_URL))
+
+    if sync_engine.dialect.name == "postgresql" and DB_STATEMENT_TIMEOUT_MS > 0:
+        @event.listens_for(sync_engine, "connect")
+        def _pg_statement_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+            cursor.close()
+            # иначе SET откатится вместе с транзакцией при возврате в пул
+            dbapi_connection.commit()
+
+    if sync_engine.dialect.name == "sqlite":
+        @event.listens_for(sync_engine, "connect")
+        def _sqlite_connect(dbapi_connection, connection_record):
+            _sqlite_setup(dbapi_connection)
+
+    return sync_engine
+
+
+engine: Engine | None = None
+
+# expire_on_commit=False: после commit объекты остаются заполненными,
+# и не нужен лишний SELECT (db.refresh) ради id/created_at.
+# bind проставляет init_engines().
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
 
 Base = declarative_base()
 
@@ -48,3 +133,115 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ---------- ASYNC ----------
+
+
+def _async_url(url: URL) -> URL:
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        return url.set(drivername="postgresql+asyncpg")
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    raise RuntimeError(f"DB_ASYNC: нет async-драйвера для {backend!r}")
+
+
+def _create_async_engine() -> AsyncEngine:
+    url = _async_url(DATABASE_URL)
+    kwargs = _engine_kwargs(url)
+    if url.get_backend_name() == "postgresql" and DB_STATEMENT_TIMEOUT_MS > 0:
+        kwargs["connect_args"] = {
+            "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+        }
+    async_engine = create_async_engine(url, **kwargs)
+
+    if url.get_backend_name() == "sqlite":
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def _sqlite_connect_async(dbapi_connection, connection_record):
+            _sqlite_setup(dbapi_connection)
+
+    return async_engine
+
+
+async_engine: AsyncEngine | None = None
+AsyncSessionLocal: async_sessionmaker | None = None
+
+
+# ---------- ИНИЦИАЛИЗАЦИЯ ----------
+
+
+def init_engines() -> Engine:
+    """
+    Создаёт engine-ы и привязывает к ним фабрики сессий. Повторный вызов
+    ничего не делает. Соединения не открываются: пул заполняется при
+    первом запросе (или в ping() на прогреве).
+    """
+    global engine, async_engine, AsyncSessionLocal
+    if engine is None:
+        engine = _create_engine()
+        SessionLocal.configure(bind=engine)
+        if DB_ASYNC:
+            async_engine = _create_async_engine()
+            AsyncSessionLocal = async_sessionmaker(
+                async_engine,
+                autoflush=False,
+                expire_on_commit=False,
+            )
+    return engine
+
+
+def ping() -> None:
+    """SELECT 1 через пул — проверка связи и первое соединение."""
+    with init_engines().connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def ping_async() -> None:
+    if async_engine is not None:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+
+async def dispose_engines() -> None:
+    global engine, async_engine, AsyncSessionLocal
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        await run_in_threadpool(engine.dispose)
+    engine, async_engine, AsyncSessionLocal = None, None, None
+
+
+class ThreadpoolSession:
+    """
+    Sync Session с тем же интерфейсом run_sync, что у AsyncSession:
+    функция из crud выполняется в threadpool. Так ручки пишутся одинаково
+    и с DB_ASYNC=1, и без него.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def run_sync(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+
+AsyncDB = Union[AsyncSession, ThreadpoolSession]
+
+
+async def get_async_db() -> AsyncIterator[AsyncDB]:
+    """
+    DB_ASYNC=1 — AsyncSession поверх asyncpg/aiosqlite: I/O идёт в event loop
+    и не занимает поток. Иначе — обычная Session в threadpool.
+    Использование: await db_session.run_sync(crud.get_photo, photo_id)
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            yield session
+        return
+
+    session = SessionLocal()
+    try:
+        yield ThreadpoolSession(session)
+    finally:
+        await run_in_threadpool(session.close)
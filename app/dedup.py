@@ -0,0 +1,147 @@
+# app/dedup.py
+"""
+Поиск почти-дубликатов загрузок по перцептивному хэшу (dHash, 64 бита).
+
+Multi-index hashing: хэш режется на 4 полосы по 16 бит, у каждой полосы —
+свой B-tree индекс в photos. Если расстояние Хэмминга между хэшами <= d,
+то хотя бы одна полоса отличается не больше чем на d // 4 бит (принцип
+Дирихле). Поэтому кандидаты — фото, у которых какая-то полоса попала в
+окрестность радиуса d // 4 соответствующей полосы запроса: при d <= 3 это
+точное совпадение полосы, при d <= 7 — 17 значений на полосу.
+
+Точное расстояние (phash_distance) считает сама БД, по нему же фильтр и
+сортировка — лимита на кандидатов нет, полнота 100% для расстояния <= d.
+
+Стоимость растёт с таблицей: при равномерных хэшах полоса совпадает у
+~N / 65536 фото, т.е. на поиск читается ~4 * N / 65536 строк при d <= 3
+(~600 при 10 млн фото) и в 17 раз больше при d <= 7. Если это станет
+узким местом, следующий шаг — более длинные полосы (меньше совпадений
+на полосу) с новой миграцией.
+"""
+import os
+from itertools import combinations
+from typing import Optional
+
+from sqlalchemy import BigInteger, Integer, literal, or_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+
+from . import models
+
+
+PHASH_DEDUP = os.getenv("PHASH_DEDUP", "1").lower() in ("1", "true", "yes", "on")
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "3"))
+# у однотонных и гладких картинок dHash почти весь из нулей (или единиц) —
+# такие хэши совпадают у совершенно разных изображений, их не сравниваем
+PHASH_MIN_BITS = int(os.getenv("PHASH_MIN_BITS", "8"))
+
+BANDS = 4
+BAND_BITS = 16
+_BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def to_signed(phash: int) -> int:
+    """Беззнаковый 64-битный хэш -> значение для BIGINT."""
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+
+def to_unsigned(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+
+def bands(phash: int) -> tuple[int, ...]:
+    return tuple((phash >> (BAND_BITS * i)) & _BAND_MASK for i in range(BANDS))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count("1")
+
+
+def is_informative(phash: int) -> bool:
+    ones = bin(to_unsigned(phash)).count("1")
+    return PHASH_MIN_BITS <= ones <= 64 - PHASH_MIN_BITS
+
+
+def photo_columns(phash: Optional[int]) -> dict:
+    """Поля Photo для записи хэша (пусто, если хэша нет)."""
+    if phash is None:
+        return {}
+    b0, b1, b2, b3 = bands(phash)
+    return {
+        "phash": to_signed(phash),
+        "phash_b0": b0,
+        "phash_b1": b1,
+        "phash_b2": b2,
+        "phash_b3": b3,
+    }
+
+
+class phash_distance(FunctionElement):
+    """Расстояние Хэмминга между двумя BIGINT-хэшами — в SQL."""
+    type = Integer()
+    inherit_cache = True
+    name = "phash_distance"
+
+
+@compiles(phash_distance)
+def _phash_distance_default(element, compiler, **kw):
+    # SQLite: функция регистрируется на каждом соединении (см. app/db.py)
+    return "phash_distance(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(phash_distance, "postgresql")
+def _phash_distance_postgresql(element, compiler, **kw):
+    # bit_count() есть только с Postgres 14 — считаем единицы в битовой строке
+    a, b = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"length(replace(CAST(({a} # {b}) AS bit(64))::text, '0', ''))"
+
+
+def _neighbors(value: int, radius: int) -> list[int]:
+    """Все 16-битные значения на расстоянии <= radius от value."""
+    out = [value]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), r):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            out.append(flipped)
+    return out
+
+
+def find_similar_generation(
+    db: Session,
+    phash: int,
+    style: str,
+    length: str,
+    tags_count: int,
+    max_distance: int = PHASH_MAX_DISTANCE,
+) -> Optional[models.Generation]:
+    """
+    Ближайшая Generation с теми же параметрами для фото, чей хэш на
+    расстоянии <= max_distance. None — похожих нет.
+    """
+    photo = models.Photo
+    gen = models.Generation
+    radius = max_distance // BANDS
+    band_columns = (photo.phash_b0, photo.phash_b1, photo.phash_b2, photo.phash_b3)
+
+    conditions = []
+    for column, value in zip(band_columns, bands(phash)):
+        neighbors = _neighbors(value, radius)
+        conditions.append(column == value if len(neighbors) == 1 else column.in_(neighbors))
+
+    distance = phash_distance(photo.phash, literal(to_signed(phash), BigInteger))
+    return (
+        db.query(gen)
+        .join(photo, gen.photo_id == photo.id)
+        .filter(
+            or_(*conditions),
+            distance <= max_distance,
+            gen.style == style,
+            gen.length == length,
+            gen.tags_count == tags_count,
+        )
+        .order_by(distance, gen.id.desc())
+        .first()
+    )
@@ -0,0 +1,138 @@
+# app/eventlog.py
+"""
+Журнал событий в таблицу logs без задержки на пути запроса.
+
+emit() только кладёт событие в asyncio.Queue (без I/O). Фоновая задача
+собирает пачку и пишет её одним INSERT ... executemany, когда набралось
+LOG_BATCH_SIZE событий или прошло LOG_FLUSH_INTERVAL секунд с первого
+события пачки. Очередь ограничена LOG_QUEUE_MAX: при переполнении новые
+события отбрасываются и считаются в dropped. На shutdown очередь
+дописывается до конца.
+
+Log.message — JSON: {"event": "generation.created", ...поля события}.
+emit() вызывать из event loop (async-кода).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+
+from . import crud, db
+
+
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+
+logger = logging.getLogger(__name__)
+
+
+def _write(rows: list[dict]) -> None:
+    with db.SessionLocal() as session:
+        try:
+            crud.bulk_create_logs(session, rows)
+            return
+        except IntegrityError:
+            session.rollback()
+        # Generation успели удалить до записи (обычно — массовое удаление):
+        # одна такая строка не должна терять всю пачку
+        fixed = crud.detach_missing_generations(session, rows)
+        crud.bulk_create_logs(session, fixed)
+        logger.warning(
+            "logs: %d событий записаны без generation_id — Generation уже удалена",
+            sum(1 for old, new in zip(rows, fixed) if old is not new),
+        )
+
+
+class LogWriter:
+    def __init__(
+        self,
+        max_queue: int = LOG_QUEUE_MAX,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_queue)
+        self._task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+        self.written = 0
+        self.dropped = 0  # очередь переполнена
+        self.failed = 0  # пачку не удалось записать
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def emit(self, level: str, event: str, generation_id: int | None = None, **fields) -> None:
+        row = {
+            "level": level,
+            "message": json.dumps({"event": event, **fields}, ensure_ascii=False, default=str),
+            "generation_id": generation_id,
+        }
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run(), name="log-writer")
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу и дописывает всё, что осталось в очереди."""
+        if self._task is not None:
+            # не cancel: задача допишет текущую пачку и выйдет сама
+            self._stopping.set()
+            await self._task
+            self._task = None
+        while not self._queue.empty():
+            await self._flush(self._drain(self.batch_size))
+
+    def _drain(self, limit: int) -> list[dict]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _get(self, timeout: float) -> dict | None:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            first = await self._get(self.flush_interval)
+            if first is None:
+                continue
+
+            batch = [first, *self._drain(self.batch_size - 1)]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stopping.is_set():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                row = await self._get(timeout)
+                if row is None:
+                    break
+                batch.append(row)
+                batch.extend(self._drain(self.batch_size - len(batch)))
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        try:
+            await run_in_threadpool(_write, batch)
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            events = sorted({json.loads(row["message"]).get("event") for row in batch})
+            logger.exception("не удалось записать %d событий в logs (%s)", len(batch), ", ".join(events))
@@ -0,0 +1,135 @@
+# app/images.py
+"""
+Подготовка изображения перед отправкой в OpenAI.
+
+Загрузка читается чанками (sha256 считается на лету, без копии в памяти),
+затем в отдельном пуле потоков картинка уменьшается до IMAGE_MAX_EDGE по
+большей стороне, поворачивается по EXIF и пережимается в компактный
+JPEG/WebP без метаданных. В модель уходит уже маленький data: URL.
+Заодно считается перцептивный dHash для поиска почти-дубликатов
+(см. app/dedup.py).
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()  # JPEG | WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(30 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 2)))
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+
+class ImageError(ValueError):
+    """Файл не удалось прочитать как изображение или он слишком большой."""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime: str
+    width: int = 0
+    height: int = 0
+    phash: int | None = None  # 64-битный dHash, беззнаковый
+
+    def to_data_url(self) -> str:
+        b64 = base64.b64encode(self.data).decode("ascii")
+        return f"data:{self.mime};base64,{b64}"
+
+
+async def hash_upload(upload: UploadFile) -> tuple[str, int]:
+    """
+    Читает загрузку чанками и возвращает (sha256, размер).
+    Файл остаётся во временном хранилище Starlette, указатель сбрасывается в 0.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > IMAGE_MAX_UPLOAD_BYTES:
+            raise ImageError(
+                f"Файл больше {IMAGE_MAX_UPLOAD_BYTES // (1024 * 1024)} МБ"
+            )
+        digest.update(chunk)
+    await upload.seek(0)
+    return digest.hexdigest(), size
+
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """
+    Difference hash: серое 9x8, бит = пиксель ярче соседа справа.
+    Устойчив к ресайзу, пережатию и небольшим правкам цвета.
+    """
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def prepare_image(fp: BinaryIO, max_edge: int = IMAGE_MAX_EDGE) -> PreparedImage:
+    """Синхронно: уменьшить, повернуть по EXIF и пережать без метаданных."""
+    try:
+        return _prepare_image(fp, max_edge)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        # Pillow бросает OSError/SyntaxError на битых и неизвестных форматах
+        raise ImageError("Не удалось прочитать изображение")
+
+
+def _prepare_image(fp: BinaryIO, max_edge: int) -> PreparedImage:
+    img = Image.open(fp)
+    # для JPEG декодер сразу уменьшает в 2/4/8 раз — это дешевле resize
+    img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        if IMAGE_FORMAT == "JPEG":
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # exif/icc не передаём — метаданные в результат не попадают
+    img.save(out, format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
+    return PreparedImage(
+        data=out.getvalue(),
+        mime=_MIME.get(IMAGE_FORMAT, "image/jpeg"),
+        width=img.width,
+        height=img.height,
+        phash=dhash(img),
+    )
+
+
+async def prepare_upload(upload: UploadFile) -> PreparedImage:
+    """Подготовка загрузки в пуле потоков, не блокируя event loop."""
+    await upload.seek(0)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, prepare_image, upload.file)
+
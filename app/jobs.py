@@ -0,0 +1,266 @@
+# app/jobs.py
+"""
+Пул воркеров для асинхронных задач генерации (таблица jobs).
+
+Задачи всегда лежат в БД. Внутри API-процесса новые id сразу кладутся в
+asyncio.Queue (быстрый путь), а если очередь пуста — воркер раз в
+JOBS_POLL_INTERVAL секунд сам забирает queued-задачи из таблицы. Захват
+задачи — атомарный UPDATE queued -> running, поэтому тот же пул можно
+запускать отдельным процессом (python -m app.worker) рядом с API.
+
+running-задача — аренда: пока она выполняется, воркер раз в треть
+JOBS_LEASE_TIMEOUT обновляет updated_at. При остановке пула задача
+возвращается в queued. Если процесс упал, аренда истекает, и любой пул
+(при старте и раз в JOBS_REAP_INTERVAL секунд) возвращает задачу в
+очередь или, после JOBS_MAX_ATTEMPTS попыток, переводит её в failed.
+
+Временные ошибки (429/503/504, открытый breaker, нет бюджета, таймаут
+апстрима) не валят задачу: воркер ждёт backoff (JOBS_RETRY_BACKOFF * 2^n,
+не меньше Retry-After, не больше JOBS_RETRY_BACKOFF_MAX), держа аренду, и
+возвращает её в очередь; в failed — только постоянные ошибки или после
+JOBS_MAX_ATTEMPTS попыток.
+"""
+import asyncio
+import logging
+import os
+import random
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from . import admission, crud, db, dedup, eventlog, images, resilience
+
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "2"))
+JOBS_LEASE_TIMEOUT = float(os.getenv("JOBS_LEASE_TIMEOUT", "300"))
+JOBS_REAP_INTERVAL = float(os.getenv("JOBS_REAP_INTERVAL", "60"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RETRY_BACKOFF = float(os.getenv("JOBS_RETRY_BACKOFF", "5"))
+JOBS_RETRY_BACKOFF_MAX = float(os.getenv("JOBS_RETRY_BACKOFF_MAX", "120"))
+
+# ответы _complete, после которых задачу стоит повторить
+TRANSIENT_STATUS = {429, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+# (params, prepared image) -> result dict (поля Generation)
+JobHandler = Callable[[dict, images.PreparedImage], Awaitable[dict]]
+
+
+def _load_job(job_id: str):
+    with db.SessionLocal() as session:
+        job = crud.get_job(session, job_id)
+        if job is None:
+            return None
+        params = {
+            "style": job.style,
+            "length": job.length,
+            "tags_count": job.tags_count,
+            "cache_key": job.cache_key,
+            "file_path": job.file_path,
+        }
+        phash = dedup.to_unsigned(job.image_phash) if job.image_phash is not None else None
+        return params, job.image_data, job.image_mime, phash, job.attempts
+
+
+def _finish(job_id: str, result: dict, file_path: str) -> int | None:
+    with db.SessionLocal() as session:
+        return crud.finish_job(session, crud.get_job(session, job_id), result, file_path).generation_id
+
+
+def _fail(job_id: str, error: str) -> None:
+    with db.SessionLocal() as session:
+        crud.fail_job(session, crud.get_job(session, job_id), error)
+
+
+def _claim(job_id: str) -> bool:
+    with db.SessionLocal() as session:
+        return crud.claim_job(session, job_id)
+
+
+def _claim_next() -> str | None:
+    with db.SessionLocal() as session:
+        return crud.claim_next_job(session)
+
+
+def _touch(job_id: str) -> None:
+    with db.SessionLocal() as session:
+        crud.touch_job(session, job_id)
+
+
+def _release(job_id: str) -> bool:
+    with db.SessionLocal() as session:
+        return crud.release_job(session, job_id)
+
+
+def _retry(job_id: str, error: str) -> bool:
+    with db.SessionLocal() as session:
+        return crud.retry_job(session, job_id, error)
+
+
+def _transient(e: Exception) -> bool:
+    if isinstance(e, HTTPException):
+        return e.status_code in TRANSIENT_STATUS
+    if isinstance(e, (resilience.CircuitOpenError, admission.Rejected)):
+        return True
+    return resilience.is_retryable(e)
+
+
+def _retry_after(e: Exception) -> float | None:
+    if isinstance(e, HTTPException):
+        value = (e.headers or {}).get("Retry-After")
+        return float(value) if value else None
+    if isinstance(e, (resilience.CircuitOpenError, admission.Rejected)):
+        return e.retry_after
+    return resilience.retry_after_seconds(e)
+
+
+def _reclaim(lease_seconds: float, max_attempts: int) -> tuple[int, int]:
+    with db.SessionLocal() as session:
+        return crud.reclaim_stale_jobs(session, lease_seconds, max_attempts)
+
+
+class JobWorkerPool:
+    def __init__(
+        self,
+        handler: JobHandler,
+        concurrency: int = JOBS_WORKERS,
+        poll_interval: float = JOBS_POLL_INTERVAL,
+        file_path: str = "generated_via_openai",
+        event_log: eventlog.LogWriter | None = None,
+        lease_timeout: float = JOBS_LEASE_TIMEOUT,
+        reap_interval: float = JOBS_REAP_INTERVAL,
+        max_attempts: int = JOBS_MAX_ATTEMPTS,
+        retry_backoff: float = JOBS_RETRY_BACKOFF,
+        retry_backoff_max: float = JOBS_RETRY_BACKOFF_MAX,
+    ):
+        self.handler = handler
+        self.event_log = event_log
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.file_path = file_path
+        self.lease_timeout = lease_timeout
+        self.reap_interval = reap_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def notify(self, job_id: str) -> None:
+        """Новая задача в этом процессе — не ждём следующего опроса БД."""
+        self._queue.put_nowait(job_id)
+
+    def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self._reaper(), name="job-reaper"))
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"job-worker-{i}"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def run_forever(self) -> None:
+        self.start()
+        await asyncio.gather(*self._tasks)
+
+    async def _next_job(self) -> str | None:
+        try:
+            job_id = await asyncio.wait_for(self._queue.get(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            return await run_in_threadpool(_claim_next)
+        if await run_in_threadpool(_claim, job_id):
+            return job_id
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job_id = await self._next_job()
+                if job_id is not None:
+                    await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("job worker error")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _reaper(self) -> None:
+        """Истёкшие аренды: сразу при старте (задачи упавшего процесса) и дальше периодически."""
+        while True:
+            try:
+                requeued, failed = await run_in_threadpool(_reclaim, self.lease_timeout, self.max_attempts)
+                if requeued or failed:
+                    logger.warning("jobs: истекла аренда — в очередь %d, в failed %d", requeued, failed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("job reaper error")
+            await asyncio.sleep(self.reap_interval)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_timeout / 3)
+            try:
+                await run_in_threadpool(_touch, job_id)
+            except Exception:
+                logger.exception("job heartbeat error")
+
+    async def _run(self, job_id: str) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await self._execute(job_id)
+        except asyncio.CancelledError:
+            # пул останавливается посреди задачи — отдаём её обратно в очередь
+            await run_in_threadpool(_release, job_id)
+            raise
+        finally:
+            heartbeat.cancel()
+
+    async def _execute(self, job_id: str) -> None:
+        loaded = await run_in_threadpool(_load_job, job_id)
+        if loaded is None:
+            return
+        params, image_data, image_mime, phash, attempts = loaded
+        if not image_data:
+            await self._failed(job_id, "У задачи нет изображения")
+            return
+
+        prepared = images.PreparedImage(data=image_data, mime=image_mime, phash=phash)
+        try:
+            result = await self.handler(params, prepared)
+        except Exception as e:
+            await self._error(job_id, attempts, e)
+            return
+
+        gen_id = await run_in_threadpool(_finish, job_id, result, self.file_path)
+        if self.event_log is not None:
+            self.event_log.emit("info", "job.done", generation_id=gen_id, job_id=job_id)
+
+    async def _error(self, job_id: str, attempts: int, e: Exception) -> None:
+        error = str(e.detail) if isinstance(e, HTTPException) else f"OpenAI error: {e}"
+        if not _transient(e) or attempts >= self.max_attempts:
+            await self._failed(job_id, error)
+            return
+        # ждём, не отдавая аренду: сразу взятая снова задача упёрлась бы в тот же лимит
+        await asyncio.sleep(self._backoff(attempts, _retry_after(e)))
+        if await run_in_threadpool(_retry, job_id, error):
+            self.notify(job_id)
+            if self.event_log is not None:
+                self.event_log.emit("warning", "job.retry", job_id=job_id, attempts=attempts, error=error)
+
+    def _backoff(self, attempts: int, retry_after: float | None) -> float:
+        delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (attempts - 1)))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.retry_backoff_max))
+        return delay
+
+    async def _failed(self, job_id: str, error: str) -> None:
+        await run_in_threadpool(_fail, job_id, error)
+        if self.event_log is not None:
+            self.event_log.emit("error", "job.failed", job_id=job_id, error=error)
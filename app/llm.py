@@ -0,0 +1,90 @@
+# app/llm.py
+"""
+Клиент модели для main.py.
+
+Конвейер генерации зовёт не AsyncOpenAI напрямую, а ModelClient:
+- create(request)  — ответ с output_text и usage (responses.create);
+- stream(request)  — асинхронный итератор событий responses API
+                     (response.output_text.delta, response.completed).
+
+По умолчанию это OpenAIModelClient. OPENAI_BASE_URL направляет его на
+другой совместимый сервер, например на локальную заглушку из
+bench/fake_openai.py. Свой клиент подставляется через set_client() до
+первого запроса (в бенчмарках, отладке и т.п.).
+
+Клиент создаётся лениво, при первом get_client(): импорт модуля не требует
+OPENAI_API_KEY, не открывает соединений и не тянет за собой пакет openai
+(его импорт — около полусекунды холодного старта).
+"""
+import os
+from typing import Any, AsyncIterator, Protocol
+
+from . import resilience
+
+
+class ModelClient(Protocol):
+    async def create(self, request: dict) -> Any:
+        """Ответ с полями output_text и usage."""
+        ...
+
+    async def stream(self, request: dict) -> AsyncIterator[Any]:
+        """События стрима: .type, .delta, .response."""
+        ...
+
+    async def close(self) -> None: ...
+
+
+class OpenAIModelClient:
+    def __init__(self, api_key: str, base_url: str | None = None):
+        # Повторы и таймауты — в app/resilience.py, встроенные ретраи SDK
+        # выключены, чтобы не умножать попытки.
+        from openai import AsyncOpenAI
+
+        self._client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            timeout=resilience.UPSTREAM_TIMEOUT,
+        )
+
+    async def create(self, request: dict) -> Any:
+        return await self._client.responses.create(**request)
+
+    async def stream(self, request: dict) -> AsyncIterator[Any]:
+        return await self._client.responses.create(**request, stream=True)
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def build_client() -> ModelClient:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY не найден в .env (backend/.env)")
+    return OpenAIModelClient(api_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
+
+
+_client: ModelClient | None = None
+_injected = False
+
+
+def get_client() -> ModelClient:
+    global _client
+    if _client is None:
+        _client = build_client()
+    return _client
+
+
+def set_client(client: ModelClient | None) -> None:
+    """Подменить клиент модели; None — вернуться к клиенту по умолчанию."""
+    global _client, _injected
+    _client = client
+    _injected = client is not None
+
+
+async def close_client() -> None:
+    """Закрывает клиент по умолчанию; подставленный через set_client остаётся."""
+    global _client
+    if _client is not None and not _injected:
+        await _client.close()
+        _client = None
@@ -1,10 +1,19 @@
 # app/main.py
 
-from typing import List
+from typing import AsyncIterator, Awaitable, Callable, List, Literal
 
 import os
-import base64
+import asyncio
 import json
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+# от начала импорта до готовности — см. lifespan и GET /ready
+_IMPORT_STARTED = time.perf_counter()
 
 from fastapi import (
     FastAPI,
@@ -13,34 +22,211 @@ from fastapi import (
     Form,
     HTTPException,
     Depends,
+    Query,
+    Request,
 )
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
+import orjson
 from sqlalchemy.orm import Session
 
-from openai import OpenAI
-
-from . import db, models, schemas, crud
+from . import (
+    db,
+    models,
+    schemas,
+    crud,
+    admission,
+    cache,
+    dedup,
+    eventlog,
+    images,
+    jobs,
+    llm,
+    metrics,
+    migrations,
+    prompts,
+    resilience,
+    search,
+    storage,
+    streaming,
+    validation,
+)
 
 
 # ---------- .env и клиент OpenAI ----------
 
 load_dotenv()  # backend/.env
 
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("OPENAI_API_KEY не найден в .env (backend/.env)")
+# Сам клиент модели — в app/llm.py (создаётся лениво, подменяется через
+# llm.set_client), здесь — повторы, таймауты и breaker вокруг него.
+upstream = resilience.ResilientCaller()
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов к OpenAI может одновременно выполняться в одном процессе.
+# Остальные ждут на семафоре, не блокируя event loop и остальные ручки.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "200"))
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# Кэш готовых ответов модели (см. app/cache.py, RESULT_CACHE_BACKEND)
+result_cache = cache.build_result_cache()
+
+# Кэш GET /photos/{id} и /generations/{id} (см. app/cache.py, READ_CACHE_*)
+read_cache = cache.build_read_cache()
+
+# Оригиналы загрузок (см. app/storage.py, BLOB_BACKEND); создаётся в lifespan —
+# локальный бэкенд создаёт каталоги. None — хранение выключено.
+blob_store: storage.BlobStore | None = None
+
+# Журнал событий в таблицу logs (пишется пачками в фоне, см. app/eventlog.py)
+event_log = eventlog.LogWriter()
+
+# Лимиты на клиента и общий бюджет токенов OpenAI (см. app/admission.py)
+client_limiter = admission.ClientLimiter()
+token_budget = admission.GlobalBudget()
+
+
+# ---------- ЖИЗНЕННЫЙ ЦИКЛ: ЛЕНИВАЯ ИНИЦИАЛИЗАЦИЯ И ПРОГРЕВ ----------
+
+# Схема БД — миграциями (python -m app.migrations upgrade), а не при импорте.
+# DB_AUTO_MIGRATE=1 — применять их на старте (локально, SQLite, тесты).
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0").lower() in ("1", "true", "yes", "on")
+# Пауза между повторами неудавшегося прогрева (БД недоступна на старте)
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+# Размер общего threadpool для sync-ручек и работы с БД из async-кода.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+
+class _Readiness:
+    def __init__(self):
+        self.ready = False
+        self.import_seconds: float | None = None  # импорт app.main
+        self.startup_seconds: float | None = None  # lifespan до приёма запросов
+        self.ready_seconds: float | None = None  # от начала импорта до успешного прогрева
+        self.failed: dict[str, str] = {}  # прогрев -> последняя ошибка
+
+
+readiness = _Readiness()
+
+# Прогрев: (имя, корутина). Ошибка не валит процесс — /ready отвечает 503,
+# а неудавшиеся шаги повторяются в фоне каждые WARMUP_RETRY_INTERVAL секунд.
+_warmups: list[tuple[str, Callable[[], Awaitable[None]]]] = []
+
+
+def warmup(name: str):
+    def register(fn):
+        _warmups.append((name, fn))
+        return fn
+
+    return register
+
+
+@warmup("db")
+async def _warm_db():
+    await run_in_threadpool(db.ping)  # заодно первое соединение в пуле
+    waiting = await run_in_threadpool(migrations.pending, db.engine)
+    if waiting and DB_AUTO_MIGRATE:
+        await run_in_threadpool(migrations.upgrade, db.engine, None, logger.info)
+    elif waiting:
+        raise RuntimeError(
+            f"схема БД на версии {migrations.HEAD - len(waiting)} из {migrations.HEAD}: "
+            "нужен python -m app.migrations upgrade"
+        )
+
+
+@warmup("db_async")
+async def _warm_db_async():
+    await db.ping_async()
+
+
+async def _run_warmups(names: list[str]) -> list[str]:
+    """Выполняет шаги прогрева из names, возвращает имена неудавшихся."""
+    failed = []
+    for name, fn in _warmups:
+        if name not in names:
+            continue
+        try:
+            await fn()
+            readiness.failed.pop(name, None)
+        except Exception as e:
+            readiness.failed[name] = str(e)
+            failed.append(name)
+            logger.warning("прогрев %s не удался: %s", name, e)
+    return failed
+
+
+def _mark_ready() -> None:
+    readiness.ready = True
+    readiness.ready_seconds = time.perf_counter() - _IMPORT_STARTED
+    logger.info("готов к работе за %.3f с от импорта", readiness.ready_seconds)
 
-client = OpenAI(api_key=api_key)
 
+async def _retry_warmups(names: list[str]) -> None:
+    while names:
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+        names = await _run_warmups(names)
+    _mark_ready()
 
-# ---------- ИНИЦИАЛИЗАЦИЯ FASTAPI И БАЗЫ ----------
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Всё тяжёлое — здесь, а не при импорте: engine-ы БД, клиент модели,
+    прогрев (SELECT 1, проверка версии схемы), фоновые воркеры.
+    """
+    import anyio.to_thread
+
+    global blob_store
+
+    started = time.perf_counter()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+    db.init_engines()
+    blob_store = storage.build_blob_store()
+
+    # клиент модели (импорт openai) собирается в потоке параллельно с прогревом БД;
+    # без OPENAI_API_KEY падаем на старте, а не на первом запросе
+    retry = None
+    _, failed = await asyncio.gather(
+        run_in_threadpool(llm.get_client),
+        _run_warmups([name for name, _ in _warmups]),
+    )
+    if failed:
+        retry = asyncio.create_task(_retry_warmups(failed), name="warmup-retry")
+    else:
+        _mark_ready()
+
+    event_log.start()
+    if job_pool.concurrency > 0:
+        job_pool.start()
+    readiness.startup_seconds = time.perf_counter() - started
+
+    try:
+        yield
+    finally:
+        if retry is not None:
+            retry.cancel()
+            await asyncio.gather(retry, return_exceptions=True)
+        await job_pool.stop()
+        # после воркеров: их последние события тоже должны попасть в logs
+        await event_log.stop()
+        await llm.close_client()
+        await db.dispose_engines()
+        readiness.ready = False
+
+
+# ---------- FASTAPI ----------
 
 app = FastAPI(
     title="PhotoGen API",
     description="API для генерации описаний по изображениям и CRUD по историям",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -49,13 +235,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-models.Base.metadata.create_all(bind=db.engine)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
-def get_db():
-    """Зависимость для получения Session."""
-    yield from db.get_db()
+async def get_db():
+    """
+    Зависимость для получения сессии (AsyncSession при DB_ASYNC=1).
+    Работа с БД в ручках — только через await db_session.run_sync(crud...).
+    """
+    async for session in db.get_async_db():
+        yield session
 
 
 # ---------- ВСПОМОГАТЕЛЬНАЯ СХЕМА ДЛЯ /generate ----------
@@ -100,6 +289,217 @@ def _parse_model_json(raw_text: str) -> dict:
         raise ValueError(f"Модель вернула невалидный JSON: {e}. Текст: {raw_text!r}")
 
 
+# ---------- ВЫЗОВ МОДЕЛИ И ЗАПИСЬ В БД ----------
+
+
+def _model_request(params: dict, data_url: str) -> dict:
+    """
+    Аргументы responses.create: статичный префикс промпта — первым
+    сообщением (стабильный префикс для prompt caching), параметры запроса
+    и картинка — в конце.
+    """
+    with metrics.stage("prompt_build"):
+        prompt = prompts.get_prompt(params["style"], params["length"], params["tags_count"])
+        text = prompt.render(params["tags_count"])
+    return {
+        "model": "gpt-4o-mini",
+        "input": [
+            {"role": "system", "content": prompt.prefix},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": text},
+                    {"type": "input_image", "image_url": data_url},
+                ],
+            },
+        ],
+        "max_output_tokens": 2000,
+        "prompt_cache_key": f"photogen-v{prompts.PROMPT_VERSION}",
+        "text": {"format": validation.response_format(params["tags_count"])},
+    }
+
+
+# Сколько раз подряд можно чинить ответ текстовым вызовом
+MODEL_REPAIR_ATTEMPTS = int(os.getenv("MODEL_REPAIR_ATTEMPTS", "1"))
+
+
+async def _repair_model(params: dict, raw_text: str, problems: list[str]) -> str:
+    """Текстовый вызов без картинки: исправить уже сгенерированный ответ."""
+    request = {
+        "model": "gpt-4o-mini",
+        "input": [
+            {"role": "system", "content": prompts.REPAIR_PREFIX},
+            {
+                "role": "user",
+                "content": prompts.render_repair(
+                    params["style"],
+                    params["length"],
+                    params["tags_count"],
+                    problems,
+                    raw_text,
+                ),
+            },
+        ],
+        "max_output_tokens": 2000,
+        "prompt_cache_key": f"photogen-repair-v{prompts.PROMPT_VERSION}",
+        "text": {"format": validation.response_format(params["tags_count"])},
+    }
+    return await _create_response(
+        request,
+        admission.estimate_cost(params["length"], image_bytes=0),
+        stage="repair",
+    )
+
+
+def _image_bytes(data_url: str) -> int:
+    return len(data_url) * 3 // 4
+
+
+async def _acquire_budget(cost: int) -> None:
+    """Общий бюджет токенов OpenAI; очередь — из admission.current_lane."""
+    if not admission.ADMISSION_ENABLED:
+        return
+    with metrics.stage("admission_wait"):
+        await token_budget.acquire(cost, admission.current_lane.get())
+
+
+async def _create_response(request: dict, cost: int, stage: str = "upstream") -> str:
+    """
+    responses.create через upstream (таймауты, повторы, hedging, breaker).
+    Бюджет токенов берётся один раз на вызов, слот семафора — на каждую
+    попытку отдельно: пауза между повторами его не держит.
+    """
+
+    async def attempt():
+        async with openai_semaphore:
+            return await llm.get_client().create(request)
+
+    await _acquire_budget(cost)
+    with metrics.stage(stage):
+        response = await upstream.call(attempt)
+    metrics.record_usage(getattr(response, "usage", None))
+    return response.output_text
+
+
+async def _call_model(params: dict, data_url: str) -> str:
+    """Асинхронный вызов gpt-4o-mini для одной картинки и одного набора параметров."""
+    return await _create_response(
+        _model_request(params, data_url),
+        admission.estimate_cost(params["length"], _image_bytes(data_url)),
+    )
+
+
+def _variants_request(variants: list[dict], data_url: str) -> dict:
+    """Как _model_request, но несколько вариантов одной картинки в одном вызове."""
+    with metrics.stage("prompt_build"):
+        text = prompts.render_variants(variants)
+    return {
+        "model": "gpt-4o-mini",
+        "input": [
+            {"role": "system", "content": prompts.STATIC_PREFIX},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": text},
+                    {"type": "input_image", "image_url": data_url},
+                ],
+            },
+        ],
+        "max_output_tokens": min(2000 * len(variants), 16000),
+        "prompt_cache_key": f"photogen-v{prompts.PROMPT_VERSION}",
+        "text": {
+            "format": validation.variants_response_format(
+                [variant["tags_count"] for variant in variants]
+            ),
+        },
+    }
+
+
+async def _stream_model(params: dict, data_url: str) -> AsyncIterator[str]:
+    """
+    То же, что _call_model, но отдаёт текстовые дельты по мере генерации.
+    Повторяется только открытие стрима: после первых дельт клиент уже
+    получил часть текста. Hedging тоже нет — два стрима не склеить.
+    Слот семафора, как и в _create_response, берётся на каждую попытку
+    (пауза между повторами его не держит), а удачная держит его до конца стрима.
+    """
+    request = _model_request(params, data_url)
+    await _acquire_budget(admission.estimate_cost(params["length"], _image_bytes(data_url)))
+
+    held = False
+
+    async def attempt():
+        nonlocal held
+        await openai_semaphore.acquire()
+        held = True
+        try:
+            return await llm.get_client().stream(request)
+        except BaseException:
+            openai_semaphore.release()
+            held = False
+            raise
+
+    try:
+        with metrics.stage("upstream"):
+            stream = await upstream.call(attempt, hedge=False)
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+                elif event.type == "response.completed":
+                    metrics.record_usage(getattr(event.response, "usage", None))
+    finally:
+        if held:
+            openai_semaphore.release()
+
+
+def _save_generation(db_session: Session, result: dict) -> models.Generation:
+    """Синхронная запись Photo + Generation одним commit (вызывается из threadpool)."""
+    return crud.create_photo_with_generation(
+        db_session,
+        "generated_via_openai",
+        result,
+    )
+
+
+def _log_created(result: dict, gen_id: int, source: str) -> None:
+    event_log.emit(
+        "info",
+        "generation.created",
+        generation_id=gen_id,
+        source=source,
+        style=result["style"],
+        length=result["length"],
+        tags_count=result["tags_count"],
+        cache_key=result.get("cache_key"),
+    )
+
+
+def _log_failed(params: dict, error: HTTPException) -> HTTPException:
+    """Пишет событие о неудачной генерации и возвращает ту же ошибку (для raise)."""
+    event_log.emit(
+        "error",
+        "generation.failed",
+        style=params.get("style"),
+        length=params.get("length"),
+        tags_count=params.get("tags_count"),
+        cache_key=params.get("cache_key"),
+        status_code=error.status_code,
+        detail=str(error.detail),
+    )
+    return error
+
+
+async def _cache_get(key: str) -> dict | None:
+    with metrics.stage("cache_lookup"):
+        if result_cache.blocking:
+            cached = await run_in_threadpool(result_cache.get, key)
+        else:
+            cached = result_cache.get(key)
+    if cached is not None:
+        metrics.generation_source.inc("cache")
+    return cached
+
+
 # ---------- /health ----------
 
 
@@ -108,202 +508,1079 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready():
+    """Readiness: 200 после успешного прогрева (БД доступна, схема актуальна), иначе 503."""
+    return JSONResponse(
+        status_code=200 if readiness.ready else 503,
+        content={
+            "ready": readiness.ready,
+            "import_seconds": readiness.import_seconds,
+            "startup_seconds": readiness.startup_seconds,
+            "ready_seconds": readiness.ready_seconds,
+            "failed": readiness.failed,
+        },
+    )
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "backend": cache.RESULT_CACHE_BACKEND,
+        **result_cache.stats.as_dict(),
+        "read": {"backend": cache.READ_CACHE_BACKEND, **read_cache.stats.as_dict()},
+    }
+
+
+@app.get("/upstream/stats")
+def upstream_stats():
+    return {"circuit": upstream.breaker.state, **upstream.stats.as_dict()}
+
+
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+@metrics.registry.collector
+def _runtime_metrics():
+    """Кэш, upstream и пул БД — снимаются в момент скрейпа."""
+    stats = result_cache.stats
+    yield (
+        "photogen_result_cache_requests_total",
+        "counter",
+        "Обращения к кэшу результатов.",
+        [({"result": "hit"}, stats.hits), ({"result": "miss"}, stats.misses)],
+    )
+    yield (
+        "photogen_result_cache_evictions_total",
+        "counter",
+        "Вытеснения из кэша результатов.",
+        [({}, stats.evictions)],
+    )
+    read = read_cache.stats
+    yield (
+        "photogen_read_cache_requests_total",
+        "counter",
+        "Обращения к кэшу GET /photos/{id} и /generations/{id}.",
+        [({"result": "hit"}, read.hits), ({"result": "miss"}, read.misses)],
+    )
+
+    up = upstream.stats
+    yield (
+        "photogen_upstream_events_total",
+        "counter",
+        "Вызовы OpenAI через resilience-слой по исходу.",
+        [
+            ({"event": name}, getattr(up, name))
+            for name in (
+                "calls",
+                "successes",
+                "failures",
+                "retries",
+                "timeouts",
+                "hedges",
+                "hedge_wins",
+                "rejected",
+            )
+        ],
+    )
+    yield (
+        "photogen_upstream_circuit_state",
+        "gauge",
+        "Состояние circuit breaker: 0 closed, 1 half_open, 2 open.",
+        [({}, _CIRCUIT_STATES[upstream.breaker.state])],
+    )
+    yield (
+        "photogen_openai_semaphore_available",
+        "gauge",
+        "Свободные слоты OPENAI_MAX_CONCURRENCY.",
+        [({}, openai_semaphore._value)],
+    )
+
+    if admission.ADMISSION_ENABLED:
+        yield (
+            "photogen_admission_requests_total",
+            "counter",
+            "Вызовы модели по очереди admission: допущено / отказано по общему бюджету.",
+            [
+                ({"lane": lane, "result": result}, counts[lane])
+                for result, counts in (
+                    ("admitted", token_budget.admitted),
+                    ("rejected", token_budget.rejected),
+                )
+                for lane in admission.LANES
+            ],
+        )
+        yield (
+            "photogen_admission_queued",
+            "gauge",
+            "Вызовы модели, ждущие общий бюджет токенов.",
+            [({"lane": lane}, token_budget.queued(lane)) for lane in admission.LANES],
+        )
+        yield (
+            "photogen_admission_client_rejected_total",
+            "counter",
+            "Запросы, отклонённые лимитом клиента.",
+            [({}, client_limiter.rejected)],
+        )
+
+    yield (
+        "photogen_event_log_events_total",
+        "counter",
+        "События журнала logs: записано / отброшено при переполнении / ошибка записи.",
+        [
+            ({"result": "written"}, event_log.written),
+            ({"result": "dropped"}, event_log.dropped),
+            ({"result": "failed"}, event_log.failed),
+        ],
+    )
+    yield (
+        "photogen_event_log_pending",
+        "gauge",
+        "События в очереди на запись.",
+        [({}, event_log.pending)],
+    )
+
+    yield (
+        "photogen_ready",
+        "gauge",
+        "1 — прогрев пройден и сервис принимает запросы.",
+        [({}, int(readiness.ready))],
+    )
+    yield (
+        "photogen_startup_seconds",
+        "gauge",
+        "Холодный старт: импорт app.main, lifespan, от импорта до готовности.",
+        [
+            ({"phase": "import"}, readiness.import_seconds),
+            ({"phase": "lifespan"}, readiness.startup_seconds),
+            ({"phase": "ready"}, readiness.ready_seconds),
+        ],
+    )
+
+    engines = {}
+    if db.engine is not None:
+        engines["sync"] = db.engine
+    if db.async_engine is not None:
+        engines["async"] = db.async_engine.sync_engine
+    samples = []
+    for engine_name, engine in engines.items():
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(engine.pool, name, None)
+            if callable(fn):
+                samples.append(({"engine": engine_name, "state": name}, fn()))
+    yield (
+        "photogen_db_pool_connections",
+        "gauge",
+        "Состояние пула соединений SQLAlchemy.",
+        samples,
+    )
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(content=metrics.registry.expose(), media_type=metrics.CONTENT_TYPE)
+
+
+# ---------- ОБЩИЙ КОНВЕЙЕР ГЕНЕРАЦИИ ----------
+
+
+async def _accept_upload(image: UploadFile) -> tuple[str, str | None]:
+    """Проверка файла, sha256 и сохранение оригинала: (digest, file_path)."""
+    if not image.content_type or not image.content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=400,
+            detail="Нужно отправить файл-изображение",
+        )
+
+    try:
+        with metrics.stage("upload_read"):
+            image_digest, _ = await images.hash_upload(image)
+    except images.ImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with metrics.stage("blob_store"):
+        file_path = await _store_upload(image, image_digest)
+    return image_digest, file_path
+
+
+async def _lookup(
+    image: UploadFile,
+    style: str,
+    length: str,
+    tags_count: int,
+) -> tuple[dict, dict | None]:
+    """
+    Проверка файла, сохранение оригинала, нормализация параметров и поиск
+    в кэше. Возвращает (params, cached): params — style/length/tags_count/
+    cache_key/file_path, cached — готовый ответ модели или None.
+    """
+    image_digest, file_path = await _accept_upload(image)
+    params, cached = await _lookup_digest(image_digest, style, length, tags_count)
+    if file_path is not None:
+        params["file_path"] = file_path
+    return params, cached
+
+
+async def _lookup_digest(
+    image_digest: str,
+    style: str,
+    length: str,
+    tags_count: int,
+) -> tuple[dict, dict | None]:
+    """Параметры + поиск в кэше по уже посчитанному sha256 картинки."""
+    length = prompts.normalize_length(length)
+
+    params = {
+        "style": style,
+        "length": length,
+        "tags_count": tags_count,
+        "cache_key": cache.make_key(
+            image_digest,
+            style,
+            length,
+            tags_count,
+            prompts.PROMPT_VERSION,
+        ),
+    }
+
+    # --- кэш результатов: та же картинка + те же параметры -> без OpenAI ---
+    cached = await _cache_get(params["cache_key"])
+    return params, cached
+
+
+async def _store_upload(image: UploadFile, image_digest: str) -> str | None:
+    """
+    Потоковая запись оригинала в blob store. Ключ идёт в Photo.file_path.
+    Ошибка хранилища генерацию не ломает — просто без оригинала.
+    """
+    if blob_store is None:
+        return None
+    await image.seek(0)
+    try:
+        return await run_in_threadpool(blob_store.put, image.file, image_digest)
+    except OSError:
+        logger.exception("не удалось сохранить оригинал %s", image_digest)
+        return None
+    finally:
+        await image.seek(0)
+
+
+def _data_url(prepared: images.PreparedImage) -> str:
+    with metrics.stage("base64_encode"):
+        return prepared.to_data_url()
+
+
+async def _prepare(image: UploadFile) -> images.PreparedImage:
+    """Уменьшаем и пережимаем картинку в пуле потоков."""
+    try:
+        with metrics.stage("image_prepare"):
+            return await images.prepare_upload(image)
+    except images.ImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _find_near_duplicate(params: dict, phash: int) -> dict | None:
+    with db.SessionLocal() as session:
+        gen = dedup.find_similar_generation(
+            session,
+            phash,
+            params["style"],
+            params["length"],
+            params["tags_count"],
+        )
+        return {"description": gen.description, "tags": gen.tags} if gen else None
+
+
+async def _near_duplicate(params: dict, prepared: images.PreparedImage) -> dict | None:
+    """
+    Готовый ответ для почти такой же картинки (ресайз, пережатие, скриншот)
+    с теми же параметрами — по dHash, см. app/dedup.py.
+    """
+    if not dedup.PHASH_DEDUP or prepared.phash is None:
+        return None
+    if not dedup.is_informative(prepared.phash):
+        return None
+    with metrics.stage("dedup_lookup"):
+        found = await run_in_threadpool(_find_near_duplicate, params, prepared.phash)
+    if found is not None:
+        metrics.generation_source.inc("near_duplicate")
+        result_cache.set(params["cache_key"], found)
+    return found
+
+
+async def _complete(params: dict, prepared: images.PreparedImage) -> dict:
+    """
+    Почти-дубликат или модель + разбор JSON + запись в кэш
+    для уже подготовленной картинки.
+    """
+    params = {**params, "phash": prepared.phash}
+    reused = await _near_duplicate(params, prepared)
+    if reused is not None:
+        return {**params, **reused}
+    return await _complete_with_model(params, prepared)
+
+
+async def _complete_with_model(params: dict, prepared: images.PreparedImage) -> dict:
+    try:
+        raw_text = await _call_model(params, _data_url(prepared))
+    except Exception as e:
+        raise _log_failed(params, _upstream_error(e))
+
+    return await _finalize(params, raw_text)
+
+
+def _retry_after(seconds: float) -> dict:
+    return {"Retry-After": str(max(math.ceil(seconds), 1))}
+
+
+def _too_many(e: admission.Rejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.detail, headers=_retry_after(e.retry_after))
+
+
+def _upstream_error(e: Exception) -> HTTPException:
+    """
+    Ошибка вызова модели -> HTTP: 503 при открытом breaker, 429 без бюджета,
+    504/503 — временная ошибка апстрима, на которой кончились повторы
+    (таймаут / 5xx, 429 OpenAI), иначе 500.
+    """
+    if isinstance(e, resilience.CircuitOpenError):
+        return HTTPException(status_code=503, detail=str(e), headers=_retry_after(e.retry_after))
+    if isinstance(e, admission.Rejected):
+        return _too_many(e)
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(status_code=504, detail="OpenAI не ответил вовремя")
+    if resilience.is_retryable(e):
+        retry_after = resilience.retry_after_seconds(e)
+        headers = _retry_after(retry_after) if retry_after is not None else None
+        return HTTPException(status_code=503, detail=f"OpenAI error: {e}", headers=headers)
+    return HTTPException(status_code=500, detail=f"OpenAI error: {e}")
+
+
+def _check(params: dict, raw_text: str) -> tuple[dict | None, list[str]]:
+    """(нормализованный ответ или None, если это не JSON; список нарушений)."""
+    try:
+        data = _parse_model_json(raw_text)
+    except ValueError:
+        return None, ["Ответ не является валидным JSON-объектом."]
+    if not isinstance(data, dict):
+        return None, ["Ответ должен быть JSON-объектом с полями description и tags."]
+    data = validation.normalize(data, params["tags_count"])
+    return data, validation.validate(data, params["length"], params["tags_count"])
+
+
+async def _finalize(params: dict, raw_text: str) -> dict:
+    """
+    Разбор и проверка ответа модели + запись в кэш.
+    Нарушения (не JSON, число предложений/тегов) чинятся текстовым
+    repair-вызовом по уже сгенерированному тексту — картинку заново не шлём.
+    """
+    metrics.generation_source.inc("model")
+    with metrics.stage("json_parse"):
+        data, problems = _check(params, raw_text)
+
+    for _ in range(MODEL_REPAIR_ATTEMPTS):
+        if not problems:
+            break
+        try:
+            repaired_text = await _repair_model(params, raw_text, problems)
+        except Exception as e:
+            if data is not None:
+                break  # отдаём то, что есть, лучше, чем 500
+            raise _log_failed(params, _upstream_error(e))
+        repaired, repaired_problems = _check(params, repaired_text)
+        if repaired is None and data is not None:
+            break
+        raw_text, data, problems = repaired_text, repaired, repaired_problems
+
+    if data is None:
+        raise _log_failed(params, HTTPException(status_code=500, detail="Модель вернула не JSON"))
+    if problems:
+        logger.warning("ответ модели не прошёл проверку: %s", "; ".join(problems))
+
+    result_cache.set(params["cache_key"], data)
+
+    return {**params, **data}
+
+
+async def _run_generation(
+    image: UploadFile,
+    style: str,
+    length: str,
+    tags_count: int,
+) -> dict:
+    """
+    Кэш -> подготовка картинки -> модель -> разбор JSON. В БД ничего не пишет.
+    Возвращает поля будущей Generation + cache_key.
+    Ошибки отдаёт как HTTPException.
+    """
+    params, cached = await _lookup(image, style, length, tags_count)
+    if cached is not None:
+        return {**params, **cached}
+
+    prepared = await _prepare(image)
+    return await _complete(params, prepared)
+
+
+# ---------- ADMISSION CONTROL ----------
+
+
+def _admit(request: Request, lane: str, cost: int) -> None:
+    """
+    Лимит клиента по оценке стоимости запроса (429 + Retry-After сразу,
+    до обработки картинки) и очередь, в которой вызовы модели этого
+    запроса ждут общий бюджет токенов.
+    """
+    admission.current_lane.set(lane)
+    if not admission.ADMISSION_ENABLED:
+        return
+    try:
+        client_limiter.check(admission.client_id(request), cost)
+    except admission.Rejected as e:
+        raise _too_many(e)
+
+
 # ---------- /generate ----------
 
 
-@app.post("/generate", response_model=GenerationResponse)
+@app.post(
+    "/generate",
+    response_model=GenerationResponse | schemas.VariantsGenerationResponse,
+    responses={202: {"model": schemas.JobOut}},
+)
 async def generate(
+    request: Request,
     image: UploadFile = File(...),
     style: str = Form("Default"),
     length: str = Form("Medium"),
     tags_count: int = Form(5),
-    db_session: Session = Depends(get_db),
+    variants: str | None = Form(None),
+    async_mode: bool = Query(False, alias="async"),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
     """
     Генерация описания и тегов по загруженному изображению (OpenAI gpt-4o-mini)
     + запись Photo и Generation в БД.
+
+    variants — JSON-массив [{"style", "length", "tags_count"}, ...]: несколько
+    описаний одной картинки за один вызов модели, ответ — VariantsGenerationResponse.
+    ?async=1 — сразу вернуть 202 с задачей; результат забирать через GET /jobs/{id}.
     """
+    if variants is not None:
+        if async_mode:
+            raise HTTPException(status_code=400, detail="variants не поддерживаются с async=1")
+        parsed = _parse_variants(variants, style, length, tags_count)
+        cost = admission.estimate_cost([v["length"] for v in parsed], image.size)
+        _admit(request, "interactive", cost)
+        return await _generate_variants(image, parsed, db_session)
 
-    if not image.content_type or not image.content_type.startswith("image/"):
+    _admit(request, "interactive", admission.estimate_cost(length, image.size))
+    if async_mode:
+        return await _enqueue_generation(image, style, length, tags_count, db_session)
+
+    result = await _run_generation(image, style, length, tags_count)
+
+    # --------- ЧАСТЬ CRUD: СОХРАНЯЕМ В БД (вне event loop) ---------
+    with metrics.stage("db_write"):
+        gen = await db_session.run_sync(_save_generation, result)
+    _log_created(result, gen.id, "generate")
+
+    return GenerationResponse(
+        description=result["description"],
+        tags=result["tags"],
+        generated_image=None,
+    )
+
+
+# ---------- /generate с variants ----------
+
+# Сколько вариантов (style/length/tags_count) можно запросить за раз
+GENERATE_MAX_VARIANTS = int(os.getenv("GENERATE_MAX_VARIANTS", "6"))
+
+
+def _parse_variants(variants: str, style: str, length: str, tags_count: int) -> list[dict]:
+    """Незаданные поля варианта берутся из общих style/length/tags_count."""
+    try:
+        parsed = json.loads(variants)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"variants: невалидный JSON: {e}")
+    if not isinstance(parsed, list) or not parsed:
+        raise HTTPException(status_code=400, detail="variants должен быть непустым массивом")
+    if len(parsed) > GENERATE_MAX_VARIANTS:
         raise HTTPException(
             status_code=400,
-            detail="Нужно отправить файл-изображение",
+            detail=f"Не больше {GENERATE_MAX_VARIANTS} вариантов за запрос",
         )
 
-    image_bytes = await image.read()
+    out = []
+    for item in parsed:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Элементы variants должны быть объектами")
+        try:
+            count = int(item.get("tags_count", tags_count))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="variants: tags_count должен быть числом")
+        out.append(
+            {
+                "style": str(item.get("style") or style),
+                "length": str(item.get("length") or length),
+                "tags_count": count,
+            }
+        )
+    return out
 
-    b64_image = base64.b64encode(image_bytes).decode("utf-8")
-    data_url = f"data:{image.content_type};base64,{b64_image}"
 
-    # --- подсказка по длине ---
-    # Short: 3–5 предложений
-    # Medium: 5–8 предложений
-    # Long: 10–15 предложений
-    # VeryLong: 30+ предложений, минимум 4 абзаца
-    if length == "Short":
-        length_hint = (
-            "Для параметра длины ('Short') напиши от 3 до 5 предложений. "
-            "Меньше 3 и больше 5 предложений писать нельзя."
-        )
-    elif length == "Medium":
-        length_hint = (
-            "Для параметра длины ('Medium') напиши от 5 до 8 предложений. "
-            "Текст должен укладываться строго в диапазон 5–8 предложений."
+def _split_variants(raw_text: str, count: int) -> list | None:
+    """Элементы variants из ответа модели или None, если формат не тот."""
+    try:
+        data = _parse_model_json(raw_text)
+    except ValueError:
+        return None
+    items = data.get("variants") if isinstance(data, dict) else None
+    if not isinstance(items, list) or len(items) != count:
+        return None
+    return items
+
+
+async def _complete_variants(
+    params_list: list[dict],
+    prepared: images.PreparedImage,
+) -> list[dict]:
+    """
+    Несколько вариантов для одной подготовленной картинки: почти-дубликаты
+    берутся из БД, остальное — одним vision-вызовом. Если общий ответ не
+    разобрать, варианты догенерируются параллельными вызовами с той же
+    картинкой. Каждый вариант проходит _finalize (проверка + repair).
+    """
+    params_list = [{**params, "phash": prepared.phash} for params in params_list]
+    results: list[dict | None] = []
+    for params in params_list:
+        reused = await _near_duplicate(params, prepared)
+        results.append({**params, **reused} if reused is not None else None)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if len(pending) == 1:
+        results[pending[0]] = await _complete_with_model(params_list[pending[0]], prepared)
+    elif pending:
+        try:
+            data_url = _data_url(prepared)
+            raw_text = await _create_response(
+                _variants_request([params_list[i] for i in pending], data_url),
+                admission.estimate_cost(
+                    [params_list[i]["length"] for i in pending],
+                    _image_bytes(data_url),
+                ),
+            )
+        except Exception as e:
+            raise _log_failed(params_list[pending[0]], _upstream_error(e))
+
+        items = _split_variants(raw_text, len(pending))
+        if items is None:
+            logger.warning("ответ с вариантами не разобран, генерируем по одному")
+            done = await asyncio.gather(
+                *(_complete_with_model(params_list[i], prepared) for i in pending)
+            )
+        else:
+            done = await asyncio.gather(
+                *(
+                    _finalize(params_list[i], json.dumps(item, ensure_ascii=False))
+                    for i, item in zip(pending, items)
+                )
+            )
+        for i, result in zip(pending, done):
+            results[i] = result
+
+    return results
+
+
+def _save_variants(db_session: Session, results: list[dict]) -> tuple[int, list[int]]:
+    gens = crud.create_photo_with_generations(db_session, "generated_via_openai", results)
+    return gens[0].photo_id, [gen.id for gen in gens]
+
+
+async def _generate_variants(
+    image: UploadFile,
+    variants: list[dict],
+    db_session: db.AsyncDB,
+) -> schemas.VariantsGenerationResponse:
+    image_digest, file_path = await _accept_upload(image)
+
+    lookups = [
+        await _lookup_digest(image_digest, v["style"], v["length"], v["tags_count"])
+        for v in variants
+    ]
+    results = [{**params, **cached} if cached is not None else None for params, cached in lookups]
+
+    common = {}
+    if file_path is not None:
+        common["file_path"] = file_path
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        prepared = await _prepare(image)
+        common["phash"] = prepared.phash
+        done = await _complete_variants([lookups[i][0] for i in pending], prepared)
+        for i, result in zip(pending, done):
+            results[i] = result
+
+    results = [{**result, **common} for result in results]
+    with metrics.stage("db_write"):
+        photo_id, gen_ids = await db_session.run_sync(_save_variants, results)
+    for result, gen_id in zip(results, gen_ids):
+        _log_created(result, gen_id, "variants")
+
+    return schemas.VariantsGenerationResponse(
+        photo_id=photo_id,
+        items=[
+            schemas.VariantResult(
+                style=result["style"],
+                length=result["length"],
+                tags_count=result["tags_count"],
+                generation_id=gen_id,
+                description=result["description"],
+                tags=result["tags"],
+            )
+            for result, gen_id in zip(results, gen_ids)
+        ],
+    )
+
+
+# ---------- /generate/stream (SSE) ----------
+
+
+def _save_generation_new_session(result: dict) -> int:
+    # у стрима своя сессия: ответ живёт дольше, чем зависимость get_db
+    with db.SessionLocal() as session:
+        return _save_generation(session, result).id
+
+
+async def _sse_generation(
+    params: dict,
+    cached: dict | None,
+    prepared: images.PreparedImage | None,
+) -> AsyncIterator[str]:
+    try:
+        if cached is not None:
+            result = {**params, **cached}
+            yield streaming.sse_event("delta", {"text": result["description"]})
+        else:
+            extractor = streaming.DescriptionExtractor()
+            raw_parts = []
+            try:
+                async for delta in _stream_model(params, _data_url(prepared)):
+                    raw_parts.append(delta)
+                    text = extractor.feed(delta)
+                    if text:
+                        yield streaming.sse_event("delta", {"text": text})
+            except Exception as e:
+                raise _log_failed(params, _upstream_error(e))
+
+            result = await _finalize(params, "".join(raw_parts))
+
+        with metrics.stage("db_write"):
+            gen_id = await run_in_threadpool(_save_generation_new_session, result)
+        _log_created(result, gen_id, "stream")
+        yield streaming.sse_event(
+            "result",
+            {
+                "description": result["description"],
+                "tags": result["tags"],
+                "generation_id": gen_id,
+            },
         )
-    elif length == "Long":
-        length_hint = (
-            "Для параметра длины ('Long') напиши от 10 до 15 предложений. "
-            "Нельзя делать меньше 10 и больше 15 предложений."
+    except HTTPException as e:
+        yield streaming.sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+
+
+@app.post("/generate/stream")
+async def generate_stream(
+    request: Request,
+    image: UploadFile = File(...),
+    style: str = Form("Default"),
+    length: str = Form("Medium"),
+    tags_count: int = Form(5),
+):
+    """
+    Как /generate, но ответ — text/event-stream:
+    - event: delta  — очередной кусок описания {"text": "..."};
+    - event: result — итог {"description", "tags", "generation_id"} после записи в БД;
+    - event: error  — {"status_code", "detail"}, если что-то пошло не так в процессе.
+    Ошибки валидации файла возвращаются обычным HTTP-ответом до начала стрима.
+    """
+    _admit(request, "interactive", admission.estimate_cost(length, image.size))
+    params, cached = await _lookup(image, style, length, tags_count)
+    prepared = None
+    if cached is None:
+        prepared = await _prepare(image)
+        params["phash"] = prepared.phash
+        cached = await _near_duplicate(params, prepared)
+
+    return StreamingResponse(
+        _sse_generation(params, cached, prepared),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------- /generate?async=1 и /jobs ----------
+
+# запускается и останавливается в lifespan
+job_pool = jobs.JobWorkerPool(_complete, event_log=event_log)
+
+
+def _job_out(job: models.Job) -> schemas.JobOut:
+    gen = job.generation
+    return schemas.JobOut(
+        id=job.id,
+        status=job.status,
+        style=job.style,
+        length=job.length,
+        tags_count=job.tags_count,
+        generation_id=job.generation_id,
+        description=gen.description if gen is not None else None,
+        tags=gen.tags if gen is not None else None,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
+
+def _create_job(
+    db_session: Session,
+    params: dict,
+    prepared: images.PreparedImage | None,
+    cached: dict | None,
+) -> schemas.JobOut:
+    if cached is not None:
+        # ответ уже есть в кэше — задача сразу выполнена
+        job = crud.create_job(db_session, params, None, None)
+        job = crud.finish_job(db_session, job, {**params, **cached}, "generated_via_openai")
+    else:
+        job = crud.create_job(db_session, params, prepared.data, prepared.mime)
+    return _job_out(job)
+
+
+async def _enqueue_generation(
+    image: UploadFile,
+    style: str,
+    length: str,
+    tags_count: int,
+    db_session: db.AsyncDB,
+) -> JSONResponse:
+    params, cached = await _lookup(image, style, length, tags_count)
+    prepared = None
+    if cached is None:
+        prepared = await _prepare(image)
+        params["phash"] = prepared.phash
+        cached = await _near_duplicate(params, prepared)
+
+    job = await db_session.run_sync(_create_job, params, prepared, cached)
+    if job.status == "queued" and job_pool.concurrency > 0:
+        job_pool.notify(job.id)
+
+    return JSONResponse(status_code=202, content=jsonable_encoder(job))
+
+
+def _load_job_out(db_session: Session, job_id: str) -> schemas.JobOut | None:
+    job = crud.get_job(db_session, job_id)
+    return _job_out(job) if job else None
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
+async def get_job(
+    job_id: str,
+    db_session: db.AsyncDB = Depends(get_db),
+):
+    job = await db_session.run_sync(_load_job_out, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# ---------- /generate/batch ----------
+
+# Сколько картинок из одного батча обрабатываются одновременно
+# (поверх глобального OPENAI_MAX_CONCURRENCY) и максимальный размер батча.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+
+
+def _parse_batch_items(items: str | None, count: int) -> list[dict]:
+    """items — JSON-массив переопределений style/length/tags_count по индексу."""
+    if not items:
+        return [{} for _ in range(count)]
+    try:
+        parsed = json.loads(items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"items: невалидный JSON: {e}")
+    if not isinstance(parsed, list) or len(parsed) != count:
+        raise HTTPException(
+            status_code=400,
+            detail="items должен быть массивом той же длины, что и images",
         )
-    elif length == "VeryLong":
-        length_hint = (
-            "Для параметра длины ('VeryLong') напиши большой связный рассказ "
-            "объёмом не меньше 30 предложений. "
-            "Разбей текст как минимум на 4 абзаца. "
-            "Каждый абзац должен содержать не меньше 6–8 предложений. "
-            "В целом ориентируйся на диапазон 30–50 предложений."
+    overrides = []
+    for item in parsed:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Элементы items должны быть объектами")
+        overrides.append(
+            {k: item[k] for k in ("style", "length", "tags_count") if item.get(k) is not None}
         )
-    else:
-        length = "Medium"
-        length_hint = (
-            "Для параметра длины ('Medium') напиши от 5 до 8 предложений. "
-            "Текст должен укладываться строго в диапазон 5–8 предложений."
+    return overrides
+
+
+@app.post("/generate/batch", response_model=schemas.BatchGenerationResponse)
+async def generate_batch(
+    request: Request,
+    images_: List[UploadFile] = File(..., alias="images"),
+    style: str = Form("Default"),
+    length: str = Form("Medium"),
+    tags_count: int = Form(5),
+    items: str | None = Form(None),
+    db_session: db.AsyncDB = Depends(get_db),
+):
+    """
+    Пакетная генерация: N картинок в одном запросе.
+    style/length/tags_count — общие, items (JSON) — переопределения по индексу.
+    Модель вызывается параллельно, все Photo + Generation пишутся одной
+    транзакцией. Ошибки возвращаются по каждому элементу отдельно.
+    """
+    if not images_:
+        raise HTTPException(status_code=400, detail="Нужно отправить хотя бы одно изображение")
+    if len(images_) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Не больше {BATCH_MAX_ITEMS} изображений за запрос",
         )
 
-    # --- блок про теги: если 0, просим пустой массив ---
-    if tags_count <= 0:
-        tags_instruction = """
-Теги:
-- Поле "tags" в JSON должно быть пустым массивом [].
-- Не добавляй никаких тегов, просто верни "tags": [].
-"""
+    overrides = _parse_batch_items(items, len(images_))
+    _admit(
+        request,
+        "batch",
+        sum(
+            admission.estimate_cost(override.get("length", length), upload.size)
+            for upload, override in zip(images_, overrides)
+        ),
+    )
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_one(upload: UploadFile, override: dict) -> dict:
+        async with semaphore:
+            return await _run_generation(
+                upload,
+                override.get("style", style),
+                override.get("length", length),
+                int(override.get("tags_count", tags_count)),
+            )
+
+    outcomes = await asyncio.gather(
+        *(run_one(upload, override) for upload, override in zip(images_, overrides)),
+        return_exceptions=True,
+    )
+
+    succeeded = [
+        (index, result)
+        for index, result in enumerate(outcomes)
+        if not isinstance(result, BaseException)
+    ]
+    gen_ids = []
+    if succeeded:
+        with metrics.stage("db_write"):
+            gen_ids = await db_session.run_sync(
+                crud.bulk_create_generations,
+                [result for _, result in succeeded],
+                "generated_via_openai",
+            )
+    gen_ids = {index: gen_id for (index, _), gen_id in zip(succeeded, gen_ids)}
+    for index, result in succeeded:
+        _log_created(result, gen_ids[index], "batch")
+
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, BaseException):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            results.append(schemas.BatchItemResult(index=index, ok=False, error=str(detail)))
+        else:
+            results.append(
+                schemas.BatchItemResult(
+                    index=index,
+                    ok=True,
+                    generation_id=gen_ids[index],
+                    description=outcome["description"],
+                    tags=outcome["tags"],
+                )
+            )
+
+    return schemas.BatchGenerationResponse(
+        items=results,
+        succeeded=len(succeeded),
+        failed=len(outcomes) - len(succeeded),
+    )
+
+
+# ---------- МАССОВОЕ УДАЛЕНИЕ ----------
+
+# Строк на одну транзакцию DELETE: короткие блокировки и ограниченная
+# память даже при чистке за годы (каскад в дочерние таблицы — тоже в пачке)
+BULK_DELETE_BATCH = int(os.getenv("BULK_DELETE_BATCH", "500"))
+BULK_DELETE_MAX_IDS = int(os.getenv("BULK_DELETE_MAX_IDS", "10000"))
+
+
+async def _bulk_delete(
+    db_session: db.AsyncDB,
+    delete_batch: Callable,
+    data: schemas.PhotoBulkDelete,
+    **filters,
+) -> schemas.BulkDeleteResult:
+    """
+    Повторяет crud.delete_*_batch, пока есть что удалять. Каждая пачка —
+    своя транзакция: прерванный запрос оставляет уже удалённое удалённым.
+    ids режутся на куски по BULK_DELETE_BATCH, чтобы IN (...) не рос.
+    """
+    if data.ids is not None and len(data.ids) > BULK_DELETE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"ids: не больше {BULK_DELETE_MAX_IDS} за запрос")
+    filters.update(created_after=data.created_after, created_before=data.created_before)
+    if data.ids is None and all(value is None for value in filters.values()):
+        raise HTTPException(status_code=400, detail="Нужен хотя бы один фильтр")
+
+    if data.ids is None:
+        chunks = [None]
     else:
-        tags_instruction = f"""
-Теги:
-- Должно быть РОВНО {tags_count} тегов.
-- Теги — отдельные слова или короткие фразы.
-- Без решеток (#) и без запятых внутри тегов.
-- Теги должны точно соответствовать объектам и смыслу сцены.
-"""
-
-    system_instruction = f"""
-Ты — помощник приложения PhotoGen.
-Пользователь загрузил изображение.
-
-Твоя задача — вернуть СТРОГО ЧИСТЫЙ JSON без лишнего текста, формата:
-{{
-  "description": "краткое описание изображения",
-  "tags": ["тег1", "тег2", "..."]
-}}
-
-Язык:
-- Пиши по-русски.
-
-Стили описания (поле style):
-- Default      — нейтральное, обычное описание.
-- Art          — более художественное, образное, с эмоциями.
-- Realistic    — сухое, фактическое, как техническое описание.
-- Scientific   — как в научной/технической статье, с точными терминами.
-- Informative  — максимально информативно: что изображено, из чего состоит,
-                 где используется, какие важные детали.
-- Funny        — максимально весёлое и абсурдное описание с гиперболами,
-                 шутками и мемными фразами, но всё равно основанное на том,
-                 что реально есть на изображении, без мата.
-- Dialogue     — рассказ, где большая часть текста — диалоги персонажей.
-                 Используй формат реплик с тире, можно добавлять авторские
-                 вставки между диалогами.
-
-Длина описания (поле length) ДОЛЖНА СТРОГО СООТВЕТСТВОВАТЬ диапазону:
-- Short      — от 3 до 5 предложений.
-- Medium     — от 5 до 8 предложений.
-- Long       — от 10 до 15 предложений.
-- VeryLong   — не меньше 30 предложений, минимум 4 абзаца.
-
-{length_hint}
-
-Если количество предложений выходит за указанные границы,
-обязательно сократи или дополни текст, чтобы попасть в нужный диапазон.
-
-Дополнительные указания для стиля Funny:
-- используй преувеличения, неожиданные сравнения и лёгкий абсурд;
-- можно аккуратно вставлять популярные мемные выражения без мата;
-- описание всё равно должно быть связано с содержимым картинки.
-
-Дополнительные указания для стиля Dialogue:
-- делай упор на диалог персонажей, как сцена из фильма или визуальной новеллы;
-- реплики начинай с тире;
-- можно добавить немного описаний между репликами, чтобы связать сцену.
-
-ВАЖНО:
-- Не используй фразы вроде:
-  "на изображении показано", "на фото видно", "на картинке представлено",
-  "изображён/представлен" и т.п.
-  Сразу начинай с описания сцены или объекта.
-- Описание должно быть связным и логичным.
-
-{tags_instruction}
-
-Текущие параметры запроса:
-- Стиль: {style}
-- Параметр длины: {length}
-- Количество тегов: {tags_count}
-"""
+        ids = list(dict.fromkeys(data.ids))
+        chunks = [ids[i:i + BULK_DELETE_BATCH] for i in range(0, len(ids), BULK_DELETE_BATCH)]
+
+    deleted = batches = 0
+    for chunk in chunks:
+        more = True
+        while more:
+            count, more = await db_session.run_sync(
+                delete_batch,
+                ids=chunk,
+                batch=BULK_DELETE_BATCH,
+                **filters,
+            )
+            deleted += count
+            batches += 1 if count else 0
+    return schemas.BulkDeleteResult(deleted=deleted, batches=batches)
+
+
+def _log_bulk_deleted(event: str, data: schemas.PhotoBulkDelete, result: schemas.BulkDeleteResult) -> None:
+    event_log.emit(
+        "info",
+        event,
+        deleted=result.deleted,
+        batches=result.batches,
+        **data.model_dump(mode="json", exclude={"ids"}, exclude_none=True),
+        ids=len(data.ids) if data.ids is not None else None,
+    )
+
+
+# ---------- HTTP-КЭШ: ETag, 304 И READ-THROUGH ----------
+#
+# GET /photos/{id} и /generations/{id} отдают ETag и Last-Modified и
+# отвечают 304 на If-None-Match / If-Modified-Since. Готовое тело и
+# заголовки лежат в read_cache: повторное чтение не идёт в БД и не
+# сериализует ответ заново, а 304 — вообще без тела. Photo не меняется,
+# у Generation версию двигает crud.update_generation.
+
+class _ReadCacheEpoch:
+    """
+    Счётчик сбросов read_cache. Чтение, начавшееся до сброса, не кладёт
+    свой (возможно, уже устаревший) результат в кэш.
+    """
 
-    try:
-        response = client.responses.create(
-            model="gpt-4o-mini",
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_text", "text": system_instruction},
-                        {"type": "input_image", "image_url": data_url},
-                    ],
-                }
-            ],
-            max_output_tokens=2000,
-        )
+    def __init__(self):
+        self.value = 0
 
-        raw_text = response.output_text
 
-        # устойчивый парсер
-        try:
-            data = _parse_model_json(raw_text)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Модель вернула не JSON: {e}")
+read_cache_epoch = _ReadCacheEpoch()
 
-        description = data.get("description", "") or ""
-        tags = data.get("tags", [])
 
-        if not isinstance(tags, list):
-            tags = []
+def _invalidate(*keys: str) -> None:
+    read_cache_epoch.value += 1
+    for key in keys:
+        read_cache.delete(key)
 
-        # --------- ЧАСТЬ CRUD: СОХРАНЯЕМ В БД ---------
-        photo = crud.create_photo(
-            db_session,
-            file_path="generated_via_openai",
-        )
 
-        gen_in = schemas.GenerationCreate(
-            photo_id=photo.id,
-            description=description,
-            tags=tags,
-            style=style,
-            length=length,
-            tags_count=tags_count,
-        )
-        crud.create_generation(db_session, gen_in)
+def _invalidate_all() -> None:
+    read_cache_epoch.value += 1
+    read_cache.clear()
 
-        return GenerationResponse(
-            description=description,
-            tags=tags,
-            generated_image=None,
-        )
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI error: {e}")
+def _as_utc(value: datetime) -> datetime:
+    # SQLite отдаёт naive datetime в UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _cache_entry(kind: str, row_id: int, version: int, body: str, modified: datetime, **extra) -> dict:
+    modified = _as_utc(modified).replace(microsecond=0)
+    return {
+        "body": body,
+        "etag": f'"{kind}-{row_id}-{version}-{int(modified.timestamp())}"',
+        "last_modified": format_datetime(modified, usegmt=True),
+        "modified": modified.timestamp(),
+        **extra,
+    }
+
+
+def _photo_entry(photo: models.Photo) -> dict:
+    body = schemas.PhotoOut.model_validate(photo).model_dump_json()
+    return _cache_entry("p", photo.id, 1, body, photo.created_at)
+
+
+def _generation_entry(gen: models.Generation) -> dict:
+    body = schemas.GenerationOut.model_validate(gen).model_dump_json()
+    return _cache_entry(
+        "g",
+        gen.id,
+        gen.version,
+        body,
+        gen.updated_at or gen.created_at,
+        photo_id=gen.photo_id,
+    )
+
+
+def _not_modified(request: Request, entry: dict) -> bool:
+    """If-None-Match главнее If-Modified-Since (RFC 9110, 13.2.2)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or entry["etag"] in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return entry["modified"] <= _as_utc(since).timestamp()
+    return False
+
+
+def _entry_response(request: Request, entry: dict) -> Response:
+    # no-cache: клиент хранит ответ, но каждый раз перепроверяет его по ETag
+    headers = {
+        "ETag": entry["etag"],
+        "Last-Modified": entry["last_modified"],
+        "Cache-Control": "no-cache",
+    }
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type="application/json", headers=headers)
+
+
+async def _read_through(
+    request: Request,
+    key: str,
+    load: Callable[[], Awaitable[dict | None]],
+    not_found: str,
+) -> Response:
+    entry = read_cache.get(key)
+    if entry is None:
+        epoch = read_cache_epoch.value
+        entry = await load()
+        if entry is None:
+            raise HTTPException(status_code=404, detail=not_found)
+        if read_cache_epoch.value == epoch:
+            read_cache.set(key, entry)
+    return _entry_response(request, entry)
 
 
 # ======================================================
@@ -311,106 +1588,277 @@ async def generate(
 # ======================================================
 
 
+# Списки (GET /photos, GET /generations) собираются из строк crud.*_rows
+# и кодируются orjson напрямую: response_model у них только для OpenAPI,
+# pydantic-валидации на каждый элемент нет. datetime — как у pydantic
+# (UTC с суффиксом Z).
+def _json_response(payload) -> Response:
+    return Response(orjson.dumps(payload, option=orjson.OPT_UTC_Z), media_type="application/json")
+
+
+def _parse_fields(fields: str | None, allowed: tuple[str, ...]) -> tuple[str, ...]:
+    try:
+        return crud.parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/photos", response_model=schemas.PhotoOut)
-def create_photo(
+async def create_photo(
     data: schemas.PhotoCreate,
-    db_session: Session = Depends(get_db),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    photo = crud.create_photo(db_session, data.file_path)
+    photo = await db_session.run_sync(crud.create_photo, data.file_path)
     return photo
 
 
-@app.get("/photos", response_model=List[schemas.PhotoOut])
-def list_photos(
-    skip: int = 0,
-    limit: int = 100,
-    db_session: Session = Depends(get_db),
+@app.get("/photos", response_model=schemas.PhotoPage)
+async def list_photos(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    fields: str | None = Query(None, description="поля через запятую, например id,created_at"),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    photos = crud.get_photos(db_session, skip=skip, limit=limit)
-    return photos
+    """Keyset-пагинация: следующую страницу запрашивать с ?cursor=<next_cursor>."""
+    wanted = _parse_fields(fields, crud.PHOTO_FIELDS)
+    try:
+        photos, next_cursor = await db_session.run_sync(
+            crud.get_photo_rows,
+            fields=wanted,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _json_response({"items": photos, "next_cursor": next_cursor})
 
 
-@app.get("/photos/{photo_id}", response_model=schemas.PhotoOut)
-def get_photo(
+def _prepare_blob_sync(key: str) -> images.PreparedImage:
+    with blob_store.open(key) as fp:
+        return images.prepare_image(fp)
+
+
+@app.post("/photos/{photo_id}/generate", response_model=schemas.GenerationOut)
+async def regenerate_photo(
+    request: Request,
     photo_id: int,
-    db_session: Session = Depends(get_db),
+    style: str = Form("Default"),
+    length: str = Form("Medium"),
+    tags_count: int = Form(5),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    photo = crud.get_photo(db_session, photo_id)
+    """
+    Новая Generation для уже загруженного фото — из сохранённого
+    оригинала, без повторной загрузки картинки.
+    """
+    _admit(request, "interactive", admission.estimate_cost(length, image_bytes=None))
+    photo = await db_session.run_sync(crud.get_photo, photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
-    return photo
+    if blob_store is None or not storage.is_blob_key(photo.file_path):
+        raise HTTPException(status_code=409, detail="У фото нет сохранённого оригинала")
+
+    params, cached = await _lookup_digest(
+        storage.digest_from_key(photo.file_path),
+        style,
+        length,
+        tags_count,
+    )
+    if cached is not None:
+        result = {**params, **cached}
+    else:
+        try:
+            with metrics.stage("image_prepare"):
+                prepared = await run_in_threadpool(_prepare_blob_sync, photo.file_path)
+        except storage.BlobNotFound:
+            raise HTTPException(status_code=409, detail="У фото нет сохранённого оригинала")
+        except images.ImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = await _complete(params, prepared)
+
+    with metrics.stage("db_write"):
+        gen = await db_session.run_sync(crud.create_generation_for_photo, photo_id, result)
+    if not gen:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    _log_created(result, gen.id, "regenerate")
+    return gen
+
+
+@app.get("/photos/{photo_id}", response_model=schemas.PhotoOut)
+async def get_photo(
+    request: Request,
+    photo_id: int,
+    db_session: db.AsyncDB = Depends(get_db),
+):
+    """ETag / Last-Modified, 304 на условный запрос; повторные чтения — из read_cache."""
+    async def load() -> dict | None:
+        photo = await db_session.run_sync(crud.get_photo, photo_id)
+        return _photo_entry(photo) if photo else None
+
+    return await _read_through(request, f"photo:{photo_id}", load, "Photo not found")
 
 
 @app.delete("/photos/{photo_id}")
-def delete_photo(
+async def delete_photo(
     photo_id: int,
-    db_session: Session = Depends(get_db),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    ok = crud.delete_photo(db_session, photo_id)
+    # generations фото удалит каскад в БД — их id нужны, чтобы сбросить кэш
+    gen_ids = await db_session.run_sync(crud.get_generation_ids, photo_id) if read_cache.enabled else []
+    ok = await db_session.run_sync(crud.delete_photo, photo_id)
+    _invalidate(f"photo:{photo_id}", *(f"generation:{gen_id}" for gen_id in gen_ids))
     if not ok:
         raise HTTPException(status_code=404, detail="Photo not found")
     return {"status": "deleted"}
 
 
+@app.post("/photos/bulk-delete", response_model=schemas.BulkDeleteResult)
+async def bulk_delete_photos(
+    data: schemas.PhotoBulkDelete,
+    db_session: db.AsyncDB = Depends(get_db),
+):
+    """
+    Удаление photos (вместе с их generations) по списку id и/или диапазону
+    created_at — пачками по BULK_DELETE_BATCH, каждая своей транзакцией.
+    """
+    result = await _bulk_delete(db_session, crud.delete_photos_batch, data)
+    _invalidate_all()
+    _log_bulk_deleted("photos.bulk_deleted", data, result)
+    return result
+
+
 # ======================================================
 #                    CRUD: GENERATIONS
 # ======================================================
 
 
 @app.post("/generations", response_model=schemas.GenerationOut)
-def create_generation(
+async def create_generation(
     data: schemas.GenerationCreate,
-    db_session: Session = Depends(get_db),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    photo = crud.get_photo(db_session, data.photo_id)
+    photo = await db_session.run_sync(crud.get_photo, data.photo_id)
     if not photo:
         raise HTTPException(status_code=400, detail="Photo not found")
 
-    gen = crud.create_generation(db_session, data)
+    gen = await db_session.run_sync(crud.create_generation, data)
     return gen
 
 
-@app.get("/generations", response_model=List[schemas.GenerationOut])
-def list_generations(
-    skip: int = 0,
-    limit: int = 100,
-    db_session: Session = Depends(get_db),
+@app.get("/generations", response_model=schemas.GenerationPage)
+async def list_generations(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    tag: List[str] | None = Query(None),
+    match: Literal["any", "all"] = "any",
+    tag_prefix: str | None = None,
+    fields: str | None = Query(None, description="поля через запятую, например id,tags,created_at"),
+    description: Literal["full", "preview", "none"] = "full",
+    preview_chars: int = Query(200, ge=1, le=5000),
+    db_session: db.AsyncDB = Depends(get_db),
+):
+    """
+    Keyset-пагинация: следующую страницу запрашивать с ?cursor=<next_cursor>.
+    Фильтр по тегам: ?tag=кот&tag=сон&match=all, ?tag_prefix=ко.
+    Лёгкие страницы: ?fields=id,tags,created_at — только эти поля;
+    ?description=preview&preview_chars=200 — начало описания,
+    ?description=none — без описаний.
+    """
+    wanted = _parse_fields(fields, crud.GENERATION_FIELDS)
+    try:
+        gens, next_cursor = await db_session.run_sync(
+            crud.get_generation_rows,
+            fields=wanted,
+            description=description,
+            preview_chars=preview_chars,
+            cursor=cursor,
+            limit=limit,
+            tags=tag,
+            match=match,
+            tag_prefix=tag_prefix,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _json_response({"items": gens, "next_cursor": next_cursor})
+
+
+@app.get("/generations/search", response_model=schemas.GenerationSearchResults)
+async def search_generations(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=500),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    gens = crud.get_generations(db_session, skip=skip, limit=limit)
-    return gens
+    """Полнотекстовый поиск по описаниям: результаты по релевантности + сниппеты."""
+    hits = await db_session.run_sync(
+        search.search_generations,
+        q,
+        limit=limit,
+        offset=offset,
+    )
+    return schemas.GenerationSearchResults(items=hits)
 
 
 @app.get("/generations/{gen_id}", response_model=schemas.GenerationOut)
-def get_generation(
+async def get_generation(
+    request: Request,
     gen_id: int,
-    db_session: Session = Depends(get_db),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    gen = crud.get_generation(db_session, gen_id)
-    if not gen:
-        raise HTTPException(status_code=404, detail="Generation not found")
-    return gen
+    """ETag / Last-Modified, 304 на условный запрос; повторные чтения — из read_cache."""
+    async def load() -> dict | None:
+        gen = await db_session.run_sync(crud.get_generation, gen_id)
+        return _generation_entry(gen) if gen else None
+
+    return await _read_through(request, f"generation:{gen_id}", load, "Generation not found")
 
 
 @app.put("/generations/{gen_id}", response_model=schemas.GenerationOut)
-def update_generation(
+async def update_generation(
     gen_id: int,
     data: schemas.GenerationUpdate,
-    db_session: Session = Depends(get_db),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    gen = crud.get_generation(db_session, gen_id)
+    gen = await db_session.run_sync(crud.get_generation, gen_id)
     if not gen:
         raise HTTPException(status_code=404, detail="Generation not found")
 
-    gen = crud.update_generation(db_session, gen, data)
+    gen = await db_session.run_sync(crud.update_generation, gen, data)
+    _invalidate(f"generation:{gen_id}")
     return gen
 
 
 @app.delete("/generations/{gen_id}")
-def delete_generation(
+async def delete_generation(
     gen_id: int,
-    db_session: Session = Depends(get_db),
+    db_session: db.AsyncDB = Depends(get_db),
 ):
-    ok = crud.delete_generation(db_session, gen_id)
+    ok = await db_session.run_sync(crud.delete_generation, gen_id)
+    _invalidate(f"generation:{gen_id}")
     if not ok:
         raise HTTPException(status_code=404, detail="Generation not found")
     return {"status": "deleted"}
+
+
+@app.post("/generations/bulk-delete", response_model=schemas.BulkDeleteResult)
+async def bulk_delete_generations(
+    data: schemas.GenerationBulkDelete,
+    db_session: db.AsyncDB = Depends(get_db),
+):
+    """
+    Удаление generations по списку id, photo_id и/или диапазону created_at
+    (фильтры через AND) — пачками по BULK_DELETE_BATCH, каждая своей транзакцией.
+    """
+    result = await _bulk_delete(
+        db_session,
+        crud.delete_generations_batch,
+        data,
+        photo_id=data.photo_id,
+    )
+    _invalidate_all()
+    _log_bulk_deleted("generations.bulk_deleted", data, result)
+    return result
+
+
+# импорт app.main закончен (см. GET /ready)
+readiness.import_seconds = time.perf_counter() - _IMPORT_STARTED
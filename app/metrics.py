@@ -0,0 +1,263 @@
+# app/metrics.py
+"""
+Метрики в текстовом формате Prometheus (GET /metrics).
+
+Свой маленький реестр вместо prometheus_client: счётчики, gauge и
+гистограммы с метками, плюс «коллекторы» — функции, которые отдают
+значения на момент скрейпа (статистика кэша, upstream, пула БД).
+Запись — несколько операций со словарём под общим lock-ом, поэтому
+метрики можно держать включёнными в проде.
+
+- MetricsMiddleware — чистый ASGI: латентность и статус по шаблону
+  маршрута (/generations/{gen_id}, а не по конкретному id) + in-flight;
+- stage("...") — таймер этапа конвейера /generate;
+- record_usage — токены из response.usage OpenAI.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+
+_LE_INF = 'le="+Inf"'
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def expose(self) -> list[str]:
+        with _lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with _lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по бакетам..., sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, *labels, value: float) -> None:
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - started)
+
+    def expose(self) -> list[str]:
+        with _lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, _LE_INF)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+# Коллектор: () -> [(имя, тип, описание, [(labels dict, значение), ...]), ...]
+Collector = Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Collector] = []
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, fn: Collector) -> Collector:
+        self._collectors.append(fn)
+        return fn
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_str = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_str} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "photogen_http_requests_total",
+    "HTTP-запросы по маршруту и статусу.",
+    ("method", "route", "status"),
+)
+http_duration = registry.histogram(
+    "photogen_http_request_duration_seconds",
+    "Время обработки HTTP-запроса (до конца тела ответа).",
+    ("method", "route"),
+)
+http_in_flight = registry.gauge(
+    "photogen_http_requests_in_flight",
+    "HTTP-запросы в обработке.",
+    ("method",),
+)
+stage_duration = registry.histogram(
+    "photogen_stage_duration_seconds",
+    "Время этапов конвейера генерации.",
+    ("stage",),
+)
+openai_tokens = registry.counter(
+    "photogen_openai_tokens_total",
+    "Токены OpenAI из response.usage (input/cached_input/output).",
+    ("kind",),
+)
+generation_source = registry.counter(
+    "photogen_generation_results_total",
+    "Откуда взят результат генерации: cache / near_duplicate / model.",
+    ("source",),
+)
+
+
+def stage(name: str):
+    """with metrics.stage("upstream"): ... — таймер этапа генерации."""
+    return stage_duration.time(name)
+
+
+def record_usage(usage) -> None:
+    if usage is None:
+        return
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", 0) or 0
+    details = getattr(usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    openai_tokens.inc("input", amount=input_tokens)
+    openai_tokens.inc("cached_input", amount=cached)
+    openai_tokens.inc("output", amount=output_tokens)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность/статус/in-flight по шаблону маршрута."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+        # шаблон маршрута известен только после роутинга, поэтому
+        # in-flight — только по методу
+        http_in_flight.inc(method)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec(method)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            http_duration.observe(method, path, value=time.perf_counter() - started)
+            http_requests.inc(method, path, str(status))
@@ -0,0 +1,114 @@
+# app/migrations/__init__.py
+"""
+Версионные миграции схемы БД вместо create_all при импорте app.main.
+
+Каждая миграция — модуль vNNNN_*.py с VERSION и upgrade(conn), таблицы
+в нём описаны своей MetaData (снимок схемы на момент миграции, а не
+текущие models.py). Применённые версии пишутся в schema_migrations;
+каждая миграция — отдельная транзакция, в Postgres под advisory lock,
+так что параллельный запуск с нескольких инстансов безопасен.
+
+    python -m app.migrations upgrade        # до последней версии
+    python -m app.migrations upgrade 5      # до версии 5
+    python -m app.migrations current        # текущая версия
+    python -m app.migrations history        # список с отметкой применённых
+    python -m app.migrations check          # exit 1, если есть неприменённые
+
+Новая миграция: следующий vNNNN_*.py + запись в MIGRATIONS. Операции
+из ops пропускают уже существующее — базы, созданные раньше через
+create_all, доводятся до последней версии без ручного stamp.
+"""
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from .. import models
+from . import (
+    v0001_baseline,
+    v0002_generation_cache_key,
+    v0003_jobs,
+    v0004_keyset_indexes,
+    v0005_generation_tags,
+    v0006_description_fts,
+    v0007_phash,
+    v0008_job_file_path,
+    v0009_fk_indexes,
+    v0010_generation_version,
+)
+
+
+MIGRATIONS = (
+    v0001_baseline,
+    v0002_generation_cache_key,
+    v0003_jobs,
+    v0004_keyset_indexes,
+    v0005_generation_tags,
+    v0006_description_fts,
+    v0007_phash,
+    v0008_job_file_path,
+    v0009_fk_indexes,
+    v0010_generation_version,
+)
+
+HEAD = MIGRATIONS[-1].VERSION
+
+# произвольная константа для pg_advisory_xact_lock
+_PG_LOCK_KEY = 0x70686F746F67656E  # "photogen"
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", models.Timestamp, server_default=func.now(), nullable=False),
+)
+
+
+def _name(migration) -> str:
+    return migration.__name__.rsplit(".", 1)[-1]
+
+
+def _lock(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    if not conn.dialect.has_table(conn, schema_migrations.name):
+        return set()
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def current(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return max(applied_versions(conn), default=0)
+
+
+def pending(engine: Engine) -> list:
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [m for m in MIGRATIONS if m.VERSION not in done]
+
+
+def upgrade(engine: Engine, target: int | None = None, log=print) -> list[int]:
+    """Применяет неприменённые миграции до target включительно; возвращает их версии."""
+    with engine.begin() as conn:
+        _lock(conn)
+        schema_migrations.create(conn, checkfirst=True)
+
+    done = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.VERSION > target:
+            break
+        with engine.begin() as conn:
+            _lock(conn)
+            # перепроверка под lock-ом: другой инстанс мог успеть раньше
+            if migration.VERSION in applied_versions(conn):
+                continue
+            log(f"миграция {migration.VERSION:04d} {_name(migration)}")
+            migration.upgrade(conn)
+            conn.execute(
+                schema_migrations.insert().values(version=migration.VERSION, name=_name(migration))
+            )
+        done.append(migration.VERSION)
+    return done
@@ -0,0 +1,45 @@
+# app/migrations/__main__.py
+"""python -m app.migrations [upgrade [VERSION] | current | history | check]"""
+import argparse
+import sys
+
+from .. import db
+from . import HEAD, MIGRATIONS, _name, current, pending, upgrade
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.migrations", description="Миграции схемы БД")
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upgrade", help="применить миграции")
+    up.add_argument("version", type=int, nargs="?", default=None)
+    sub.add_parser("current", help="текущая версия схемы")
+    sub.add_parser("history", help="все миграции с отметкой применённых")
+    sub.add_parser("check", help="exit 1, если есть неприменённые миграции")
+    args = parser.parse_args(argv)
+
+    engine = db.init_engines()
+    try:
+        if args.command == "upgrade":
+            done = upgrade(engine, args.version)
+            print(f"схема на версии {current(engine)}" + ("" if done else " (нечего применять)"))
+        elif args.command == "current":
+            print(f"{current(engine)} (последняя {HEAD})")
+        elif args.command == "history":
+            waiting = {m.VERSION for m in pending(engine)}
+            for migration in MIGRATIONS:
+                mark = " " if migration.VERSION in waiting else "x"
+                doc = (migration.__doc__ or "").strip()
+                print(f"[{mark}] {migration.VERSION:04d} {_name(migration)} — {doc}")
+        elif args.command == "check":
+            waiting = pending(engine)
+            if waiting:
+                print("не применены: " + ", ".join(_name(m) for m in waiting))
+                return 1
+            print("схема актуальна")
+    finally:
+        engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+# app/migrations/ops.py
+"""
+Операции для миграций. Все — «если ещё нет»: базы, созданные раньше
+через create_all, могут уже содержать часть схемы, и миграция на них
+должна просто пройти дальше.
+"""
+from sqlalchemy import Column, Index, Table, inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+
+
+def has_table(conn: Connection, name: str) -> bool:
+    return inspect(conn).has_table(name)
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(col["name"] == column for col in inspect(conn).get_columns(table))
+
+
+def create_table(conn: Connection, table: Table) -> bool:
+    """True — таблица создана сейчас."""
+    if has_table(conn, table.name):
+        return False
+    table.create(conn)
+    return True
+
+
+def add_column(conn: Connection, column: Column) -> bool:
+    """column должна принадлежать Table (из MetaData миграции)."""
+    table = column.table.name
+    if has_column(conn, table, column.name):
+        return False
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+    return True
+
+
+def create_index(conn: Connection, index: Index) -> None:
+    index.create(conn, checkfirst=True)
@@ -0,0 +1,46 @@
+"""photos, generations, logs — исходная схема."""
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table, Text, func
+
+from .. import models
+from . import ops
+
+
+VERSION = 1
+
+meta = MetaData()
+
+photos = Table(
+    "photos",
+    meta,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("file_path", Text, nullable=False),
+    Column("created_at", models.Timestamp, server_default=func.now(), nullable=False),
+)
+
+generations = Table(
+    "generations",
+    meta,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("photo_id", Integer, ForeignKey("photos.id", ondelete="CASCADE"), nullable=False),
+    Column("description", Text, nullable=False),
+    Column("tags", models.StringArray, nullable=False),
+    Column("style", String(50), nullable=False),
+    Column("length", String(20), nullable=False),
+    Column("tags_count", Integer, nullable=False),
+    Column("created_at", models.Timestamp, server_default=func.now(), nullable=False),
+)
+
+logs = Table(
+    "logs",
+    meta,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("generation_id", Integer, ForeignKey("generations.id", ondelete="CASCADE"), nullable=True),
+    Column("level", String(20), nullable=False),
+    Column("message", Text, nullable=False),
+    Column("created_at", models.Timestamp, server_default=func.now(), nullable=False),
+)
+
+
+def upgrade(conn) -> None:
+    for table in (photos, generations, logs):
+        ops.create_table(conn, table)
@@ -0,0 +1,21 @@
+"""generations.cache_key — ключ кэша результатов /generate."""
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table
+
+from . import ops
+
+
+VERSION = 2
+
+meta = MetaData()
+
+generations = Table(
+    "generations",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("cache_key", String(64), nullable=True),
+)
+
+
+def upgrade(conn) -> None:
+    ops.add_column(conn, generations.c.cache_key)
+    ops.create_index(conn, Index("ix_generations_cache_key", generations.c.cache_key))
@@ -0,0 +1,45 @@
+"""jobs — асинхронные задачи /generate?async=1."""
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    Text,
+    func,
+)
+
+from .. import models
+from . import ops
+
+
+VERSION = 3
+
+meta = MetaData()
+
+# только для внешнего ключа
+Table("generations", meta, Column("id", Integer, primary_key=True))
+
+jobs = Table(
+    "jobs",
+    meta,
+    Column("id", String(32), primary_key=True),
+    Column("status", String(20), nullable=False, index=True),
+    Column("style", String(50), nullable=False),
+    Column("length", String(20), nullable=False),
+    Column("tags_count", Integer, nullable=False),
+    Column("cache_key", String(64), nullable=True),
+    Column("image_data", LargeBinary, nullable=True),
+    Column("image_mime", String(50), nullable=True),
+    Column("generation_id", Integer, ForeignKey("generations.id", ondelete="SET NULL"), nullable=True),
+    Column("error", Text, nullable=True),
+    Column("attempts", Integer, nullable=False),
+    Column("created_at", models.Timestamp, server_default=func.now(), nullable=False),
+    Column("updated_at", models.Timestamp, server_default=func.now(), nullable=False),
+)
+
+
+def upgrade(conn) -> None:
+    ops.create_table(conn, jobs)
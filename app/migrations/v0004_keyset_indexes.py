@@ -0,0 +1,31 @@
+"""(created_at, id) на photos и generations — keyset-пагинация."""
+from sqlalchemy import Column, Index, Integer, MetaData, Table
+
+from .. import models
+from . import ops
+
+
+VERSION = 4
+
+meta = MetaData()
+
+photos = Table(
+    "photos",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("created_at", models.Timestamp),
+)
+generations = Table(
+    "generations",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("created_at", models.Timestamp),
+)
+
+
+def upgrade(conn) -> None:
+    ops.create_index(conn, Index("ix_photos_created_at_id", photos.c.created_at, photos.c.id))
+    ops.create_index(
+        conn,
+        Index("ix_generations_created_at_id", generations.c.created_at, generations.c.id),
+    )
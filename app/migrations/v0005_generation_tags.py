@@ -0,0 +1,78 @@
+"""generation_tags — индекс тегов для /generations?tag=...; заполняется по generations.tags."""
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    exists,
+    select,
+)
+
+from .. import crud, models
+from . import ops
+
+
+VERSION = 5
+
+BACKFILL_BATCH = 1000
+
+meta = MetaData()
+
+generations = Table(
+    "generations",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("tags", models.StringArray),
+)
+
+generation_tags = Table(
+    "generation_tags",
+    meta,
+    Column("generation_id", Integer, ForeignKey("generations.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag", String(100), primary_key=True),
+)
+
+tag_index = Index(
+    "ix_generation_tags_tag",
+    generation_tags.c.tag,
+    generation_tags.c.generation_id,
+    postgresql_ops={"tag": "text_pattern_ops"},
+)
+
+
+def _backfill(conn) -> None:
+    """Теги генераций, созданных до появления таблицы (пачками по id)."""
+    has_rows = exists().where(generation_tags.c.generation_id == generations.c.id)
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(generations.c.id, generations.c.tags)
+            .where(generations.c.id > last_id, ~has_rows)
+            .order_by(generations.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            return
+
+        values = []
+        for gen_id, tags in rows:
+            seen = set()
+            for tag in tags or []:
+                if not isinstance(tag, str):
+                    continue
+                tag = crud.normalize_tag(tag)
+                if tag and tag not in seen:
+                    seen.add(tag)
+                    values.append({"generation_id": gen_id, "tag": tag})
+        if values:
+            conn.execute(generation_tags.insert(), values)
+        last_id = rows[-1].id
+
+
+def upgrade(conn) -> None:
+    ops.create_table(conn, generation_tags)
+    ops.create_index(conn, tag_index)
+    _backfill(conn)
@@ -0,0 +1,26 @@
+"""Полнотекстовый поиск по generations.description: GIN в Postgres, FTS5 в SQLite."""
+from sqlalchemy import text
+
+from .. import models
+from . import ops
+
+
+VERSION = 6
+
+
+def upgrade(conn) -> None:
+    if conn.dialect.name == "postgresql":
+        # выражение должно совпадать с models.description_tsvector
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_generations_description_fts ON generations "
+                "USING gin (to_tsvector('russian'::regconfig, description))"
+            )
+        )
+    elif conn.dialect.name == "sqlite":
+        created = not ops.has_table(conn, "generations_fts")
+        for ddl in models.SQLITE_FTS_DDL:
+            conn.execute(text(ddl))
+        if created:
+            # внешняя FTS5-таблица: индексируем уже существующие строки
+            conn.execute(text("INSERT INTO generations_fts(generations_fts) VALUES ('rebuild')"))
@@ -0,0 +1,34 @@
+"""photos.phash + полосы phash_b0..b3 с индексами, jobs.image_phash — поиск почти-дубликатов."""
+from sqlalchemy import BigInteger, Column, Index, Integer, MetaData, String, Table
+
+from . import ops
+
+
+VERSION = 7
+
+BANDS = ("phash_b0", "phash_b1", "phash_b2", "phash_b3")
+
+meta = MetaData()
+
+photos = Table(
+    "photos",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("phash", BigInteger, nullable=True),
+    *(Column(band, Integer, nullable=True) for band in BANDS),
+)
+
+jobs = Table(
+    "jobs",
+    meta,
+    Column("id", String(32), primary_key=True),
+    Column("image_phash", BigInteger, nullable=True),
+)
+
+
+def upgrade(conn) -> None:
+    ops.add_column(conn, photos.c.phash)
+    for band in BANDS:
+        ops.add_column(conn, photos.c[band])
+        ops.create_index(conn, Index(f"ix_photos_{band}", photos.c[band]))
+    ops.add_column(conn, jobs.c.image_phash)
@@ -0,0 +1,20 @@
+"""jobs.file_path — ключ оригинала в хранилище блобов (app/storage.py)."""
+from sqlalchemy import Column, MetaData, String, Table, Text
+
+from . import ops
+
+
+VERSION = 8
+
+meta = MetaData()
+
+jobs = Table(
+    "jobs",
+    meta,
+    Column("id", String(32), primary_key=True),
+    Column("file_path", Text, nullable=True),
+)
+
+
+def upgrade(conn) -> None:
+    ops.add_column(conn, jobs.c.file_path)
@@ -0,0 +1,39 @@
+"""Индексы по внешним ключам generations.photo_id, logs.generation_id, jobs.generation_id.
+
+Postgres сам не индексирует ссылающиеся колонки: без них каскадное
+удаление (ON DELETE CASCADE / SET NULL) на каждую удаляемую строку
+сканирует дочернюю таблицу целиком.
+"""
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table
+
+from . import ops
+
+
+VERSION = 9
+
+meta = MetaData()
+
+generations = Table(
+    "generations",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("photo_id", Integer),
+)
+logs = Table(
+    "logs",
+    meta,
+    Column("id", Integer, primary_key=True),
+    Column("generation_id", Integer),
+)
+jobs = Table(
+    "jobs",
+    meta,
+    Column("id", String(32), primary_key=True),
+    Column("generation_id", Integer),
+)
+
+
+def upgrade(conn) -> None:
+    ops.create_index(conn, Index("ix_generations_photo_id", generations.c.photo_id))
+    ops.create_index(conn, Index("ix_logs_generation_id", logs.c.generation_id))
+    ops.create_index(conn, Index("ix_jobs_generation_id", jobs.c.generation_id))
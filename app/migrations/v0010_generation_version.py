@@ -0,0 +1,24 @@
+"""generations.version и generations.updated_at — ETag и Last-Modified для GET /generations/{id}."""
+from sqlalchemy import Column, Integer, MetaData, Table
+
+from .. import models
+from . import ops
+
+
+VERSION = 10
+
+meta = MetaData()
+
+generations = Table(
+    "generations",
+    meta,
+    Column("id", Integer, primary_key=True),
+    # константный DEFAULT: SQLite не добавляет NOT NULL-колонку без него
+    Column("version", Integer, server_default="1", nullable=False),
+    Column("updated_at", models.Timestamp, nullable=True),
+)
+
+
+def upgrade(conn) -> None:
+    ops.add_column(conn, generations.c.version)
+    ops.add_column(conn, generations.c.updated_at)
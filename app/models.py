@@ -2,14 +2,21 @@
 import json
 
 from sqlalchemy import (
+    DDL,
+    BigInteger,
     Column,
     Integer,
     Text,
     String,
     DateTime,
+    LargeBinary,
     ForeignKey,
+    Index,
+    event,
     func,
+    literal_column,
 )
+from sqlalchemy.dialects import postgresql, sqlite  # noqa: F401 — регистрирует FTS-функции Postgres
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import TypeDecorator
 
@@ -38,26 +45,65 @@ class StringArray(TypeDecorator):
         return json.loads(value)
 
 
+# created_at у всех таблиц. В SQLite CURRENT_TIMESTAMP пишет время без
+# микросекунд — привязываем параметры в том же формате, иначе сравнение
+# строк в keyset-пагинации (created_at, id) < (...) ломается на равных секундах.
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(truncate_microseconds=True),
+    "sqlite",
+)
+
+
+# Полнотекстовый поиск по description (см. app/search.py).
+# Конфигурация — литерал, а не параметр: иначе Postgres не сматчит выражение
+# запроса с выражением GIN-индекса.
+FTS_CONFIG = literal_column("'russian'::regconfig")
+
+
+def description_tsvector(column):
+    return func.to_tsvector(FTS_CONFIG, column)
+
+
 class Photo(Base):
     __tablename__ = "photos"
+    __mapper_args__ = {"eager_defaults": True}  # server defaults через RETURNING
 
     id = Column(Integer, primary_key=True, index=True)
     file_path = Column(Text, nullable=False)  # путь к файлу или ключ
+
+    # перцептивный dHash (64 бита, со знаком — под BIGINT) и его четыре
+    # 16-битные полосы: multi-index hashing для поиска по расстоянию
+    # Хэмминга (см. app/dedup.py)
+    phash = Column(BigInteger, nullable=True)
+    phash_b0 = Column(Integer, nullable=True, index=True)
+    phash_b1 = Column(Integer, nullable=True, index=True)
+    phash_b2 = Column(Integer, nullable=True, index=True)
+    phash_b3 = Column(Integer, nullable=True, index=True)
+
     created_at = Column(
-        DateTime(timezone=True),
+        Timestamp,
         server_default=func.now(),
         nullable=False,
     )
 
+    # каскад делает БД (ondelete="CASCADE" у Generation.photo_id):
+    # при удалении Photo дочерние Generation не грузятся в сессию
     generations = relationship(
         "Generation",
         back_populates="photo",
         cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        # keyset-пагинация: ORDER BY created_at DESC, id DESC
+        Index("ix_photos_created_at_id", "created_at", "id"),
     )
 
 
 class Generation(Base):
     __tablename__ = "generations"
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
 
@@ -65,6 +111,7 @@ class Generation(Base):
         Integer,
         ForeignKey("photos.id", ondelete="CASCADE"),
         nullable=False,
+        index=True,  # каскадное удаление photo; без индекса — seq scan в Postgres
     )
 
     description = Column(Text, nullable=False)
@@ -74,28 +121,164 @@ class Generation(Base):
     length = Column(String(20), nullable=False)
     tags_count = Column(Integer, nullable=False)
 
+    # ключ кэша результатов /generate (см. app/cache.py)
+    cache_key = Column(String(64), nullable=True, index=True)
+
     created_at = Column(
-        DateTime(timezone=True),
+        Timestamp,
         server_default=func.now(),
         nullable=False,
     )
+    # ETag / Last-Modified для GET /generations/{id}: оба меняет
+    # crud.update_generation; updated_at=NULL — строка не менялась
+    version = Column(Integer, server_default="1", nullable=False)
+    updated_at = Column(Timestamp, onupdate=func.now(), nullable=True)
 
     photo = relationship("Photo", back_populates="generations")
 
+    # нормализованная копия tags для поиска по индексу (см. crud.sync_tags)
+    tag_rows = relationship(
+        "GenerationTag",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        Index("ix_generations_created_at_id", "created_at", "id"),
+        Index(
+            "ix_generations_description_fts",
+            description_tsvector(description),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+    )
+
+
+# SQLite: внешняя FTS5-таблица поверх generations + триггеры синхронизации.
+# В FK-каскадах (удаление photo) триггеры тоже срабатывают.
+# Те же DDL выполняет миграция 0006 (app/migrations).
+SQLITE_FTS_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+        description,
+        content='generations',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS generations_fts_ai AFTER INSERT ON generations BEGIN
+        INSERT INTO generations_fts(rowid, description) VALUES (new.id, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS generations_fts_ad AFTER DELETE ON generations BEGIN
+        INSERT INTO generations_fts(generations_fts, rowid, description)
+        VALUES ('delete', old.id, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS generations_fts_au AFTER UPDATE OF description ON generations BEGIN
+        INSERT INTO generations_fts(generations_fts, rowid, description)
+        VALUES ('delete', old.id, old.description);
+        INSERT INTO generations_fts(rowid, description) VALUES (new.id, new.description);
+    END
+    """,
+)
+
+for _ddl in SQLITE_FTS_DDL:
+    event.listen(
+        Generation.__table__,
+        "after_create",
+        DDL(_ddl).execute_if(dialect="sqlite"),
+    )
+
+event.listen(
+    Generation.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS generations_fts").execute_if(dialect="sqlite"),
+)
+
+
+class GenerationTag(Base):
+    """Одна строка на (generation, тег): индекс для /generations?tag=..."""
+    __tablename__ = "generation_tags"
+
+    generation_id = Column(
+        Integer,
+        ForeignKey("generations.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    tag = Column(String(100), primary_key=True)  # lower-case, без пробелов по краям
+
+    __table_args__ = (
+        # точное совпадение и префикс (LIKE 'abc%' в Postgres — через text_pattern_ops)
+        Index(
+            "ix_generation_tags_tag",
+            "tag",
+            "generation_id",
+            postgresql_ops={"tag": "text_pattern_ops"},
+        ),
+    )
+
 
 class Log(Base):
     __tablename__ = "logs"
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     generation_id = Column(
         Integer,
         ForeignKey("generations.id", ondelete="CASCADE"),
         nullable=True,
+        index=True,
     )
     level = Column(String(20), nullable=False)   # info / error / warning
     message = Column(Text, nullable=False)
     created_at = Column(
-        DateTime(timezone=True),
+        Timestamp,
+        server_default=func.now(),
+        nullable=False,
+    )
+
+
+class Job(Base):
+    """Асинхронная задача генерации (POST /generate?async=1)."""
+    __tablename__ = "jobs"
+    __mapper_args__ = {"eager_defaults": True}
+
+    id = Column(String(32), primary_key=True)  # uuid4().hex
+    status = Column(String(20), nullable=False, index=True)  # queued / running / done / failed
+
+    style = Column(String(50), nullable=False)
+    length = Column(String(20), nullable=False)
+    tags_count = Column(Integer, nullable=False)
+    cache_key = Column(String(64), nullable=True)
+
+    # уже подготовленная (уменьшенная) картинка; очищается после выполнения
+    image_data = Column(LargeBinary, nullable=True)
+    image_mime = Column(String(50), nullable=True)
+    image_phash = Column(BigInteger, nullable=True)  # dHash картинки, см. Photo.phash
+    file_path = Column(Text, nullable=True)  # ключ оригинала в app/storage.py
+
+    generation_id = Column(
+        Integer,
+        ForeignKey("generations.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True,
+    )
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(
+        Timestamp,
         server_default=func.now(),
         nullable=False,
     )
+    updated_at = Column(
+        Timestamp,
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    generation = relationship("Generation")
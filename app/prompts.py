@@ -0,0 +1,278 @@
+# app/prompts.py
+"""
+Реестр промптов для генерации описаний.
+
+Промпт делится на две части:
+- STATIC_PREFIX — общие инструкции (формат JSON, стили, диапазоны длины,
+  правила). Один и тот же текст для всех запросов, поэтому идёт первым
+  сообщением и попадает в prompt caching на стороне OpenAI;
+- суффикс — подсказка по длине, блок про теги и параметры запроса.
+  Шаблон суффикса компилируется один раз на (style, length, режим тегов),
+  на запрос подставляется только количество тегов.
+
+PROMPT_VERSION входит в ключ кэша результатов (app/cache.py):
+поменяли текст промпта или формат ответа — поднимаем версию.
+
+render_variants — несколько вариантов (style/length/tags_count) одной
+картинки в одном запросе: каждый вариант — тот же скомпилированный суффикс.
+
+REPAIR_PREFIX / render_repair — текстовый промпт для исправления ответа,
+который не прошёл app/validation.py (картинка повторно не отправляется).
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from string import Template
+
+
+PROMPT_VERSION = "3"
+
+STYLES = (
+    "Default",
+    "Art",
+    "Realistic",
+    "Scientific",
+    "Informative",
+    "Funny",
+    "Dialogue",
+)
+
+DEFAULT_LENGTH = "Medium"
+
+# допустимое количество предложений для каждого length
+LENGTH_SENTENCES = {
+    "Short": (3, 5),
+    "Medium": (5, 8),
+    "Long": (10, 15),
+    "VeryLong": (30, 50),
+}
+
+# --- подсказка по длине ---
+# Short: 3–5 предложений
+# Medium: 5–8 предложений
+# Long: 10–15 предложений
+# VeryLong: 30+ предложений, минимум 4 абзаца
+LENGTH_HINTS = {
+    "Short": (
+        "Для параметра длины ('Short') напиши от 3 до 5 предложений. "
+        "Меньше 3 и больше 5 предложений писать нельзя."
+    ),
+    "Medium": (
+        "Для параметра длины ('Medium') напиши от 5 до 8 предложений. "
+        "Текст должен укладываться строго в диапазон 5–8 предложений."
+    ),
+    "Long": (
+        "Для параметра длины ('Long') напиши от 10 до 15 предложений. "
+        "Нельзя делать меньше 10 и больше 15 предложений."
+    ),
+    "VeryLong": (
+        "Для параметра длины ('VeryLong') напиши большой связный рассказ "
+        "объёмом не меньше 30 предложений. "
+        "Разбей текст как минимум на 4 абзаца. "
+        "Каждый абзац должен содержать не меньше 6–8 предложений. "
+        "В целом ориентируйся на диапазон 30–50 предложений."
+    ),
+}
+
+STATIC_PREFIX = """
+Ты — помощник приложения PhotoGen.
+Пользователь загрузил изображение.
+
+Твоя задача — вернуть СТРОГО ЧИСТЫЙ JSON без лишнего текста, формата:
+{
+  "description": "краткое описание изображения",
+  "tags": ["тег1", "тег2", "..."]
+}
+
+Язык:
+- Пиши по-русски.
+
+Стили описания (поле style):
+- Default      — нейтральное, обычное описание.
+- Art          — более художественное, образное, с эмоциями.
+- Realistic    — сухое, фактическое, как техническое описание.
+- Scientific   — как в научной/технической статье, с точными терминами.
+- Informative  — максимально информативно: что изображено, из чего состоит,
+                 где используется, какие важные детали.
+- Funny        — максимально весёлое и абсурдное описание с гиперболами,
+                 шутками и мемными фразами, но всё равно основанное на том,
+                 что реально есть на изображении, без мата.
+- Dialogue     — рассказ, где большая часть текста — диалоги персонажей.
+                 Используй формат реплик с тире, можно добавлять авторские
+                 вставки между диалогами.
+
+Длина описания (поле length) ДОЛЖНА СТРОГО СООТВЕТСТВОВАТЬ диапазону:
+- Short      — от 3 до 5 предложений.
+- Medium     — от 5 до 8 предложений.
+- Long       — от 10 до 15 предложений.
+- VeryLong   — не меньше 30 предложений, минимум 4 абзаца.
+
+Если количество предложений выходит за указанные границы,
+обязательно сократи или дополни текст, чтобы попасть в нужный диапазон.
+
+Дополнительные указания для стиля Funny:
+- используй преувеличения, неожиданные сравнения и лёгкий абсурд;
+- можно аккуратно вставлять популярные мемные выражения без мата;
+- описание всё равно должно быть связано с содержимым картинки.
+
+Дополнительные указания для стиля Dialogue:
+- делай упор на диалог персонажей, как сцена из фильма или визуальной новеллы;
+- реплики начинай с тире;
+- можно добавить немного описаний между репликами, чтобы связать сцену.
+
+ВАЖНО:
+- Не используй фразы вроде:
+  "на изображении показано", "на фото видно", "на картинке представлено",
+  "изображён/представлен" и т.п.
+  Сразу начинай с описания сцены или объекта.
+- Описание должно быть связным и логичным.
+- Параметры конкретного запроса (длина, теги, стиль) указаны ниже, в сообщении
+  пользователя.
+"""
+
+# --- блок про теги: если 0, просим пустой массив ---
+TAGS_NONE = """
+Теги:
+- Поле "tags" в JSON должно быть пустым массивом [].
+- Не добавляй никаких тегов, просто верни "tags": [].
+"""
+
+TAGS_COUNT = """
+Теги:
+- Должно быть РОВНО $tags_count тегов.
+- Теги — отдельные слова или короткие фразы.
+- Без решеток (#) и без запятых внутри тегов.
+- Теги должны точно соответствовать объектам и смыслу сцены.
+"""
+
+SUFFIX = """
+$length_hint
+$tags_instruction
+Текущие параметры запроса:
+- Стиль: $style
+- Параметр длины: $length
+- Количество тегов: $$tags_count
+"""
+
+# --- несколько вариантов за один вызов ---
+VARIANTS_HEADER = Template("""
+Нужно $count варианта(ов) описания ОДНОГО И ТОГО ЖЕ изображения с разными
+параметрами. Каждый вариант пиши независимо, строго по его параметрам.
+Верни СТРОГО ЧИСТЫЙ JSON без лишнего текста, формата:
+{"variants": [{"description": "...", "tags": ["..."]}, ...]}
+Ровно $count элементов в массиве variants, в том же порядке, что и варианты ниже.
+""")
+
+VARIANT_BLOCK = Template("""
+=== Вариант $number ===
+$suffix""")
+
+# --- исправление ответа: только текст, без картинки ---
+REPAIR_PREFIX = """
+Ты — редактор приложения PhotoGen.
+Тебе дают JSON-ответ другой модели с описанием изображения и список
+нарушений требований. Самого изображения у тебя нет.
+
+Исправь ответ:
+- устрани каждое нарушение из списка;
+- сохрани смысл, стиль, язык и факты исходного описания, ничего не выдумывай
+  сверх того, что уже сказано в тексте;
+- если нужно дополнить описание — раскрывай детали, уже упомянутые в тексте;
+- если нужно добавить теги — бери их из содержания описания;
+- теги — отдельные слова или короткие фразы, без решеток (#) и запятых.
+
+Верни СТРОГО ЧИСТЫЙ JSON того же формата:
+{"description": "...", "tags": ["...", "..."]}
+"""
+
+REPAIR_SUFFIX = Template("""
+Параметры запроса:
+- Стиль: $style
+- Параметр длины: $length ($low–$high предложений)
+- Количество тегов: $tags_count
+
+Нарушения:
+$problems
+
+Исходный ответ:
+$previous
+""")
+
+
+def normalize_length(length: str) -> str:
+    return length if length in LENGTH_SENTENCES else DEFAULT_LENGTH
+
+
+def tags_mode(tags_count: int) -> str:
+    return "none" if tags_count <= 0 else "count"
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    style: str
+    length: str
+    tags_mode: str
+    suffix: Template
+
+    @property
+    def prefix(self) -> str:
+        return STATIC_PREFIX
+
+    def render(self, tags_count: int) -> str:
+        """Суффикс для конкретного запроса (подставляется только tags_count)."""
+        return self.suffix.substitute(tags_count=tags_count)
+
+
+def _compile(style: str, length: str, mode: str) -> CompiledPrompt:
+    tags_instruction = TAGS_NONE if mode == "none" else TAGS_COUNT
+    # style приходит от клиента: экранируем $, чтобы он не стал плейсхолдером
+    suffix = Template(SUFFIX).substitute(
+        length_hint=LENGTH_HINTS[length],
+        tags_instruction=tags_instruction,
+        style=style.replace("$", "$$"),
+        length=length,
+    )
+    return CompiledPrompt(style=style, length=length, tags_mode=mode, suffix=Template(suffix))
+
+
+_REGISTRY = {
+    (style, length, mode): _compile(style, length, mode)
+    for style in STYLES
+    for length in LENGTH_SENTENCES
+    for mode in ("none", "count")
+}
+
+
+@lru_cache(maxsize=256)
+def _compile_custom(style: str, length: str, mode: str) -> CompiledPrompt:
+    # произвольные стили от клиентов — компилируем по требованию
+    return _compile(style, length, mode)
+
+
+def get_prompt(style: str, length: str, tags_count: int) -> CompiledPrompt:
+    key = (style, normalize_length(length), tags_mode(tags_count))
+    return _REGISTRY.get(key) or _compile_custom(*key)
+
+
+def render_repair(style: str, length: str, tags_count: int, problems: list[str], previous: str) -> str:
+    length = normalize_length(length)
+    low, high = LENGTH_SENTENCES[length]
+    return REPAIR_SUFFIX.substitute(
+        style=style,
+        length=length,
+        low=low,
+        high=high,
+        tags_count=max(tags_count, 0),
+        problems="\n".join(f"- {problem}" for problem in problems),
+        previous=previous,
+    )
+
+
+def render_variants(variants: list[dict]) -> str:
+    """variants — словари style/length/tags_count (как params в main.py)."""
+    parts = [VARIANTS_HEADER.substitute(count=len(variants))]
+    for number, variant in enumerate(variants, start=1):
+        prompt = get_prompt(variant["style"], variant["length"], variant["tags_count"])
+        parts.append(
+            VARIANT_BLOCK.substitute(number=number, suffix=prompt.render(variant["tags_count"]))
+        )
+    return "".join(parts)
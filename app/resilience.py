@@ -0,0 +1,282 @@
+# app/resilience.py
+"""
+Устойчивость вызовов к OpenAI.
+
+- таймаут на каждую попытку;
+- ограниченные повторы с экспоненциальной задержкой и full jitter,
+  Retry-After от апстрима уважается;
+- hedging: если попытка висит дольше p95 последних успешных вызовов —
+  запускаем дубль, берём первый успешный ответ (не больше
+  UPSTREAM_HEDGE_MAX_RATIO от всех вызовов);
+- circuit breaker: после UPSTREAM_CB_FAILURES подряд неудач сразу
+  отказываем UPSTREAM_CB_RESET секунд, потом пропускаем одну пробу.
+
+Повторяются только временные ошибки (таймауты, обрывы соединения,
+408/409/429/5xx). Ошибки запроса (400 и т.п.) отдаются сразу и не
+открывают breaker.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "90"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "20"))
+
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0").lower() in ("1", "true", "yes", "on")
+UPSTREAM_HEDGE_QUANTILE = float(os.getenv("UPSTREAM_HEDGE_QUANTILE", "0.95"))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "50"))
+UPSTREAM_HEDGE_MAX_RATIO = float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.1"))
+
+UPSTREAM_CB_FAILURES = int(os.getenv("UPSTREAM_CB_FAILURES", "5"))
+UPSTREAM_CB_RESET = float(os.getenv("UPSTREAM_CB_RESET", "30"))
+
+LATENCY_WINDOW = 500
+
+T = TypeVar("T")
+
+_RETRYABLE_STATUS = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Breaker открыт — апстрим не трогаем."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"OpenAI временно недоступен, повторите через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    # openai не импортируем (полсекунды холодного старта, см. app/llm.py):
+    # его исключение может прилететь, только если пакет уже загружен
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return False
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in _RETRYABLE_STATUS or exc.status_code >= 500
+    return False
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Retry-After / retry-after-ms из ответа апстрима, если есть."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+class UpstreamStats:
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0  # отказано открытым breaker-ом
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+            "latency_p50": self.quantile(0.5),
+            "latency_p95": self.quantile(0.95),
+            "latency_p99": self.quantile(0.99),
+        }
+
+
+class CircuitBreaker:
+    """closed -> open (после N неудач подряд) -> half_open (одна проба) -> closed."""
+
+    def __init__(self, failure_threshold: int = UPSTREAM_CB_FAILURES, reset_timeout: float = UPSTREAM_CB_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        if self.state == "closed":
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == "open" and elapsed >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        raise CircuitOpenError(max(self.reset_timeout - elapsed, 1.0))
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_neutral(self) -> None:
+        """Исход ничего не говорит о здоровье апстрима (4xx): только освобождаем пробу."""
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class ResilientCaller:
+    def __init__(
+        self,
+        timeout: float = UPSTREAM_TIMEOUT,
+        max_retries: int = UPSTREAM_MAX_RETRIES,
+        backoff_base: float = UPSTREAM_BACKOFF_BASE,
+        backoff_max: float = UPSTREAM_BACKOFF_MAX,
+        hedge: bool = UPSTREAM_HEDGE,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = UpstreamStats()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], hedge: Optional[bool] = None) -> T:
+        """
+        fn — фабрика одной попытки (вызывается заново на каждый повтор/дубль).
+        hedge=False — для вызовов, которые нельзя дублировать (стриминг).
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self.stats.calls += 1
+
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats.rejected += 1
+                raise
+
+            started = time.monotonic()
+            try:
+                if hedge:
+                    result = await self._hedged(fn)
+                else:
+                    result = await self._attempt(fn)
+            except Exception as e:
+                if not is_retryable(e):
+                    # ошибка запроса, а не апстрима — breaker не закрываем и не открываем
+                    self.breaker.record_neutral()
+                    self.stats.failures += 1
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    self.stats.failures += 1
+                    raise
+                attempt += 1
+                self.stats.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after_seconds(e)))
+                continue
+            except BaseException:
+                # отмена (клиент отключился, проигравший дубль, stop() пула) — исход неизвестен;
+                # пробу отпускаем, иначе half_open навсегда остаётся без пробы
+                self.breaker.record_neutral()
+                raise
+
+            self.breaker.record_success()
+            self.stats.successes += 1
+            self.stats.latencies.append(time.monotonic() - started)
+            return result
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # full jitter: равномерно в [0, base * 2^attempt], не больше backoff_max
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return await asyncio.wait_for(fn(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+
+    def _hedge_delay(self) -> Optional[float]:
+        if len(self.stats.latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        if self.stats.hedges >= UPSTREAM_HEDGE_MAX_RATIO * self.stats.calls:
+            return None
+        return self.stats.quantile(UPSTREAM_HEDGE_QUANTILE)
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]]) -> T:
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._attempt(fn)
+
+        primary = asyncio.ensure_future(self._attempt(fn))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.stats.hedges += 1
+        secondary = asyncio.ensure_future(self._attempt(fn))
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.stats.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
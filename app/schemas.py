@@ -23,6 +23,11 @@ class PhotoOut(PhotoBase):
         from_attributes = True
 
 
+class PhotoPage(BaseModel):
+    items: List[PhotoOut]
+    next_cursor: Optional[str] = None
+
+
 # ---------- GENERATION ----------
 
 class GenerationBase(BaseModel):
@@ -54,6 +59,44 @@ class GenerationOut(GenerationBase):
         from_attributes = True
 
 
+class GenerationPage(BaseModel):
+    items: List[GenerationOut]
+    next_cursor: Optional[str] = None
+
+
+class GenerationSearchHit(BaseModel):
+    id: int
+    photo_id: int
+    style: str
+    length: str
+    tags: List[str]
+    created_at: datetime
+    rank: float
+    snippet: str  # фрагмент description, совпадения обёрнуты в <b>...</b>
+
+
+class GenerationSearchResults(BaseModel):
+    items: List[GenerationSearchHit]
+
+
+# ---------- МАССОВОЕ УДАЛЕНИЕ ----------
+
+class PhotoBulkDelete(BaseModel):
+    """Фильтры объединяются через AND; нужен хотя бы один."""
+    ids: Optional[List[int]] = None
+    created_after: Optional[datetime] = None   # включительно
+    created_before: Optional[datetime] = None  # не включительно
+
+
+class GenerationBulkDelete(PhotoBulkDelete):
+    photo_id: Optional[int] = None
+
+
+class BulkDeleteResult(BaseModel):
+    deleted: int
+    batches: int
+
+
 # ---------- Лог (опционально) ----------
 
 class LogBase(BaseModel):
@@ -83,3 +126,52 @@ class GenerationResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# ---------- ОТВЕТ /generate с variants ----------
+
+class VariantResult(BaseModel):
+    style: str
+    length: str
+    tags_count: int
+    generation_id: int
+    description: str
+    tags: List[str]
+
+
+class VariantsGenerationResponse(BaseModel):
+    photo_id: int
+    items: List[VariantResult]
+
+
+# ---------- ОТВЕТ /generate/batch ----------
+
+class BatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    generation_id: Optional[int] = None
+    description: Optional[str] = None
+    tags: Optional[List[str]] = None
+    error: Optional[str] = None
+
+
+class BatchGenerationResponse(BaseModel):
+    items: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+
+# ---------- JOBS (/generate?async=1) ----------
+
+class JobOut(BaseModel):
+    id: str
+    status: str
+    style: str
+    length: str
+    tags_count: int
+    generation_id: Optional[int] = None
+    description: Optional[str] = None
+    tags: Optional[List[str]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
@@ -0,0 +1,159 @@
+# app/search.py
+"""
+Полнотекстовый поиск по Generation.description.
+
+- Postgres: GIN-индекс по to_tsvector('russian', description),
+  запрос websearch_to_tsquery, ранжирование ts_rank_cd, сниппеты ts_headline.
+- SQLite (локально/тесты): FTS5-таблица generations_fts, bm25 и snippet().
+
+ts_headline дорогой, поэтому считается только для уже отобранной страницы.
+
+Сниппет — безопасный HTML: текст описания (это вывод модели) экранируется,
+и только потом совпадения оборачиваются в <b>...</b>.
+"""
+import html
+import re
+from typing import List
+
+from sqlalchemy import column, func, literal_column, select, table
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+SNIPPET_START = "<b>"
+SNIPPET_STOP = "</b>"
+
+# БД размечает совпадения управляющими символами, а не тегами: иначе
+# после html.escape их не отличить от разметки в самом описании
+_MARK_START = "\x02"
+_MARK_STOP = "\x03"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# FTS5-таблица создаётся DDL-ом в models.py, в метаданных её нет
+_fts = table("generations_fts", column("rowid"))
+_fts_ref = literal_column("generations_fts")
+
+
+def search_generations(
+    db: Session,
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[dict]:
+    """Список словарей: поля Generation + rank (больше — релевантнее) + snippet."""
+    if db.get_bind().dialect.name == "sqlite":
+        return _search_sqlite(db, q, limit, offset)
+    return _search_postgres(db, q, limit, offset)
+
+
+def _render_snippet(raw: str) -> str:
+    return (
+        html.escape(raw, quote=False)
+        .replace(_MARK_START, SNIPPET_START)
+        .replace(_MARK_STOP, SNIPPET_STOP)
+    )
+
+
+def _row_to_hit(row) -> dict:
+    return {
+        "id": row.id,
+        "photo_id": row.photo_id,
+        "style": row.style,
+        "length": row.length,
+        "tags": row.tags,
+        "created_at": row.created_at,
+        "rank": float(row.rank),
+        "snippet": _render_snippet(row.snippet),
+    }
+
+
+# ---------- POSTGRES ----------
+
+
+def _search_postgres(db: Session, q: str, limit: int, offset: int) -> List[dict]:
+    gen = models.Generation
+    tsquery = func.websearch_to_tsquery(models.FTS_CONFIG, q)
+    document = models.description_tsvector(gen.description)
+
+    # 1) по индексу отбираем и ранжируем только id нужной страницы
+    ranked = (
+        select(
+            gen.id.label("id"),
+            func.ts_rank_cd(document, tsquery).label("rank"),
+        )
+        .where(document.op("@@")(tsquery))
+        .order_by(literal_column("rank").desc(), gen.id.desc())
+        .limit(limit)
+        .offset(offset)
+        .subquery()
+    )
+
+    # 2) сниппеты — только для этих строк
+    stmt = (
+        select(
+            gen.id,
+            gen.photo_id,
+            gen.style,
+            gen.length,
+            gen.tags,
+            gen.created_at,
+            ranked.c.rank,
+            func.ts_headline(
+                models.FTS_CONFIG,
+                gen.description,
+                tsquery,
+                f'StartSel="{_MARK_START}", StopSel="{_MARK_STOP}", MaxWords=35, MinWords=15',
+            ).label("snippet"),
+        )
+        .join(ranked, ranked.c.id == gen.id)
+        .order_by(ranked.c.rank.desc(), gen.id.desc())
+    )
+    return [_row_to_hit(row) for row in db.execute(stmt)]
+
+
+# ---------- SQLITE (FTS5) ----------
+
+
+def _fts5_query(q: str) -> str:
+    """
+    Пользовательский текст -> безопасный запрос FTS5: каждое слово
+    в кавычках и с * (префикс — грубая замена стемминга для русского).
+    """
+    return " ".join(f'"{word}"*' for word in _WORD.findall(q.lower()))
+
+
+def _search_sqlite(db: Session, q: str, limit: int, offset: int) -> List[dict]:
+    match = _fts5_query(q)
+    if not match:
+        return []
+
+    gen = models.Generation
+    # bm25: чем меньше, тем релевантнее — переворачиваем знак для rank
+    stmt = (
+        select(
+            gen.id,
+            gen.photo_id,
+            gen.style,
+            gen.length,
+            gen.tags,
+            gen.created_at,
+            (-func.bm25(_fts_ref)).label("rank"),
+            func.snippet(
+                _fts_ref,
+                0,
+                _MARK_START,
+                _MARK_STOP,
+                "…",
+                24,
+            ).label("snippet"),
+        )
+        .select_from(_fts)
+        .join(gen, gen.id == _fts.c.rowid)
+        .where(_fts_ref.op("MATCH")(match))
+        .order_by(func.bm25(_fts_ref), gen.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    return [_row_to_hit(row) for row in db.execute(stmt)]
@@ -0,0 +1,216 @@
+# app/storage.py
+"""
+Хранилище оригиналов загруженных изображений (content-addressed).
+
+Ключ блоба — sha256 содержимого с шардингом по первым байтам:
+blobs/ab/cd/abcd…ef. Одинаковые загрузки хранятся один раз, а ключ
+пишется в Photo.file_path — по нему /photos/{id}/generate перегенерирует
+описание без повторной загрузки.
+
+Бэкенды (BLOB_BACKEND):
+- local  — файлы в BLOB_ROOT;
+- object — поверх ObjectStoreClient (интерфейс S3-подобного хранилища),
+           по умолчанию — LocalObjectClient, его локальная замена;
+- none   — оригиналы не сохраняются.
+
+Запись потоковая: загрузка копируется чанками во временный файл и
+атомарно переименовывается, целиком в память не читается. Все методы
+синхронные — из async-кода их зовут через run_in_threadpool.
+Блобы не удаляются вместе с Photo: на один блоб могут ссылаться
+несколько фото.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Optional, Protocol
+
+
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+BLOB_ROOT = os.getenv("BLOB_ROOT", os.path.join("data", "blobs"))
+
+KEY_PREFIX = "blobs/"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobNotFound(LookupError):
+    pass
+
+
+def blob_key(digest: str) -> str:
+    return f"{KEY_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def is_blob_key(value: Optional[str]) -> bool:
+    return bool(value) and value.startswith(KEY_PREFIX)
+
+
+def digest_from_key(key: str) -> str:
+    return key.rsplit("/", 1)[-1]
+
+
+def _copy_hashing(src: BinaryIO, dst: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    while True:
+        chunk = src.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dst.write(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore(Protocol):
+    def exists(self, key: str) -> bool: ...
+
+    def put(self, fp: BinaryIO, digest: Optional[str] = None) -> str:
+        """Сохраняет поток, возвращает ключ. digest — если sha256 уже посчитан."""
+        ...
+
+    def open(self, key: str) -> BinaryIO: ...
+
+    def delete(self, key: str) -> None: ...
+
+
+# ---------- LOCAL FS ----------
+
+
+class LocalBlobStore:
+    def __init__(self, root: str = BLOB_ROOT):
+        self.root = root
+        self._tmp = os.path.join(root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if not is_blob_key(key) or ".." in key:
+            raise BlobNotFound(key)
+        return os.path.join(self.root, *key[len(KEY_PREFIX):].split("/"))
+
+    def exists(self, key: str) -> bool:
+        try:
+            return os.path.exists(self._path(key))
+        except BlobNotFound:
+            return False
+
+    def put(self, fp: BinaryIO, digest: Optional[str] = None) -> str:
+        if digest is not None and self.exists(blob_key(digest)):
+            return blob_key(digest)  # такой контент уже есть — не копируем
+
+        with tempfile.NamedTemporaryFile(dir=self._tmp, delete=False) as tmp:
+            try:
+                actual = _copy_hashing(fp, tmp)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+
+        key = blob_key(actual)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # rename атомарен: параллельная запись того же блоба просто перезапишет
+        # его тем же содержимым
+        os.replace(tmp.name, path)
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except (FileNotFoundError, BlobNotFound):
+            pass
+
+
+# ---------- OBJECT STORE ----------
+
+
+class ObjectStoreClient(Protocol):
+    """Минимум от S3/GCS-клиента (boto3 и т.п. оборачиваются в этот интерфейс)."""
+
+    def head_object(self, key: str) -> bool: ...
+
+    def put_object(self, key: str, fp: BinaryIO) -> None:
+        """Потоковая загрузка (multipart на стороне клиента)."""
+        ...
+
+    def get_object(self, key: str) -> BinaryIO: ...
+
+    def delete_object(self, key: str) -> None: ...
+
+
+class LocalObjectClient:
+    """Локальная замена объектного хранилища: плоские ключи в каталоге."""
+
+    def __init__(self, root: str = BLOB_ROOT):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def head_object(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def put_object(self, key: str, fp: BinaryIO) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as tmp:
+            shutil.copyfileobj(fp, tmp, COPY_CHUNK_SIZE)
+        os.replace(tmp.name, path)
+
+    def get_object(self, key: str) -> BinaryIO:
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def delete_object(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class ObjectBlobStore:
+    def __init__(self, client: ObjectStoreClient):
+        self.client = client
+
+    def exists(self, key: str) -> bool:
+        return is_blob_key(key) and self.client.head_object(key)
+
+    def put(self, fp: BinaryIO, digest: Optional[str] = None) -> str:
+        if digest is None:
+            # ключ зависит от содержимого: сначала считаем хэш, потом грузим
+            start = fp.tell()
+            digest = _copy_hashing(fp, _NullWriter())
+            fp.seek(start)
+        key = blob_key(digest)
+        if not self.client.head_object(key):
+            self.client.put_object(key, fp)
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        if not is_blob_key(key):
+            raise BlobNotFound(key)
+        return self.client.get_object(key)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(key)
+
+
+class _NullWriter:
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+
+def build_blob_store(name: str = BLOB_BACKEND) -> Optional[BlobStore]:
+    if name == "local":
+        return LocalBlobStore()
+    if name == "object":
+        return ObjectBlobStore(LocalObjectClient())
+    if name in ("none", "off", ""):
+        return None
+    raise RuntimeError(f"Неизвестный BLOB_BACKEND: {name!r}")
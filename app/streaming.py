@@ -0,0 +1,106 @@
+# app/streaming.py
+"""
+Помощники для /generate/stream (Server-Sent Events).
+
+Модель отвечает JSON-ом {"description": "...", "tags": [...]}, поэтому,
+чтобы отдавать текст описания по мере генерации, строку description
+приходится декодировать инкрементально прямо из потока токенов.
+"""
+import json
+import re
+
+
+_DESCRIPTION_START = re.compile(r'"description"\s*:\s*"')
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class DescriptionExtractor:
+    """
+    Скармливаем сырые дельты ответа модели — получаем новые куски
+    значения поля description (уже раскодированные из JSON-строки).
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._state = "seek"  # seek -> string -> done
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, delta: str) -> str:
+        self._buf += delta
+
+        if self._state == "seek":
+            match = _DESCRIPTION_START.search(self._buf)
+            if not match:
+                return ""
+            self._pos = match.end()
+            self._state = "string"
+
+        if self._state != "string":
+            return ""
+
+        out = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self._state = "done"
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+
+            # escape-последовательность может оборваться на границе чанка
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc in _SIMPLE_ESCAPES:
+                out.append(_SIMPLE_ESCAPES[esc])
+                i += 2
+                continue
+            if esc != "u":
+                # битый escape — отдаём как есть, финальный JSON всё равно проверим
+                out.append(esc)
+                i += 2
+                continue
+
+            if i + 6 > len(buf):
+                break
+            try:
+                code = int(buf[i + 2: i + 6], 16)
+            except ValueError:
+                out.append(esc)
+                i += 2
+                continue
+            if 0xD800 <= code <= 0xDBFF:
+                # суррогатная пара: ждём вторую половину \uXXXX
+                if i + 12 > len(buf):
+                    break
+                out.append(json.loads(f'"{buf[i: i + 12]}"'))
+                i += 12
+            else:
+                out.append(chr(code))
+                i += 6
+
+        self._pos = i
+        return "".join(out)
+
+
+def sse_event(event: str, data: dict) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
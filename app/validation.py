@@ -0,0 +1,126 @@
+# app/validation.py
+"""
+Проверка ответа модели.
+
+- response_format — JSON-схема для structured outputs (text.format в
+  responses.create): description + ровно tags_count тегов;
+  variants_response_format — то же для нескольких вариантов за вызов;
+- validate — что схема не ловит: количество предложений по length
+  (prompts.LENGTH_SENTENCES) и пустое описание.
+
+Если проверка не прошла, main.py делает дешёвый текстовый repair-вызов
+(без картинки) с уже сгенерированным текстом и списком проблем.
+"""
+import os
+import re
+
+from . import prompts
+
+
+# на сколько предложений можно промахнуться мимо диапазона без repair
+VALIDATION_SENTENCE_SLACK = int(os.getenv("VALIDATION_SENTENCE_SLACK", "1"))
+
+# конец предложения: . ! ? … (в том числе ?! и ...) перед пробелом/концом текста
+_SENTENCE_END = re.compile(r"[.!?…]+(?:[\"»”)]*)(?=\s|$)")
+
+
+def _description_schema(tags_count: int | None) -> dict:
+    tags = {"type": "array", "items": {"type": "string"}}
+    if tags_count is not None:
+        tags["minItems"] = tags["maxItems"] = max(tags_count, 0)
+    return {
+        "type": "object",
+        "properties": {
+            "description": {"type": "string"},
+            "tags": tags,
+        },
+        "required": ["description", "tags"],
+        "additionalProperties": False,
+    }
+
+
+def response_format(tags_count: int) -> dict:
+    return {
+        "type": "json_schema",
+        "name": "photogen_description",
+        "strict": True,
+        "schema": _description_schema(tags_count),
+    }
+
+
+def variants_response_format(tags_counts: list[int]) -> dict:
+    """
+    {"variants": [...]} ровно на len(tags_counts) элементов. Число тегов
+    фиксируется в схеме, только если оно у всех вариантов одинаковое —
+    иначе его проверяет validate по каждому варианту.
+    """
+    same = tags_counts[0] if len(set(tags_counts)) == 1 else None
+    return {
+        "type": "json_schema",
+        "name": "photogen_variants",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "variants": {
+                    "type": "array",
+                    "items": _description_schema(same),
+                    "minItems": len(tags_counts),
+                    "maxItems": len(tags_counts),
+                },
+            },
+            "required": ["variants"],
+            "additionalProperties": False,
+        },
+    }
+
+
+def count_sentences(text: str) -> int:
+    text = text.strip()
+    if not text:
+        return 0
+    ends = [m.end() for m in _SENTENCE_END.finditer(text)]
+    # хвост без точки — тоже предложение
+    if not ends or ends[-1] < len(text):
+        ends.append(len(text))
+    return len(ends)
+
+
+def normalize(data: dict, tags_count: int) -> dict:
+    """Приводит типы и срезает лишние теги (это чинится без модели)."""
+    description = data.get("description", "") or ""
+    if not isinstance(description, str):
+        description = str(description)
+
+    tags = data.get("tags", [])
+    if not isinstance(tags, list):
+        tags = []
+    tags = [str(tag).strip() for tag in tags if str(tag).strip()]
+
+    return {"description": description.strip(), "tags": tags[: max(tags_count, 0)]}
+
+
+def validate(data: dict, length: str, tags_count: int) -> list[str]:
+    """Список нарушений (по-русски, уходит в repair-промпт). Пустой — всё ок."""
+    problems = []
+
+    description = data["description"]
+    if not description:
+        problems.append("Поле description пустое.")
+    else:
+        low, high = prompts.LENGTH_SENTENCES[prompts.normalize_length(length)]
+        sentences = count_sentences(description)
+        if sentences < low - VALIDATION_SENTENCE_SLACK:
+            problems.append(
+                f"В description {sentences} предложений, нужно от {low} до {high}: дополни текст."
+            )
+        elif sentences > high + VALIDATION_SENTENCE_SLACK:
+            problems.append(
+                f"В description {sentences} предложений, нужно от {low} до {high}: сократи текст."
+            )
+
+    expected = max(tags_count, 0)
+    if len(data["tags"]) != expected:
+        problems.append(f"В tags {len(data['tags'])} тегов, нужно ровно {expected}.")
+
+    return problems
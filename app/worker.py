@@ -0,0 +1,37 @@
+# app/worker.py
+"""
+Отдельный процесс-воркер для задач /generate?async=1:
+
+    JOBS_WORKERS=0 uvicorn app.main:app      # API без встроенных воркеров
+    python -m app.worker                     # воркеры, масштабируются отдельно
+
+Воркер забирает queued-задачи из таблицы jobs (см. app/jobs.py).
+Схема БД — миграциями (python -m app.migrations upgrade) до запуска.
+"""
+import asyncio
+import logging
+
+from . import db, jobs, llm, main
+
+
+async def run() -> None:
+    # БД недоступна на старте — не падаем: пул повторяет опрос jobs сам
+    db.init_engines()
+    pool = jobs.JobWorkerPool(
+        main.job_pool.handler,
+        concurrency=max(jobs.JOBS_WORKERS, 1),
+        event_log=main.event_log,
+    )
+    main.event_log.start()
+    try:
+        await pool.run_forever()
+    finally:
+        await pool.stop()
+        await main.event_log.stop()
+        await llm.close_client()
+        await db.dispose_engines()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
@@ -0,0 +1,246 @@
+# bench/fake_openai.py
+"""
+Локальная заглушка OpenAI Responses API (POST /v1/responses) для
+бенчмарков и нагрузочных тестов без трат на токены.
+
+Отвечает валидным для PhotoGen JSON: число предложений и тегов берётся
+из промпта («Параметр длины: ...», «Количество тегов: ...»), число
+вариантов — из JSON-схемы в text.format. Поддерживает stream=True
+(SSE-события response.output_text.delta / response.completed).
+
+Поведение настраивается флагами:
+- задержка — логнормальная: медиана --latency-median, разброс
+  --latency-sigma, потолок --latency-max (секунды);
+- ошибки — доля --error-rate, статус --error-status (429 отдаётся
+  с retry-after-ms);
+- стрим — задержка до первого чанка та же, дальше --stream-chunks
+  чанков через --chunk-delay секунд.
+
+    python -m bench.fake_openai --port 8901 --latency-median 0.8 --error-rate 0.01
+
+Сервис направляется на заглушку через OPENAI_BASE_URL=http://127.0.0.1:8901/v1.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app import prompts
+
+
+@dataclass
+class FakeConfig:
+    latency_median: float = 0.8
+    latency_sigma: float = 0.4
+    latency_max: float = 10.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    stream_chunks: int = 20
+    chunk_delay: float = 0.02
+    seed: int | None = None
+
+
+_LENGTH_RE = re.compile(r"Параметр длины: (\w+)")
+_TAGS_RE = re.compile(r"Количество тегов: (-?\d+)")
+
+_SENTENCES = [
+    "На снимке мягкий дневной свет.",
+    "В центре кадра стоит главный объект.",
+    "Фон слегка размыт и не отвлекает внимание.",
+    "Цвета спокойные и естественные.",
+    "Композиция выстроена по правилу третей.",
+    "Детали хорошо читаются даже издалека.",
+    "Настроение у кадра тёплое и уютное.",
+    "Тени ложатся мягко и подчёркивают объём.",
+]
+_TAGS = ["свет", "кадр", "фон", "цвет", "композиция", "детали", "настроение", "тени", "фото", "сцена"]
+
+
+def _sample_latency(config: FakeConfig, rng: random.Random) -> float:
+    if config.latency_median <= 0:
+        return 0.0
+    value = config.latency_median * math.exp(config.latency_sigma * rng.gauss(0, 1))
+    return min(value, config.latency_max)
+
+
+def _prompt_text(body: dict) -> tuple[str, bool]:
+    """Весь текст из input и признак, есть ли там картинка."""
+    parts, has_image = [], False
+    for message in body.get("input") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for item in content or []:
+            if item.get("type") == "input_text":
+                parts.append(item.get("text", ""))
+            elif item.get("type") == "input_image":
+                has_image = True
+    return "\n".join(parts), has_image
+
+
+def _description(length: str, tags_count: int, rng: random.Random) -> dict:
+    low, high = prompts.LENGTH_SENTENCES[prompts.normalize_length(length)]
+    count = (low + high) // 2
+    sentences = [_SENTENCES[(i + rng.randrange(len(_SENTENCES))) % len(_SENTENCES)] for i in range(count)]
+    tags = [_TAGS[i % len(_TAGS)] for i in range(max(tags_count, 0))]
+    return {"description": " ".join(sentences), "tags": tags}
+
+
+def _output_json(body: dict, text: str, rng: random.Random) -> str:
+    lengths = _LENGTH_RE.findall(text) or ["Medium"]
+    tags = [int(value) for value in _TAGS_RE.findall(text)] or [5]
+    schema = ((body.get("text") or {}).get("format") or {}).get("schema") or {}
+    variants = schema.get("properties", {}).get("variants")
+    if variants is not None:
+        count = variants.get("minItems", len(lengths))
+        items = [
+            _description(lengths[min(i, len(lengths) - 1)], tags[min(i, len(tags) - 1)], rng)
+            for i in range(count)
+        ]
+        return json.dumps({"variants": items}, ensure_ascii=False)
+    return json.dumps(_description(lengths[0], tags[0], rng), ensure_ascii=False)
+
+
+def _response(body: dict, output_text: str, text: str, has_image: bool) -> dict:
+    input_tokens = len(text) // 3 + (2800 if has_image else 0)
+    output_tokens = len(output_text) // 3
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "status": "completed",
+        "output": [
+            {
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": output_text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": min(1024, input_tokens)},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="fake-openai")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    @app.post("/v1/responses")
+    async def responses(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        latency = _sample_latency(config, rng)
+
+        if rng.random() < config.error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(latency / 4)
+            headers = {"retry-after-ms": "200"} if config.error_status == 429 else {}
+            return JSONResponse(
+                status_code=config.error_status,
+                headers=headers,
+                content={"error": {"message": "fake upstream error", "type": "server_error", "code": None}},
+            )
+
+        text, has_image = _prompt_text(body)
+        output_text = _output_json(body, text, rng)
+        response = _response(body, output_text, text, has_image)
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return JSONResponse(response)
+
+        stats["streams"] += 1
+
+        async def events():
+            sequence = 0
+            created = {**response, "status": "in_progress", "output": []}
+            yield _sse({"type": "response.created", "sequence_number": sequence, "response": created})
+            await asyncio.sleep(latency)
+            chunks = max(config.stream_chunks, 1)
+            size = max(math.ceil(len(output_text) / chunks), 1)
+            item_id = response["output"][0]["id"]
+            for start in range(0, len(output_text), size):
+                sequence += 1
+                yield _sse(
+                    {
+                        "type": "response.output_text.delta",
+                        "sequence_number": sequence,
+                        "item_id": item_id,
+                        "output_index": 0,
+                        "content_index": 0,
+                        "delta": output_text[start:start + size],
+                        "logprobs": [],
+                    }
+                )
+                if config.chunk_delay > 0:
+                    await asyncio.sleep(config.chunk_delay)
+            sequence += 1
+            yield _sse({"type": "response.completed", "sequence_number": sequence, "response": response})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Локальная заглушка OpenAI Responses API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency-median", type=float, default=FakeConfig.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=FakeConfig.latency_sigma)
+    parser.add_argument("--latency-max", type=float, default=FakeConfig.latency_max)
+    parser.add_argument("--error-rate", type=float, default=FakeConfig.error_rate)
+    parser.add_argument("--error-status", type=int, default=FakeConfig.error_status)
+    parser.add_argument("--stream-chunks", type=int, default=FakeConfig.stream_chunks)
+    parser.add_argument("--chunk-delay", type=float, default=FakeConfig.chunk_delay)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    config = FakeConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        latency_max=args.latency_max,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        stream_chunks=args.stream_chunks,
+        chunk_delay=args.chunk_delay,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
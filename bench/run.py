@@ -0,0 +1,463 @@
+# bench/run.py
+"""
+Бенчмарк PhotoGen API против локальной заглушки OpenAI (bench/fake_openai.py).
+
+Для каждой БД (--db sqlite / --db postgres) поднимает заглушку и сервис
+(uvicorn app.main:app) отдельными процессами, гоняет сценарии с заданной
+конкурентностью и печатает RPS, p50/p95/p99 и время этапов конвейера
+(дельта photogen_stage_duration_seconds из /metrics за сценарий).
+Перед стартом сервиса схема доводится через python -m app.migrations upgrade;
+строка startup — время от запуска процесса до 200 на GET /ready, с фазами
+import/lifespan/ready из самого /ready.
+
+Сценарии:
+- generate — POST /generate с уникальными картинками (кэш и дедуп не срабатывают);
+- stream   — POST /generate/stream, время до конца стрима;
+- crud     — GET/PUT /generations/{id}, GET /photos/{id};
+- list     — GET /generations и /photos по курсорам, /generations/search.
+
+    python -m bench.run --db sqlite --concurrency 16 --requests 300
+    python -m bench.run --db postgres --pg-url postgresql://postgres:pg@localhost/photogen_bench
+    python -m bench.run --db sqlite --baseline bench/baseline.json   # exit 1 при регрессии
+    python -m bench.run --db sqlite --save-baseline bench/baseline.json
+
+Postgres нужен отдельной базой: бенчмарк пишет в неё строки и не чистит.
+Отчёт дублируется в --output (по умолчанию bench_output.txt в корне репо).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+import httpx
+from PIL import Image
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("generate", "stream", "crud", "list")
+LENGTHS = ("Short", "Medium", "Long")
+
+
+# ---------- ПРОЦЕССЫ ----------
+
+
+def _wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} не поднялся за {timeout:.0f} с")
+
+
+@contextmanager
+def _process(args: list[str], env: dict, ready_url: str):
+    proc = subprocess.Popen([sys.executable, *args], cwd=ROOT, env=env)
+    try:
+        _wait_ready(ready_url)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+@contextmanager
+def _fake_upstream(args: argparse.Namespace):
+    url = f"http://127.0.0.1:{args.fake_port}"
+    cmd = [
+        "-m", "bench.fake_openai",
+        "--port", str(args.fake_port),
+        "--latency-median", str(args.latency_median),
+        "--latency-sigma", str(args.latency_sigma),
+        "--error-rate", str(args.error_rate),
+        "--chunk-delay", str(args.chunk_delay),
+    ]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    with _process(cmd, dict(os.environ), f"{url}/stats"):
+        yield f"{url}/v1"
+
+
+@contextmanager
+def _service(args: argparse.Namespace, db_name: str, database_url: str, upstream_url: str, workdir: str):
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": upstream_url,
+        "BLOB_ROOT": os.path.join(workdir, "blobs"),
+        "ADMISSION_ENABLED": "1" if args.admission else "0",
+    }
+    subprocess.run(
+        [sys.executable, "-m", "app.migrations", "upgrade"],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{args.app_port}"
+    cmd = ["-m", "uvicorn", "app.main:app", "--port", str(args.app_port), "--log-level", "warning"]
+    started = time.perf_counter()
+    # /ready отвечает 503, пока не прошёл прогрев, — _wait_ready ждёт < 500
+    with _process(cmd, env, f"{url}/ready"):
+        seconds = time.perf_counter() - started
+        yield url, _startup_result(db_name, seconds, httpx.get(f"{url}/ready", timeout=5).json())
+
+
+# ---------- НАГРУЗКА ----------
+
+
+@dataclass
+class Result:
+    db: str
+    scenario: str
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    rps: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    statuses: dict = field(default_factory=dict)
+    stages: dict = field(default_factory=dict)
+
+
+def _startup_result(db_name: str, seconds: float, ready: dict) -> Result:
+    phases = {
+        phase: {"mean_ms": round((ready.get(f"{phase}_seconds") or 0.0) * 1000, 2), "calls": 1}
+        for phase in ("import", "startup", "ready")
+    }
+    ms = round(seconds * 1000, 2)
+    return Result(
+        db=db_name, scenario="startup", requests=1, seconds=round(seconds, 3),
+        p50_ms=ms, p95_ms=ms, p99_ms=ms, statuses={"200": 1}, stages=phases,
+    )
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+
+async def _drive(one, total: int, concurrency: int) -> tuple[list[float], dict, float]:
+    """one(i) -> статус; total запросов в concurrency потоков."""
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                status = str(await one(i))
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sorted(latencies), statuses, time.perf_counter() - started
+
+
+def _image(rng: random.Random, size: int = 256) -> bytes:
+    # шум: у каждой картинки свой sha256 и свой dHash
+    img = Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
+
+class State:
+    """id созданных фото и генераций — для crud/list сценариев."""
+
+    def __init__(self, seed: int | None):
+        self.rng = random.Random(seed)
+        self.photo_ids: list[int] = []
+        self.gen_ids: list[int] = []
+
+
+async def _seed(client: httpx.AsyncClient, state: State, rows: int) -> None:
+    """Данные для crud/list без вызовов модели (если generate не запускался)."""
+    for i in range(rows):
+        photo = (await client.post("/photos", json={"file_path": f"bench/{i}.jpg"})).json()
+        gen = (
+            await client.post(
+                "/generations",
+                json={
+                    "photo_id": photo["id"],
+                    "description": f"Тестовое описание номер {i}. Солнце и море.",
+                    "tags": ["море", "солнце"],
+                    "style": "Default",
+                    "length": "Short",
+                    "tags_count": 2,
+                },
+            )
+        ).json()
+        state.photo_ids.append(photo["id"])
+        state.gen_ids.append(gen["id"])
+
+
+async def _collect_ids(client: httpx.AsyncClient, state: State, limit: int) -> None:
+    """id уже созданных генераций (в ответе /generate их нет)."""
+    state.photo_ids, state.gen_ids = [], []
+    cursor = None
+    while len(state.gen_ids) < limit:
+        params = {"limit": 500, **({"cursor": cursor} if cursor else {})}
+        page = (await client.get("/generations", params=params)).json()
+        state.gen_ids += [item["id"] for item in page["items"]]
+        state.photo_ids += [item["photo_id"] for item in page["items"]]
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+
+
+def _scenario(name: str, client: httpx.AsyncClient, state: State):
+    rng = state.rng
+
+    def form():
+        return {"style": "Default", "length": rng.choice(LENGTHS), "tags_count": "5"}
+
+    async def generate(i):
+        files = {"image": ("bench.jpg", _image(rng), "image/jpeg")}
+        return (await client.post("/generate", files=files, data=form())).status_code
+
+    async def stream(i):
+        files = {"image": ("bench.jpg", _image(rng), "image/jpeg")}
+        async with client.stream("POST", "/generate/stream", files=files, data=form()) as response:
+            ok = response.status_code == 200
+            async for line in response.aiter_lines():
+                if line.startswith("event: error"):
+                    ok = False
+            return response.status_code if ok else "stream_error"
+
+    async def crud(i):
+        gen_id = rng.choice(state.gen_ids)
+        action = rng.random()
+        if action < 0.6:
+            return (await client.get(f"/generations/{gen_id}")).status_code
+        if action < 0.8:
+            return (await client.get(f"/photos/{rng.choice(state.photo_ids)}")).status_code
+        body = {"tags": ["bench", str(i)]}
+        return (await client.put(f"/generations/{gen_id}", json=body)).status_code
+
+    async def listing(i):
+        action = rng.random()
+        if action < 0.2:
+            params = {"q": rng.choice(["свет", "море", "кадр", "солнце"]), "limit": 20}
+            return (await client.get("/generations/search", params=params)).status_code
+        path = "/generations" if action < 0.7 else "/photos"
+        response = await client.get(path, params={"limit": 50})
+        # до трёх страниц по курсору
+        for _ in range(2):
+            cursor = response.json().get("next_cursor") if response.status_code == 200 else None
+            if not cursor:
+                break
+            response = await client.get(path, params={"limit": 50, "cursor": cursor})
+        return response.status_code
+
+    return {"generate": generate, "stream": stream, "crud": crud, "list": listing}[name]
+
+
+# ---------- /metrics ----------
+
+_STAGE_RE = re.compile(r'^photogen_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+async def _stage_totals(client: httpx.AsyncClient) -> dict[str, list[float]]:
+    """stage -> [sum, count]."""
+    totals: dict[str, list[float]] = {}
+    text = (await client.get("/metrics")).text
+    for line in text.splitlines():
+        match = _STAGE_RE.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            totals.setdefault(stage, [0.0, 0.0])[0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+def _stage_delta(before: dict, after: dict) -> dict[str, dict]:
+    stages = {}
+    for stage, (total, count) in after.items():
+        prev_total, prev_count = before.get(stage, (0.0, 0.0))
+        calls = count - prev_count
+        if calls > 0:
+            stages[stage] = {"calls": int(calls), "mean_ms": round((total - prev_total) / calls * 1000, 2)}
+    return stages
+
+
+# ---------- ПРОГОН ----------
+
+
+async def _run_scenarios(args: argparse.Namespace, base_url: str, db_name: str) -> list[Result]:
+    results = []
+    state = State(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        for name in args.scenarios:
+            if name in ("crud", "list"):
+                await _collect_ids(client, state, args.seed_rows)
+                if len(state.gen_ids) < args.seed_rows:
+                    await _seed(client, state, args.seed_rows - len(state.gen_ids))
+
+            one = _scenario(name, client, state)
+            for i in range(args.warmup):
+                await one(-1 - i)  # прогрев — до снятия метрик, в статистику не идёт
+            before = await _stage_totals(client)
+            latencies, statuses, seconds = await _drive(one, args.requests, args.concurrency)
+            after = await _stage_totals(client)
+
+            errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+            results.append(
+                Result(
+                    db=db_name,
+                    scenario=name,
+                    requests=len(latencies),
+                    errors=errors,
+                    seconds=round(seconds, 3),
+                    rps=round(len(latencies) / seconds, 2) if seconds else 0.0,
+                    p50_ms=round(_percentile(latencies, 0.50) * 1000, 2),
+                    p95_ms=round(_percentile(latencies, 0.95) * 1000, 2),
+                    p99_ms=round(_percentile(latencies, 0.99) * 1000, 2),
+                    statuses=statuses,
+                    stages=_stage_delta(before, after),
+                )
+            )
+    return results
+
+
+def _run_db(args: argparse.Namespace, db_name: str) -> list[Result]:
+    with tempfile.TemporaryDirectory(prefix="photogen-bench-") as workdir:
+        if db_name == "sqlite":
+            database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        else:
+            database_url = args.pg_url
+            if not database_url:
+                raise SystemExit("--db postgres требует --pg-url (или BENCH_PG_URL)")
+
+        with _fake_upstream(args) as upstream_url:
+            with _service(args, db_name, database_url, upstream_url, workdir) as (base_url, startup):
+                return [startup, *asyncio.run(_run_scenarios(args, base_url, db_name))]
+
+
+# ---------- ОТЧЁТ ----------
+
+
+def format_report(results: list[Result], args: argparse.Namespace) -> str:
+    lines = [
+        f"concurrency={args.concurrency} requests={args.requests} "
+        f"upstream: median={args.latency_median}s sigma={args.latency_sigma} errors={args.error_rate}",
+        "",
+        f"{'db':<9}{'scenario':<10}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for r in results:
+        lines.append(
+            f"{r.db:<9}{r.scenario:<10}{r.requests:>7}{r.errors:>6}{r.rps:>9.1f}"
+            f"{r.p50_ms:>10.1f}{r.p95_ms:>10.1f}{r.p99_ms:>10.1f}"
+        )
+    for r in results:
+        if not r.stages:
+            continue
+        lines += ["", f"этапы {r.db}/{r.scenario} (среднее, мс):"]
+        for stage, info in sorted(r.stages.items(), key=lambda item: -item[1]["mean_ms"]):
+            lines.append(f"  {stage:<18}{info['mean_ms']:>10.2f}  x{info['calls']}")
+        if set(r.statuses) - {"200"}:
+            lines.append(f"  статусы: {r.statuses}")
+    return "\n".join(lines) + "\n"
+
+
+def compare(results: list[Result], baseline: dict, max_regression: float) -> list[str]:
+    """Регрессии относительно baseline: {db: {scenario: {rps, p95_ms, ...}}}."""
+    problems = []
+    for r in results:
+        base = baseline.get(r.db, {}).get(r.scenario)
+        if not base:
+            continue
+        if base.get("p95_ms") and r.p95_ms > base["p95_ms"] * (1 + max_regression):
+            problems.append(f"{r.db}/{r.scenario}: p95 {r.p95_ms} мс > {base['p95_ms']} мс")
+        if base.get("rps") and r.rps < base["rps"] * (1 - max_regression):
+            problems.append(f"{r.db}/{r.scenario}: rps {r.rps} < {base['rps']}")
+        if r.errors > base.get("errors", 0) + r.requests * max_regression:
+            problems.append(f"{r.db}/{r.scenario}: ошибок {r.errors}")
+    return problems
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк PhotoGen API")
+    parser.add_argument("--db", action="append", choices=("sqlite", "postgres"))
+    parser.add_argument("--pg-url", default=os.getenv("BENCH_PG_URL"))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="на сценарий")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed-rows", type=int, default=200, help="минимум генераций для crud/list")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--latency-median", type=float, default=0.8)
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--admission", action="store_true", help="не выключать admission control")
+    parser.add_argument("--app-port", type=int, default=8900)
+    parser.add_argument("--fake-port", type=int, default=8901)
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench_output.txt"))
+    parser.add_argument("--json", dest="json_path", default=None, help="результаты в JSON")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--save-baseline", default=None)
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    args.db = args.db or ["sqlite"]
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = []
+    for db_name in args.db:
+        results.extend(_run_db(args, db_name))
+
+    report = format_report(results, args)
+    print(report, end="")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+
+    by_db: dict = {}
+    for r in results:
+        by_db.setdefault(r.db, {})[r.scenario] = asdict(r)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(by_db, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(by_db, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        if problems:
+            print("\nРЕГРЕССИИ:\n  " + "\n  ".join(problems))
+            return 1
+        print("\nрегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
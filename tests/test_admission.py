@@ -0,0 +1,36 @@
+# tests/test_admission.py
+"""
+ClientLimiter: перебор случайных X-API-Key с одного IP не должен обходить
+лимит клиента.
+
+    python -m pytest -q tests
+"""
+import uuid
+
+import pytest
+from starlette.requests import Request
+
+from app import admission
+
+
+def _request(api_key: str, host: str = "10.0.0.1") -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/generate",
+        "headers": [(b"x-api-key", api_key.encode())],
+        "client": (host, 12345),
+    })
+
+
+def test_rotating_keys_do_not_bypass_limit(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_API_KEYS", frozenset({"known"}))
+    limiter = admission.ClientLimiter(per_minute=1000)
+
+    limiter.check(admission.client_id(_request(uuid.uuid4().hex)), 600)
+    with pytest.raises(admission.Rejected):
+        limiter.check(admission.client_id(_request(uuid.uuid4().hex)), 600)
+
+    # ключ из списка получает свой бакет
+    assert admission.client_id(_request("known")) == "key:known"
+    limiter.check(admission.client_id(_request("known")), 600)
@@ -0,0 +1,59 @@
+# tests/test_eventlog.py
+"""
+LogWriter: событие со ссылкой на уже удалённую Generation не должно
+терять остальную пачку.
+
+    python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+# app.db читает DATABASE_URL при импорте
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+from app import crud, db, eventlog, migrations, models, schemas  # noqa: E402
+
+
+def _generation(session) -> int:
+    photo = crud.create_photo(session, "test")
+    gen = crud.create_generation(
+        session,
+        schemas.GenerationCreate(
+            photo_id=photo.id,
+            description="d",
+            tags=["t"],
+            style="Default",
+            length="Short",
+            tags_count=1,
+        ),
+    )
+    return gen.id
+
+
+def test_deleted_generation_does_not_drop_batch():
+    migrations.upgrade(db.init_engines(), log=lambda message: None)
+    with db.SessionLocal() as session:
+        alive = _generation(session)
+        deleted = _generation(session)
+        crud.delete_generation(session, deleted)
+
+    async def run():
+        writer = eventlog.LogWriter(batch_size=100, flush_interval=60)
+        writer.start()
+        for i in range(10):
+            writer.emit("info", "test.event", generation_id=alive, n=i)
+        writer.emit("info", "test.event", generation_id=deleted, n=10)
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(run())
+    assert writer.written == 11
+    assert writer.failed == 0
+
+    with db.SessionLocal() as session:
+        logs = session.query(models.Log).order_by(models.Log.id).all()
+    assert len(logs) == 11
+    assert [log.generation_id for log in logs] == [alive] * 10 + [None]
+    assert json.loads(logs[-1].message)["generation_id"] == deleted
@@ -0,0 +1,55 @@
+# tests/test_jobs.py
+"""
+JobWorkerPool: временные ошибки (429/503/504) возвращают задачу в очередь,
+постоянные и исчерпанные попытки — в failed.
+
+    python -m pytest -q tests
+"""
+import asyncio
+import os
+import tempfile
+
+# app.db читает DATABASE_URL при импорте (его мог уже задать другой модуль тестов)
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from fastapi import HTTPException  # noqa: E402
+
+from app import crud, db, jobs, migrations  # noqa: E402
+
+
+def _job() -> str:
+    migrations.upgrade(db.init_engines(), log=lambda message: None)
+    params = {"style": "Default", "length": "Short", "tags_count": 1}
+    with db.SessionLocal() as session:
+        return crud.create_job(session, params, b"img", "image/jpeg").id
+
+
+def _run(pool: jobs.JobWorkerPool, job_id: str):
+    assert jobs._claim(job_id)
+    asyncio.run(pool._run(job_id))
+    with db.SessionLocal() as session:
+        job = crud.get_job(session, job_id)
+        return job.status, job.attempts, job.error
+
+
+def _pool(error: Exception) -> jobs.JobWorkerPool:
+    async def handler(params, prepared):
+        raise error
+
+    return jobs.JobWorkerPool(handler, max_attempts=2, retry_backoff=0.0)
+
+
+def test_transient_error_requeues_until_attempts_run_out():
+    job_id = _job()
+    pool = _pool(HTTPException(status_code=503, detail="busy", headers={"Retry-After": "0"}))
+
+    assert _run(pool, job_id) == ("queued", 1, "busy")
+    assert pool._queue.get_nowait() == job_id
+    assert _run(pool, job_id) == ("failed", 2, "busy")
+
+
+def test_permanent_error_fails_at_once():
+    job_id = _job()
+    pool = _pool(HTTPException(status_code=400, detail="bad"))
+
+    assert _run(pool, job_id) == ("failed", 1, "bad")
@@ -0,0 +1,37 @@
+# tests/test_resilience.py
+"""
+CircuitBreaker: отменённая half-open проба не должна оставлять breaker
+открытым навсегда.
+
+    python -m pytest -q tests
+"""
+import asyncio
+
+from app import resilience
+
+
+def test_cancelled_probe_releases_breaker():
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    caller = resilience.ResilientCaller(timeout=5.0, max_retries=0, hedge=False, breaker=breaker)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        probe = asyncio.ensure_future(caller.call(hang))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+        return await caller.call(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == "closed"